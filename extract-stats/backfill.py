@@ -0,0 +1,162 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta, UTC
+
+
+# resumable backfills -------------------------------------------
+# A custom range is ingested in chunks of whole days. Before every chunk the orchestrator checks
+# how much time the Lambda has left and sizes the chunk from the throughput measured so far, so it
+# stops cleanly before the timeout. Progress is checkpointed in Mongo after every chunk:
+# {
+#     "_id": {"target": "daily_stats", "start": <date>, "end": <date>},
+#     "nextDay": <date>,             # first day not ingested yet, == end when done
+#     "lastCompletedDay": <date>,
+#     "docs": 1234, "seconds": 56.7, # totals over every chunk
+#     "docsPerSec": 21.8, "secondsPerDay": 4.2,
+#     "invocations": 3,
+#     "done": False,
+#     "updatedAt": <date>,
+# }
+# The next invocation, started by the Lambda itself or by whoever got the continuation event back,
+# resumes at nextDay.
+
+# time kept free at the end of every invocation for the checkpoint and the re-invoke
+margin_secs = float(os.getenv("BACKFILL_MARGIN_SECS", "30"))
+# chunk size before anything was measured, and its upper bound
+initial_chunk_days = int(os.getenv("BACKFILL_INITIAL_DAYS", "1"))
+max_chunk_days = int(os.getenv("BACKFILL_MAX_DAYS", "31"))
+# share of the remaining time a chunk may be planned to take, estimates are rough
+budget_share = float(os.getenv("BACKFILL_BUDGET_SHARE", "0.7"))
+# re-invoke the function asynchronously when out of time instead of only returning the continuation
+self_invoke = os.getenv("BACKFILL_SELF_INVOKE", "false").lower() == "true"
+# stops a backfill that makes no progress from invoking itself forever
+max_invocations = int(os.getenv("BACKFILL_MAX_INVOCATIONS", "50"))
+
+
+def remaining_seconds(context):
+    """
+    Seconds left in the invocation, unbounded when running outside Lambda (context None).
+    """
+    if context is None:
+        return float('inf')
+
+    return context.get_remaining_time_in_millis() / 1000
+
+
+def checkpoint_id(target_name, start_date, end_date):
+    return {'target': target_name, 'start': start_date, 'end': end_date}
+
+
+def load_checkpoint(checkpoints, target_name, start_date, end_date):
+    return checkpoints.find_one({'_id': checkpoint_id(target_name, start_date, end_date)}) or {}
+
+
+def save_checkpoint(checkpoints, target_name, start_date, end_date, checkpoint):
+    checkpoint = {**checkpoint, 'updatedAt': datetime.now(UTC)}
+    checkpoint.pop('_id', None)
+    checkpoints.replace_one(
+        {'_id': checkpoint_id(target_name, start_date, end_date)}, checkpoint, upsert=True
+    )
+
+
+def plan_chunk_days(seconds_per_day, budget):
+    """
+    Whole days that fit in budget seconds at the measured pace, 0 if not even one does.
+    """
+    if budget <= 0:
+        return 0
+
+    if seconds_per_day is None:
+        days = initial_chunk_days
+    else:
+        days = int(budget * budget_share // max(seconds_per_day, 1e-3))
+        if days == 0 and seconds_per_day <= budget:
+            days = 1
+
+    return min(days, max_chunk_days)
+
+
+def run_backfill(target, start_date, end_date, run_chunk, checkpoints, context=None, restart=False):
+    """
+    Ingest [start_date, end_date) (midnight UTC) into target chunk by chunk with
+    run_chunk(chunk_start, chunk_end) -> written docs, resuming from the checkpoint in checkpoints.
+    Stops when the range is done or the next chunk would not fit in the remaining time. restart
+    ignores the checkpoint and starts over at start_date.
+
+    Returns the checkpoint, its "done" says whether another invocation is needed.
+    """
+    checkpoint = {} if restart else load_checkpoint(checkpoints, target.name, start_date, end_date)
+    checkpoint.setdefault('nextDay', start_date)
+    checkpoint.setdefault('docs', 0)
+    checkpoint.setdefault('seconds', 0.0)
+    checkpoint['invocations'] = checkpoint.get('invocations', 0) + 1
+
+    # mongo hands dates back naive, they are always UTC
+    next_day = checkpoint['nextDay'].replace(tzinfo=start_date.tzinfo)
+
+    while next_day < end_date:
+        budget = remaining_seconds(context) - margin_secs
+        days = plan_chunk_days(checkpoint.get('secondsPerDay'), budget)
+        if days == 0:
+            print(f"Backfill out of time with {budget:.0f}s left, next day {next_day:%m/%d/%Y}")
+            break
+
+        chunk_start = next_day
+        chunk_end = min(chunk_start + timedelta(days=days), end_date)
+        started = time.perf_counter()
+        docs = run_chunk(chunk_start, chunk_end)
+        elapsed = time.perf_counter() - started
+
+        chunk_days = (chunk_end - chunk_start).days
+        checkpoint['docs'] += docs
+        checkpoint['seconds'] += elapsed
+        checkpoint['docsPerSec'] = checkpoint['docs'] / checkpoint['seconds'] if checkpoint['seconds'] else None
+        # the slowest recent day rules, a quiet week must not plan a chunk that overruns on a busy one
+        pace = elapsed / chunk_days
+        previous = checkpoint.get('secondsPerDay')
+        checkpoint['secondsPerDay'] = pace if previous is None else max(pace, (previous + pace) / 2)
+        checkpoint['lastCompletedDay'] = chunk_end - timedelta(days=1)
+        checkpoint['nextDay'] = next_day = chunk_end
+        save_checkpoint(checkpoints, target.name, start_date, end_date, checkpoint)
+
+        print(
+            f"Backfill chunk {chunk_start:%m/%d/%Y} - {chunk_end:%m/%d/%Y}: "
+            f"{docs} docs in {elapsed:.2f}s, {checkpoint['secondsPerDay']:.2f}s per day"
+        )
+
+    checkpoint['done'] = next_day >= end_date
+    save_checkpoint(checkpoints, target.name, start_date, end_date, checkpoint)
+
+    return checkpoint
+
+
+def continuation_event(event, invocation):
+    """
+    The event that resumes this backfill: the same range, counted as the next invocation.
+    """
+    return {**event, 'backfill': True, 'invocation': invocation + 1}
+
+
+def continue_backfill(event, context, invocation):
+    """
+    Start the next invocation asynchronously when BACKFILL_SELF_INVOKE is on (needs
+    lambda:InvokeFunction on itself), and return the continuation event either way.
+    """
+    continuation = continuation_event(event, invocation)
+    if invocation >= max_invocations:
+        print(f"Backfill gave up after {invocation} invocations, resume it with the continuation event")
+        return continuation
+
+    if self_invoke and context is not None:
+        # boto3 ships with the Lambda runtime, it is not a requirement of this package
+        import boto3
+
+        boto3.client('lambda').invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps(continuation).encode(),
+        )
+        print(f"Backfill re-invoked {context.function_name} as invocation {invocation + 1}")
+
+    return continuation
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+
+
+def parse_day(value):
+    """
+    MM/DD/YYYY -> midnight UTC datetime, same format as the Lambda event.
+    """
+    return datetime.strptime(value, '%m/%d/%Y').replace(tzinfo=timezone.utc)
+
+
+def to_millis(date):
+    return date.timestamp() * 1000
+
+
+def best_of(fn, repeat=3):
+    """
+    Call fn repeat times, return (fastest wall time in seconds, result of the last call).
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+
+    return best, result
+
+
+def stats_key(doc):
+    meta = doc['metaField']
+    return (doc['matchDay'], meta['civ_id'], meta['elo_bin'])
+
+
+def same_stats(left, right):
+    """
+    True when two lists of daily stats documents hold the same documents, ignoring the order the
+    pipeline returned them in and the _id insert_many may have added.
+    """
+    def canonical(docs):
+        return sorted(
+            ({k: v for k, v in doc.items() if k != '_id'} for doc in docs), key=stats_key
+        )
+
+    return canonical(left) == canonical(right)
+
+
+def stats_digest(docs):
+    """
+    Order-insensitive sha256 of a list of daily stats documents, so runs in separate processes can
+    check they produced the same output without shipping the documents around. Floats are rounded
+    since engines may sum durations in a different order.
+    """
+    def canonical(value):
+        if isinstance(value, float):
+            return round(value, 9)
+        if isinstance(value, dict):
+            return {key: canonical(item) for key, item in value.items() if key != '_id'}
+        return value
+
+    docs = sorted((canonical(doc) for doc in docs), key=stats_key)
+    return hashlib.sha256(json.dumps(docs, sort_keys=True, default=str).encode()).hexdigest()
@@ -0,0 +1,80 @@
+"""
+Compare the version 1 daily stats documents against their compact version 2 encoding
+(compact_schema.py): BSON bytes per document, storage and index size, then the time and bytes off
+the wire of reading the last N days, the version 2 read decoded back into version 1 documents.
+
+    cd extract-stats
+    MONGO_URI=mongodb://localhost:27017 METRICS_BYTES=true python -m benchmarks.compact_schema daily_stats [days]
+
+Copies the documents of the given daily stats collection into two scratch collections,
+bench_schema_v1 and bench_schema_v2, in the same database, the id tables of the second into
+SCHEMA_TABLES_STR. Run benchmarks.suite or benchmarks.synthetic + the Lambda first to have a
+source collection without Atlas.
+"""
+import sys
+from datetime import timedelta
+
+import bson
+
+from benchmarks.common import best_of, same_stats
+from benchmarks.timeseries_layout import copy_into, sizes
+from civs_stats import STATS_KEY
+from compact_schema import COMPACT_KEY, schema_tables_str, encode_docs, read_stats
+from connection import get_db
+from major_gods import load_god_names
+from metrics import received_bytes
+
+
+def read_bytes(fn):
+    """
+    (result of fn, bytes the driver received while running it)
+    """
+    before = received_bytes()
+    result = fn()
+    return result, received_bytes() - before
+
+
+def main(source, days=30, repeat=5):
+    db = get_db()
+    docs = list(db[source].find({}, {'_id': 0}).sort([('matchDay', 1)]))
+    if not docs:
+        sys.exit(f"{source} is empty")
+
+    v1 = db['bench_schema_v1']
+    v1.drop()
+    v1.create_index(STATS_KEY)
+    copy_into(v1, docs)
+
+    tables = db[schema_tables_str]
+    v2 = db['bench_schema_v2']
+    v2.drop()
+    tables.delete_one({'_id': v2.name})
+    v2.create_index(COMPACT_KEY)
+    encoded = list(encode_docs(docs, tables, v2.name, load_god_names(db['major_gods'])))
+    copy_into(v2, encoded)
+
+    print(f"{len(docs)} documents from {source}")
+    print(f"{'schema':<7} {'bytes/doc':>10} {'storage':>12} {'indexes':>12}")
+    for name, collection, written in (('v1', v1, docs), ('v2', v2, encoded)):
+        average = sum(len(bson.encode(doc)) for doc in written) / len(written)
+        storage, indexes = sizes(db, collection.name)
+        print(f"{name:<7} {average:>10.0f} {storage / 1024:>8.0f} KiB {indexes / 1024:>8.0f} KiB")
+
+    since = docs[-1]['matchDay'] - timedelta(days=days - 1)
+    reads = {
+        'v1': lambda: list(v1.find({'matchDay': {'$gte': since}}, {'_id': 0})),
+        'v2': lambda: list(read_stats(v2, tables, {'matchDay': {'$gte': since}})),
+    }
+
+    print(f"last {days} days")
+    print(f"{'schema':<7} {'read':>9} {'received':>12}")
+    results = {}
+    for name, read in reads.items():
+        secs, _ = best_of(read, repeat)
+        results[name], received = read_bytes(read)
+        print(f"{name:<7} {secs * 1000:>7.1f}ms {received / 1024:>8.0f} KiB")
+    print(f"identical decoded output: {same_stats(results['v1'], results['v2'])}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *map(int, sys.argv[2:3]))
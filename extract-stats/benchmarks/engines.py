@@ -0,0 +1,34 @@
+"""
+Compare the server stats pipeline against the client side NumPy engine over the same range of
+matches, checking both produce the same documents.
+
+    cd extract-stats
+    python -m benchmarks.engines 09/01/2024 09/08/2024 [repeat]
+
+Uses the same MONGO_USER / MONGO_PASS / MONGO_URL env vars as the Lambda.
+"""
+import sys
+
+import civs_stats
+from benchmarks.common import parse_day, best_of, same_stats
+from major_gods import load_god_names
+
+
+def main(start, end, repeat=3):
+    start_date = parse_day(start)
+    end_date = parse_day(end)
+    god_names = load_god_names(civs_stats.major_gods)
+
+    results = {}
+    for engine in ('server', 'numpy'):
+        secs, docs = best_of(
+            lambda: list(civs_stats.partition_stats(start_date, end_date, god_names, engine=engine)), repeat
+        )
+        results[engine] = docs
+        print(f"{engine:>6}: {secs:.3f}s, {len(docs)} docs")
+
+    print(f"identical output: {same_stats(results['server'], results['numpy'])}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2], *map(int, sys.argv[3:4]))
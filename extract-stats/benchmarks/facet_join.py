@@ -0,0 +1,44 @@
+"""
+Compare the $facet + $filter stats pipeline against the keyed $group pipeline over growing
+ranges starting at the same day. The facet pipeline's time grows with the square of the number
+of groups in the range, the keyed one linearly. Each range also checks both produce the same
+documents.
+
+    cd extract-stats
+    python -m benchmarks.facet_join 09/01/2024 [days ...]
+
+Uses the same MONGO_USER / MONGO_PASS / MONGO_URL env vars as the Lambda.
+"""
+import sys
+from datetime import timedelta
+
+import civs_stats
+from benchmarks.common import parse_day, best_of, same_stats
+from major_gods import load_god_names
+
+
+def main(start, lengths=(1, 7, 14, 28), repeat=3):
+    start_date = parse_day(start)
+    god_names = load_god_names(civs_stats.major_gods)
+
+    print(f"{'days':>5} {'docs':>7} {'facet':>9} {'keyed':>9} {'facet/doc':>11} {'keyed/doc':>11}  identical")
+    for days in lengths:
+        end_date = start_date + timedelta(days=days)
+        results = {}
+        for variant in ('facet', 'keyed'):
+            results[variant] = best_of(
+                lambda: list(civs_stats.partition_stats(start_date, end_date, god_names, variant=variant)),
+                repeat,
+            )
+
+        (facet_secs, facet_docs), (keyed_secs, keyed_docs) = results['facet'], results['keyed']
+        docs = max(len(keyed_docs), 1)
+        print(
+            f"{days:>5} {len(keyed_docs):>7} {facet_secs:>8.3f}s {keyed_secs:>8.3f}s "
+            f"{facet_secs / docs * 1e3:>9.3f}ms {keyed_secs / docs * 1e3:>9.3f}ms  "
+            f"{same_stats(facet_docs, keyed_docs)}"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], [int(days) for days in sys.argv[2:]] or (1, 7, 14, 28))
@@ -0,0 +1,60 @@
+"""
+Measure the multi mode stats of one day: every game mode's projected matches read in a single
+scan and split client side (game_modes.mode_stats) against one scan per mode, the cost of adding
+modes as N separate runs. Reports wall time and bytes off the wire of each, then checks both
+produce the same documents.
+
+    cd extract-stats
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.synthetic 300000 09/01/2024 1
+    MONGO_URI=mongodb://localhost:27017 METRICS_BYTES=true python -m benchmarks.game_modes 09/01/2024 [repeat] [mode ...]
+
+Modes default to the ones the leaderboard extractor tracks (game_modes.LEADERBOARD_MODES). Only
+reads matches, nothing is written.
+"""
+import sys
+from datetime import timedelta
+
+from benchmarks.common import parse_day, to_millis, best_of, same_stats
+from columnar_stats import projected_matches_pipeline
+from connection import get_collection
+from game_modes import LEADERBOARD_MODES, mode_stats
+from major_gods import load_god_names
+from metrics import received_bytes
+
+
+def single_scan(matches, start_date, end_date, god_names, modes):
+    pipeline = projected_matches_pipeline(to_millis(start_date), to_millis(end_date), modes)
+    return mode_stats(matches.aggregate(pipeline), god_names, modes)
+
+
+def separate_scans(matches, start_date, end_date, god_names, modes):
+    stats = {}
+    for mode in modes:
+        pipeline = projected_matches_pipeline(to_millis(start_date), to_millis(end_date), mode)
+        stats.update(mode_stats(matches.aggregate(pipeline), god_names, [mode]))
+    return stats
+
+
+def main(day, repeat=3, modes=LEADERBOARD_MODES):
+    start_date = parse_day(day)
+    end_date = start_date + timedelta(days=1)
+    matches = get_collection('matches')
+    god_names = load_god_names(get_collection('major_gods'))
+
+    print(f"{len(modes)} modes, {day}")
+    print(f"{'run':<9} {'scans':>5} {'wall':>9} {'received':>12}")
+    results = {}
+    for name, run, scans in (('single', single_scan, 1), ('separate', separate_scans, len(modes))):
+        secs, _ = best_of(lambda: run(matches, start_date, end_date, god_names, modes), repeat)
+        before = received_bytes()
+        results[name] = run(matches, start_date, end_date, god_names, modes)
+        received = received_bytes() - before
+        print(f"{name:<9} {scans:>5} {secs * 1000:>7.1f}ms {received / 1024:>8.0f} KiB")
+
+    for mode in modes:
+        single, separate = results['single'][mode], results['separate'][mode]
+        print(f"{mode:<26} {len(single):>6} documents  identical: {same_stats(single, separate)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *map(int, sys.argv[2:3]), *[sys.argv[3:]] if sys.argv[3:] else [])
@@ -0,0 +1,50 @@
+"""
+Compare civ_stats_pipeline joining major_gods per document ($lookup) against the inlined god name
+map over the same range of matches.
+
+    cd extract-stats
+    python -m benchmarks.god_lookup 09/01/2024 09/08/2024 [repeat]
+
+Uses the same MONGO_USER / MONGO_PASS / MONGO_URL env vars as the Lambda.
+"""
+import sys
+
+import civs_stats
+from benchmarks.common import parse_day, to_millis, best_of, same_stats
+from major_gods import load_god_names
+
+
+def count_join_rows(start_date, end_date):
+    """
+    Number of player rows that reach the opponent god join, ie how many times $lookup runs.
+    """
+    pipeline = civs_stats.civ_stats_pipeline(start_date, end_date)
+    join = next(i for i, stage in enumerate(pipeline) if '$lookup' in stage)
+    result = list(civs_stats.collection.aggregate(pipeline[:join] + [{'$count': 'rows'}]))
+
+    return result[0]['rows'] if result else 0
+
+
+def main(start, end, repeat=3):
+    start_date = to_millis(parse_day(start))
+    end_date = to_millis(parse_day(end))
+    god_names = load_god_names(civs_stats.major_gods)
+
+    def run(names):
+        pipeline = civs_stats.civ_stats_pipeline(start_date, end_date, names)
+        return list(civs_stats.collection.aggregate(pipeline))
+
+    lookup_secs, lookup_docs = best_of(lambda: run(None), repeat)
+    inline_secs, inline_docs = best_of(lambda: run(god_names), repeat)
+    rows = count_join_rows(start_date, end_date)
+
+    print(f"player rows joined:  {rows}")
+    print(f"$lookup pipeline:    {lookup_secs:.3f}s")
+    print(f"inlined god names:   {inline_secs:.3f}s")
+    if rows:
+        print(f"saved per row:       {(lookup_secs - inline_secs) / rows * 1e6:.2f}us")
+    print(f"identical output:    {same_stats(lookup_docs, inline_docs)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2], *map(int, sys.argv[3:4]))
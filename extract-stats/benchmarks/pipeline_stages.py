@@ -0,0 +1,56 @@
+"""
+Time civ_stats_pipeline and the minimal pipeline_builder pipeline stage by stage on the same
+range. Every prefix of each pipeline is run with a trailing $count, so each line shows the
+cumulative time up to that stage, the time the stage itself added and how many documents it
+passed on.
+
+    cd extract-stats
+    python -m benchmarks.pipeline_stages 09/01/2024 09/08/2024 [repeat]
+
+Uses the same MONGO_USER / MONGO_PASS / MONGO_URL env vars as the Lambda.
+"""
+import sys
+
+import civs_stats
+from benchmarks.common import parse_day, to_millis, best_of, same_stats
+from major_gods import load_god_names
+from pipeline_builder import build_stages, build_pipeline
+
+
+def time_steps(steps, repeat):
+    """
+    steps: list of (name, stages). Prints one line per step and returns the total time.
+    """
+    pipeline = []
+    previous = 0.0
+    for index, (name, stages) in enumerate(steps, start=1):
+        pipeline += stages
+        secs, result = best_of(
+            lambda: list(civs_stats.collection.aggregate(pipeline + [{'$count': 'docs'}])), repeat
+        )
+        docs = result[0]['docs'] if result else 0
+        print(f"  {index:>3} {name:<14} {secs:>8.3f}s {secs - previous:>+8.3f}s {docs:>10} docs")
+        previous = secs
+
+    return previous
+
+
+def main(start, end, repeat=3):
+    start_date = to_millis(parse_day(start))
+    end_date = to_millis(parse_day(end))
+    god_names = load_god_names(civs_stats.major_gods)
+
+    print("civ_stats_pipeline")
+    legacy = civs_stats.civ_stats_pipeline(start_date, end_date, god_names)
+    legacy_secs = time_steps([(next(iter(stage)), [stage]) for stage in legacy], repeat)
+
+    print("pipeline_builder")
+    minimal_secs = time_steps(build_stages(start_date, end_date, god_names), repeat)
+
+    legacy_docs = list(civs_stats.collection.aggregate(legacy))
+    minimal_docs = list(civs_stats.collection.aggregate(build_pipeline(start_date, end_date, god_names)))
+    print(f"total: {legacy_secs:.3f}s -> {minimal_secs:.3f}s, identical output: {same_stats(legacy_docs, minimal_docs)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2], *map(int, sys.argv[3:4]))
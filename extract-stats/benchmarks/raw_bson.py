@@ -0,0 +1,69 @@
+"""
+Measure the raw BSON passthrough of the server engine on one day of matches: the stats documents
+read as dicts and inserted (decoded, then encoded again) against read as RawBSONDocuments and
+inserted from the server's buffers, then the decode / encode work alone on those documents.
+
+    cd extract-stats
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.synthetic 300000 09/01/2024 1
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.raw_bson 09/01/2024 [repeat]
+
+Writes into the scratch collections bench_raw_dict and bench_raw_raw of the same database.
+"""
+import sys
+from datetime import timedelta
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+import civs_stats
+from benchmarks.common import parse_day, best_of, stats_digest
+from major_gods import load_god_names
+
+
+def run(target, start_date, end_date, god_names, raw_bson):
+    target.drop()
+    metrics = {}
+    docs = civs_stats.partition_stats(
+        start_date, end_date, god_names, engine='server', metrics=metrics, raw_bson=raw_bson
+    )
+    civs_stats.write_batches(target, docs, write_mode='insert', metrics=metrics)
+    return metrics
+
+
+def main(day, repeat=5):
+    start_date = parse_day(day)
+    end_date = start_date + timedelta(days=1)
+    god_names = load_god_names(civs_stats.major_gods)
+
+    print(f"{'mode':<5} {'wall':>9} {'drain':>9} {'insert':>9} {'docs':>6}")
+    digests = {}
+    for mode, raw_bson in (('dict', False), ('raw', True)):
+        target = civs_stats.db[f"bench_raw_{mode}"]
+        secs, metrics = best_of(lambda: run(target, start_date, end_date, god_names, raw_bson), repeat)
+        digests[mode] = stats_digest(target.find({}, {'_id': 0}))
+        print(
+            f"{mode:<5} {secs * 1000:>7.1f}ms {metrics.get('drain', 0) * 1000:>7.1f}ms "
+            f"{metrics.get('insert', 0) * 1000:>7.1f}ms {metrics.get('docs_written', 0):>6}"
+        )
+    print(f"identical output: {digests['dict'] == digests['raw']}")
+
+    # the codec work the passthrough skips, on the day's own documents
+    buffers = [doc.raw for doc in civs_stats.partition_stats(
+        start_date, end_date, god_names, engine='server', raw_bson=True
+    )]
+    if not buffers:
+        sys.exit(f"no stats documents for {day}, load synthetic matches first")
+
+    decode_secs, decoded = best_of(lambda: [bson.decode(buffer) for buffer in buffers], repeat)
+    encode_secs, _ = best_of(lambda: [bson.encode(doc) for doc in decoded], repeat)
+    wrap_secs, _ = best_of(lambda: [RawBSONDocument(buffer) for buffer in buffers], repeat)
+
+    size = sum(len(buffer) for buffer in buffers)
+    saved = decode_secs + encode_secs - wrap_secs
+    print(f"{len(buffers)} documents, {size / 1024:.0f} KiB of BSON")
+    print(f"decode {decode_secs * 1000:.2f}ms + encode {encode_secs * 1000:.2f}ms vs raw wrap {wrap_secs * 1000:.2f}ms")
+    print(f"saved per day: {saved * 1000:.2f}ms ({saved / len(buffers) * 1e6:.1f}us per document)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *map(int, sys.argv[2:3]))
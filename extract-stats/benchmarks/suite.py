@@ -0,0 +1,104 @@
+"""
+End to end benchmark of every engine / pipeline variant on synthetic matches. Fills a scratch
+database with benchmarks.synthetic, then runs create_daily_stats once per variant in its own
+process (see benchmarks.variant) and reports wall time, throughput, peak RSS and whether every
+variant wrote the same documents. The synthetic matches include some without mapData or
+matchDuration, so the comparison also covers how each engine skips null maps and durations.
+
+    cd extract-stats
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.suite 100000 [start] [days] [seed]
+
+Without MONGO_URI a throwaway mongod is started in-process with pymongo_inmemory
+(`pip install pymongo_inmemory`, it downloads the mongod binary on first use).
+"""
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+from pymongo import MongoClient
+
+from benchmarks.common import parse_day, to_millis
+from benchmarks.synthetic import load
+
+# (engine, pipeline), the pipeline only matters to the server engine
+VARIANTS = [
+    ('server', 'minimal'),
+    ('server', 'keyed'),
+    ('server', 'facet'),
+    ('numpy', 'minimal'),
+]
+
+
+@contextlib.contextmanager
+def mongo_uri():
+    """
+    MONGO_URI when set, otherwise the url of an in-process pymongo_inmemory mongod.
+    """
+    uri = os.getenv("MONGO_URI")
+    if uri:
+        if uri.startswith("mongodb+srv://"):
+            sys.exit("refusing to overwrite a mongodb+srv:// cluster, point MONGO_URI at a local mongod")
+        yield uri
+        return
+
+    try:
+        from pymongo_inmemory import Mongod
+        from pymongo_inmemory.context import Context
+    except ImportError:
+        sys.exit("set MONGO_URI to a local mongod or `pip install pymongo_inmemory`")
+
+    with Mongod(Context()) as mongod:
+        yield mongod.connection_string
+
+
+def run_variant(uri, engine, variant, start, end):
+    """
+    Run benchmarks.variant in a fresh interpreter and return its JSON result line.
+    """
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.variant', engine, variant, start, end],
+        env={**os.environ, 'MONGO_URI': uri},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(count, start='09/01/2024', days=7, seed=0):
+    start_date = parse_day(start)
+    end_date = start_date + timedelta(days=days)
+    end = f"{end_date:%m/%d/%Y}"
+
+    with mongo_uri() as uri:
+        db = MongoClient(uri)["test"]
+
+        started = time.perf_counter()
+        load(db, count, start_date, days, seed)
+        print(f"generated {count} matches over {days} days in {time.perf_counter() - started:.1f}s")
+
+        # the stats only read 1v1 matches, throughput is measured against those
+        matches = db.matches.count_documents({
+            'gameMode': '1V1_SUPREMACY',
+            'matchDate': {'$gte': to_millis(start_date), '$lt': to_millis(end_date)},
+        })
+
+        print(f"{'variant':<16} {'seconds':>9} {'docs':>7} {'matches/s':>11} {'peak rss':>10}  identical")
+        reference = None
+        for engine, variant in VARIANTS:
+            result = run_variant(uri, engine, variant, start, end)
+            reference = reference or result['digest']
+            name = engine if engine == 'numpy' else f"{engine}/{variant}"
+            print(
+                f"{name:<16} {result['seconds']:>8.2f}s {result['docs']:>7} "
+                f"{matches / result['seconds']:>11.0f} {result['peak_rss_mb']:>7.0f} MB  "
+                f"{result['digest'] == reference}"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]), *sys.argv[2:3], *map(int, sys.argv[3:5]))
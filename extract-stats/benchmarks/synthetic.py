@@ -0,0 +1,181 @@
+"""
+Fill a scratch database with synthetic `matches` plus the `major_gods` fixture, shaped like the
+documents the match extractor writes, so the stats extractor can be measured without Atlas.
+
+    cd extract-stats
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.synthetic 100000 09/01/2024 [days] [seed]
+
+Drops and refills the matches and major_gods collections of the "test" database. Refuses
+mongodb+srv:// urls so it never overwrites an Atlas cluster.
+"""
+import os
+import sys
+import time
+from datetime import timedelta
+
+import numpy as np
+from pymongo import MongoClient
+
+from benchmarks.common import parse_day, to_millis
+from query_plan import MATCH_INDEX
+
+GODS = {
+    1: 'Zeus', 2: 'Hades', 3: 'Poseidon',
+    4: 'Ra', 5: 'Isis', 6: 'Set',
+    7: 'Thor', 8: 'Odin', 9: 'Loki',
+    10: 'Kronos', 11: 'Oranos', 12: 'Gaia',
+    13: 'Freyr',
+}
+
+# civilization ids that are not major gods, the pipelines drop them
+OTHER_CIVS = [0, 99]
+
+MAPS = [
+    'Acropolis', 'Air', 'Alfheim', 'Anatolia', 'Arena', 'Black Sea', 'Blue Lagoon', 'Elysium',
+    'Erebus', 'Ghost Lake', 'Giza', 'Gold Rush', 'Highland', 'Ironwood', 'Jotunheim', 'Kerlaugar',
+    'Marsh', 'Mediterranean', 'Midgard', 'Mirage', 'Nomad', 'Oasis', 'Savannah', 'Sea of Worms',
+    'Tundra', 'Valley of Kings', 'Watering Hole',
+]
+
+# share of matches per game mode, team modes have two players per side
+GAME_MODES = [('1V1_SUPREMACY', 0.8, 1), ('2V2_SUPREMACY', 0.15, 2), ('1V1_DEATHMATCH', 0.05, 1)]
+
+CHUNK = 10_000
+
+
+def major_gods_fixture():
+    return [{'id': god_id, 'name': name} for god_id, name in GODS.items()]
+
+
+def civ_strength(rng):
+    """
+    A small fixed edge per civ, so win rates differ between matchups like on the real ladder.
+    """
+    civ_ids = list(GODS) + OTHER_CIVS
+    return dict(zip(civ_ids, rng.normal(0, 40, len(civ_ids)).tolist()))
+
+
+def generate(count, start_date, days, seed=0):
+    """
+    Yield count synthetic match documents spread uniformly over [start_date, start_date + days).
+    Ratings come from a pool of count // 20 players, outcomes follow the elo expectation plus each
+    civ's edge. A few matches have no duration, no map or a civ that is not a major god.
+    """
+    rng = np.random.default_rng(seed)
+    strength = civ_strength(rng)
+    civ_ids = np.array(list(GODS) + OTHER_CIVS)
+    civ_weights = np.array([1.0] * len(GODS) + [0.02] * len(OTHER_CIVS))
+    civ_weights /= civ_weights.sum()
+
+    players = max(count // 20, 100)
+    ratings = np.clip(rng.normal(1100, 300, players), 100, 2600).round()
+
+    start_ms = int(to_millis(start_date))
+    span_ms = days * 24 * 60 * 60 * 1000
+    mode_names = [name for name, _, _ in GAME_MODES]
+    mode_weights = [weight for _, weight, _ in GAME_MODES]
+    team_sizes = {name: size for name, _, size in GAME_MODES}
+    slots = 2 * max(team_sizes.values())
+
+    for chunk_start in range(0, count, CHUNK):
+        size = min(CHUNK, count - chunk_start)
+        match_dates = rng.integers(start_ms, start_ms + span_ms, size)
+        durations = rng.lognormal(np.log(1200), 0.45, size).round().astype(np.int64)
+        no_duration = rng.random(size) < 0.005
+        map_index = rng.integers(0, len(MAPS), size)
+        # the pipelines leave these out of the map counts (no null map cell), like the numpy engine
+        no_map = rng.random(size) < 0.005
+        modes = rng.choice(len(mode_names), size, p=mode_weights)
+        rolls = rng.random(size)
+
+        # up to four distinct players per match: a random first one, then random positive steps
+        # that add up to less than the pool size
+        steps = rng.integers(1, players // 4, (size, slots - 1))
+        first = rng.integers(0, players, (size, 1))
+        offsets = np.concatenate([np.zeros((size, 1), np.int64), steps.cumsum(axis=1)], axis=1)
+        match_players = (first + offsets) % players
+        match_civs = rng.choice(civ_ids, (size, slots), p=civ_weights)
+
+        for i in range(size):
+            mode = mode_names[modes[i]]
+            team_size = team_sizes[mode]
+            profile_ids = match_players[i, :2 * team_size]
+            civs = match_civs[i, :2 * team_size].tolist()
+
+            team_ratings = [
+                ratings[profile_ids[team * team_size:(team + 1) * team_size]].mean() for team in (0, 1)
+            ]
+            edge = (team_ratings[0] - team_ratings[1]) + strength[civs[0]] - strength[civs[team_size]]
+            team0_wins = rolls[i] < 1 / (1 + 10 ** (-edge / 400))
+
+            history = {}
+            for slot, profile_id in enumerate(profile_ids.tolist()):
+                team = slot // team_size
+                won = team0_wins == (team == 0)
+                old_rating = int(ratings[profile_id])
+                new_rating = old_rating + (16 if won else -16)
+                ratings[profile_id] = new_rating
+                history[str(profile_id)] = [{
+                    'profile_id': profile_id,
+                    'civilization_id': civs[slot],
+                    'teamid': team,
+                    'outcome': 1 if won else 0,
+                    'oldrating': old_rating,
+                    'newrating': new_rating,
+                }]
+
+            match = {
+                'matchId': chunk_start + i,
+                'gameMode': mode,
+                'matchDate': int(match_dates[i]),
+                'matchHistoryMap': history,
+            }
+            if not no_duration[i]:
+                match['matchDuration'] = int(durations[i])
+            if not no_map[i]:
+                match['mapData'] = {'name': MAPS[map_index[i]]}
+
+            yield match
+
+
+def load(db, count, start_date, days, seed=0, batch_size=CHUNK):
+    """
+    Replace db's matches and major_gods collections with count synthetic matches and the god
+    fixture, then create the index the stats $match uses. Returns the number of inserted matches.
+    """
+    db.matches.drop()
+    db.major_gods.drop()
+    db.major_gods.insert_many(major_gods_fixture())
+
+    inserted = 0
+    batch = []
+    for match in generate(count, start_date, days, seed):
+        batch.append(match)
+        if len(batch) == batch_size:
+            inserted += len(db.matches.insert_many(batch, ordered=False).inserted_ids)
+            batch = []
+    if batch:
+        inserted += len(db.matches.insert_many(batch, ordered=False).inserted_ids)
+
+    db.matches.create_index(MATCH_INDEX)
+    return inserted
+
+
+def main(count, start, days=7, seed=0):
+    uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+    if uri.startswith("mongodb+srv://"):
+        sys.exit("refusing to overwrite a mongodb+srv:// cluster, point MONGO_URI at a local mongod")
+
+    start_date = parse_day(start)
+    started = time.perf_counter()
+    db = MongoClient(uri)["test"]
+    inserted = load(db, count, start_date, days, seed)
+    elapsed = time.perf_counter() - started
+    end_date = start_date + timedelta(days=days)
+    mapless = db.matches.count_documents({'mapData': {'$exists': False}})
+    print(f"{inserted} matches ({mapless} without mapData) from {start_date:%m/%d/%Y} to {end_date:%m/%d/%Y} "
+          f"in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]), sys.argv[2], *map(int, sys.argv[3:5]))
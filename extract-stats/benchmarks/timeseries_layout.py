@@ -0,0 +1,92 @@
+"""
+Compare the current daily stats layout (a plain collection with the STATS_KEY index) against a
+time series collection holding the same documents: storage and index size, then the read latency
+of "civ X over the last N days" for a few N, as a find and as a $group of the window's totals.
+
+    cd extract-stats
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.timeseries_layout daily_stats [days ...]
+
+Copies the documents of the given daily stats collection into two scratch collections,
+bench_layout_plain and bench_layout_timeseries, in the same database. Run benchmarks.suite or
+benchmarks.synthetic + the Lambda first to have a source collection without Atlas.
+"""
+import sys
+from datetime import timedelta
+
+from benchmarks.common import best_of, stats_key
+from civs_stats import STATS_KEY
+from connection import get_db
+from timeseries import ensure_timeseries, bucket_key
+
+
+def copy_into(target, docs):
+    for start in range(0, len(docs), 1000):
+        target.insert_many([dict(doc) for doc in docs[start:start + 1000]], ordered=False)
+
+
+def sizes(db, name):
+    stats = db.command('collStats', name)
+    return stats.get('storageSize', 0), stats.get('totalIndexSize', 0)
+
+
+def window_queries(collection, civ_id, since):
+    match = {'metaField.civ_id': civ_id, 'matchDay': {'$gte': since}}
+    # (query, sort key of its results for comparing the layouts)
+    return {
+        'find': (lambda: list(collection.find(match, {'_id': 0})), stats_key),
+        'totals': (lambda: list(collection.aggregate([
+            {'$match': match},
+            {
+                '$group': {
+                    '_id': '$metaField.elo_bin',
+                    'totalResults': {'$sum': '$totalResults'},
+                    'totalWins': {'$sum': '$totalWins'},
+                }
+            },
+        ])), lambda row: row['_id']),
+    }
+
+
+def main(source, windows=(7, 30, 90), repeat=5):
+    db = get_db()
+    docs = list(db[source].find({}, {'_id': 0}).sort([('matchDay', 1)]))
+    if not docs:
+        sys.exit(f"{source} is empty")
+
+    plain = db['bench_layout_plain']
+    plain.drop()
+    plain.create_index(STATS_KEY)
+    copy_into(plain, docs)
+
+    db['bench_layout_timeseries'].drop()
+    timeseries = ensure_timeseries(db, 'bench_layout_timeseries', ttl_days=0)
+    copy_into(timeseries, sorted(docs, key=bucket_key))
+
+    print(f"{len(docs)} documents from {source}")
+    print(f"{'layout':<12} {'storage':>12} {'indexes':>12}")
+    for name, collection in (('plain', plain), ('timeseries', timeseries)):
+        storage, indexes = sizes(db, collection.name)
+        print(f"{name:<12} {storage / 1024:>9.0f} KiB {indexes / 1024:>9.0f} KiB")
+
+    # the busiest civ, over windows ending at the last ingested day
+    civ_id = max(
+        {doc['metaField']['civ_id'] for doc in docs},
+        key=lambda civ: sum(doc['totalResults'] for doc in docs if doc['metaField']['civ_id'] == civ),
+    )
+    last_day = docs[-1]['matchDay']
+
+    print(f"civ {civ_id}, windows ending {last_day:%m/%d/%Y}")
+    print(f"{'days':>5} {'query':<7} {'plain':>9} {'timeseries':>11}  identical")
+    for days in windows:
+        since = last_day - timedelta(days=days - 1)
+        plain_queries = window_queries(plain, civ_id, since)
+        timeseries_queries = window_queries(timeseries, civ_id, since)
+        for query, (run_plain, key) in plain_queries.items():
+            plain_secs, plain_result = best_of(run_plain, repeat)
+            timeseries_secs, timeseries_result = best_of(timeseries_queries[query][0], repeat)
+            same = sorted(plain_result, key=key) == sorted(timeseries_result, key=key)
+            print(f"{days:>5} {query:<7} {plain_secs * 1000:>7.1f}ms {timeseries_secs * 1000:>9.1f}ms  {same}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *[tuple(map(int, sys.argv[2:]))] if sys.argv[2:] else [])
@@ -0,0 +1,45 @@
+"""
+Run create_daily_stats once for a single engine / pipeline variant into a scratch collection and
+print one JSON line with its wall time, peak RSS and a digest of the documents it wrote. Meant to
+be spawned by benchmarks.suite, one process per variant, so peak RSS is not shared between them.
+
+    cd extract-stats
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.variant numpy minimal 09/01/2024 09/08/2024
+"""
+import json
+import resource
+import sys
+import time
+
+from benchmarks.common import parse_day, stats_digest
+
+
+def main(engine, variant, start, end):
+    started = time.perf_counter()
+    import civs_stats
+    imported = time.perf_counter() - started
+
+    target = civs_stats.db[f"bench_{engine}_{variant}"]
+    target.drop()
+
+    started = time.perf_counter()
+    count = civs_stats.create_daily_stats(
+        target, True, parse_day(start), parse_day(end), force=True, engine=engine, variant=variant,
+        write_mode='upsert', rollups=False,
+    )
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        'engine': engine,
+        'pipeline': variant,
+        'docs': count,
+        'seconds': elapsed,
+        'import_seconds': imported,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'digest': stats_digest(target.find({}, {'_id': 0})),
+    }))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:5])
@@ -0,0 +1,60 @@
+"""
+Time the win rate fields of win_rates.py on full matrices: every elo bin's civ x civ matchups and
+civ x map cells at once with NumPy, against the same Wilson interval computed one cell at a time
+in Python. Needs no mongo, the counts are random.
+
+    cd extract-stats
+    python -m benchmarks.win_rates [days] [repeat]
+
+days multiplies the matrices, ie a whole month of daily cells in one call.
+"""
+import math
+import sys
+
+import numpy as np
+
+from benchmarks.common import best_of
+from benchmarks.synthetic import GODS, MAPS
+from elo_bins import ELO_BINS
+from win_rates import win_rate_arrays, win_rate_z, win_rate_prior
+
+
+def per_cell(wins, totals):
+    """
+    The same fields one cell at a time, what readers computing them in a loop pay.
+    """
+    z2 = win_rate_z * win_rate_z
+    rows = []
+    for won, total in zip(wins.ravel().tolist(), totals.ravel().tolist()):
+        if not total:
+            rows.append((None, None, None, None, False))
+            continue
+        rate = won / total
+        center = (rate + z2 / total / 2) / (1 + z2 / total)
+        half = win_rate_z / (1 + z2 / total) * math.sqrt(rate * (1 - rate) / total + z2 / total / total / 4)
+        low, high = center - half, center + half
+        smoothed = (won + win_rate_prior / 2) / (total + win_rate_prior)
+        rows.append((rate, low, high, smoothed, low > 0.5 or high < 0.5))
+    return rows
+
+
+def main(days=1, repeat=5):
+    rng = np.random.default_rng(0)
+    shapes = {
+        'civ x civ': (days, len(ELO_BINS), len(GODS), len(GODS)),
+        'civ x map': (days, len(ELO_BINS), len(GODS), len(MAPS)),
+    }
+
+    print(f"{'cells':<10} {'count':>8} {'numpy':>10} {'python':>10}  same significant")
+    for name, shape in shapes.items():
+        totals = rng.poisson(40, shape)
+        wins = rng.binomial(totals, rng.uniform(0.4, 0.6, shape))
+
+        numpy_secs, arrays = best_of(lambda: win_rate_arrays(wins, totals), repeat)
+        python_secs, rows = best_of(lambda: per_cell(wins, totals), repeat)
+        same = arrays['significant'].ravel().tolist() == [row[4] for row in rows]
+        print(f"{name:<10} {totals.size:>8} {numpy_secs * 1000:>8.2f}ms {python_secs * 1000:>8.2f}ms  {same}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
@@ -1,22 +1,198 @@
+import time
+import_started = time.perf_counter()
+
 import os
-from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import ReplaceOne
 from datetime import datetime, timedelta, timezone, UTC
+from elo_bins import ELO_BIN_LABELS
+from columnar_stats import projected_matches_pipeline, civ_stats_columnar
+from connection import get_client, get_db, get_collection, connect_seconds
+from major_gods import load_god_names, god_name_expr
+from query_plan import log_query_plan, MATCH_INDEX
+from pipeline_builder import build_pipeline, group_stages, output_stage
+from watermarks import day_range, completed_days, pending_ranges, pending_ranges_any, mark_complete, dirty_days
+from rollups import update_rollups
+from backfill import run_backfill, continue_backfill
+from timeseries import ensure_timeseries, bucket_key, supports_deletes
+from matchup_matrix import update_matrices
+from incremental import run_incremental, has_incremental_state
+from file_source import file_matches
+from player_results import (
+    player_results_str, sync_player_results, flatten_matches, sync_results, results_pipeline, RESULTS_INDEX
+)
+from range_query import range_stats, update_cache
+from game_modes import BASE_MODE, stats_modes, mode_target_name, mode_stats
+from win_rates import with_win_rates
+from compact_schema import SCHEMA_VERSION, COMPACT_KEY, schema_tables_str, encode_docs, compact_filter
+from metrics import record, span, emit, received_bytes, start_memory, record_memory, record_rates
 
-# auth
-username = os.getenv("MONGO_USER")
-password = os.getenv("MONGO_PASS")
-mongo_url = os.getenv("MONGO_URL")
+# collections, the mongo client itself lives in connection.py and is created on first use
 target_str = os.getenv("TARGET_STR")
+watermark_str = os.getenv("WATERMARK_STR", "stats_watermarks")
+rollup_str = os.getenv("ROLLUP_STR") # defaults to <TARGET_STR>_rollups
+checkpoint_str = os.getenv("CHECKPOINT_STR", "stats_backfills")
+matrix_str = os.getenv("MATRIX_STR") # defaults to <TARGET_STR>_matrices
+
+# module attributes that used to be created at import, resolved lazily for the benchmarks
+LAZY_COLLECTIONS = {
+    'collection': 'matches',
+    'major_gods': 'major_gods',
+    'watermarks': watermark_str,
+}
+
+
+def __getattr__(name):
+    if name == 'client':
+        return get_client()
+    if name == 'db':
+        return get_db()
+    if name in LAZY_COLLECTIONS:
+        return get_collection(LAZY_COLLECTIONS[name])
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# backfill params
+partition_days = int(os.getenv("PARTITION_DAYS", "1"))
+max_workers = int(os.getenv("MAX_WORKERS", "4"))
+batch_size = int(os.getenv("BATCH_SIZE", "1000"))
+write_mode = os.getenv("WRITE_MODE", "insert") # insert | upsert | replace
+engine = os.getenv("STATS_ENGINE", "server") # server | numpy
+stats_pipeline = os.getenv("STATS_PIPELINE", "keyed") # keyed | minimal | facet | flat, server engine only
+
+# per invocation metrics, see lambda_handler and metrics.py
+invocation_count = 0
+
+# query plan instrumentation, off by default since explain executionStats runs the query again
+explain_runs = os.getenv("STATS_EXPLAIN", "false").lower() == "true"
+create_match_index = os.getenv("STATS_CREATE_INDEX", "false").lower() == "true"
+
+# write into a native time series collection, see timeseries.py for STATS_TTL_DAYS / STATS_BUCKET_SPAN_DAYS
+timeseries_target = os.getenv("STATS_TIMESERIES", "false").lower() == "true"
+
+# rebuild the civ x civ matchup matrices after every run, see matchup_matrix.py for MATRIX_WINDOWS,
+# off by default since recomputing an older day rebuilds whole windows from the daily documents
+update_matrix_docs = os.getenv("STATS_MATRICES", "false").lower() == "true"
+
+# rating / duration t-digests and distinct player HyperLogLogs on every document, see sketches.py
+stats_sketches = os.getenv("STATS_SKETCHES", "false").lower() == "true"
+
+# store Wilson intervals, smoothed win rates and significance flags in every document and cell
+stats_win_rates = os.getenv("STATS_WIN_RATES", "false").lower() == "true"
 
-# mongo params
-full_url = f"mongodb+srv://{username}:{password}@{mongo_url}"
-client = MongoClient(full_url)
-db = client["test"]
-collection = db["matches"]
+# 1 writes the documents as the pipelines return them, 2 the compact encoding of compact_schema.py
+stats_schema = int(os.getenv("STATS_SCHEMA", "1"))
+
+# read matches from a local .bson / .jsonl dump instead of the matches collection, see file_source.py
+stats_source = os.getenv("STATS_SOURCE", "")
+
+# hand the server engine's result documents to the inserts as raw BSON, without decoding them
+stats_raw_bson = os.getenv("STATS_RAW_BSON", "false").lower() == "true"
+RAW_CODEC = CodecOptions(document_class=RawBSONDocument)
+
+# columnar export after every run, to a local directory or s3://bucket/prefix, empty disables it
+stats_export_path = os.getenv("STATS_EXPORT_PATH", "")
+stats_export_format = os.getenv("STATS_EXPORT_FORMAT", "parquet") # parquet | arrow
+stats_export_compact = os.getenv("STATS_EXPORT_COMPACT", "false").lower() == "true"
+
+# merge every run's days into the weekly / monthly / all time rollups, off by default since every
+# run rebuilds the "all" rollup of each civ and elo bin
+update_rollup_docs = os.getenv("STATS_ROLLUPS", "false").lower() == "true"
+
+# a daily stats document is identified by its civ, elo bin and day
+STATS_KEY = [('metaField.civ_id', 1), ('metaField.elo_bin', 1), ('matchDay', 1)]
+# insert runs look up the partitions' days of a target by matchDay, see partial_write_mode
+MATCH_DAY_KEY = [('matchDay', 1)]
 
 # mongo civs stats pipeline -------------------------------------------
-def civ_stats_pipeline(start_date, end_date):
-    pipeline = [
+def opp_god_stages(god_names=None):
+    """
+    Stages naming each player row's opponent god as cleanmatchHistory.opp_god_name, dropping rows 
+    whose opponent is not a major god. With god_names ({id: name}) the names are inlined as a 
+    literal map, otherwise every row is joined against major_gods with a $lookup.
+    """
+    if god_names is None:
+        return [
+            {
+                '$lookup': {
+                    'from': 'major_gods', 
+                    'localField': 'cleanmatchHistory.opp_civ_id', 
+                    'foreignField': 'id', 
+                    'as': 'opp_god_info'
+                }
+            }, {
+                '$addFields': {
+                    'cleanmatchHistory.opp_god_name': '$opp_god_info.name'
+                }
+            }, {
+                '$unwind': '$cleanmatchHistory.opp_god_name'
+            }
+        ]
+
+    return [
+        {
+            '$addFields': {
+                'cleanmatchHistory.opp_god_name': god_name_expr('$cleanmatchHistory.opp_civ_id', god_names)
+            }
+        }, {
+            '$match': {
+                'cleanmatchHistory.opp_god_name': {'$ne': None}
+            }
+        }
+    ]
+
+
+def god_stages(god_names=None):
+    """
+    Stages naming each output group's god as _id.god_name, dropping groups whose civ is not a 
+    major god. Same god_names contract as opp_god_stages.
+    """
+    if god_names is None:
+        return [
+            {
+                '$lookup': {
+                    'from': 'major_gods', 
+                    'localField': '_id.civ_id', 
+                    'foreignField': 'id', 
+                    'as': 'god_info'
+                }
+            }, {
+                '$unwind': '$god_info'
+            }, {
+                '$addFields': {
+                    '_id.god_name': '$god_info.name'
+                }
+            }, {
+                '$project': {
+                    'god_info': 0
+                }
+            }
+        ]
+
+    return [
+        {
+            '$addFields': {
+                '_id.god_name': god_name_expr('$_id.civ_id', god_names)
+            }
+        }, {
+            '$match': {
+                '_id.god_name': {'$ne': None}
+            }
+        }
+    ]
+
+
+def player_row_stages(start_date, end_date, god_names=None):
+    """
+    Stages turning the 1v1 matches in [start_date, end_date) into one document per player with 
+    cleanmatchHistory (civilization_id, opp_civ_id, opp_god_name, outcome, avg_elo, elo_bin), 
+    matchDuration, mapData and matchDay. Mirror matches are dropped.
+    """
+    stages = [
     {
         '$match': {
             'gameMode': '1V1_SUPREMACY',
@@ -180,25 +356,23 @@ def civ_stats_pipeline(start_date, end_date):
                 }
             }
         }
-    }, {
-        '$lookup': {
-            'from': 'major_gods', 
-            'localField': 'cleanmatchHistory.opp_civ_id', 
-            'foreignField': 'id', 
-            'as': 'opp_god_info'
-        }
-    }, {
-        '$addFields': {
-            'cleanmatchHistory.opp_god_name': '$opp_god_info.name'
-        }
-    }, {
-        '$unwind': '$cleanmatchHistory.opp_god_name'
-    }, {
+    },
+    *opp_god_stages(god_names),
+    {
         '$project': {
             'opp_god_info': 0, 
             'matchDate': 0
         }
-    }, {
+    }
+    ]
+
+    return stages
+
+
+def civ_stats_pipeline(start_date, end_date, god_names=None):
+    pipeline = [
+    *player_row_stages(start_date, end_date, god_names),
+    {
         '$facet': {
             'justCivs': [
                 {
@@ -227,6 +401,18 @@ def civ_stats_pipeline(start_date, end_date):
                                     }, 1, 0
                                 ]
                             }
+                        }, 
+                        'durationSum': {
+                            '$sum': '$matchDuration'
+                        }, 
+                        'durationCount': {
+                            '$sum': {
+                                '$cond': [
+                                    {
+                                        '$isNumber': '$matchDuration'
+                                    }, 1, 0
+                                ]
+                            }
                         }
                     }
                 }
@@ -367,6 +553,8 @@ def civ_stats_pipeline(start_date, end_date):
             'totalResults': 1, 
             'avgDuration': 1, 
             'totalWins': 1, 
+            'durationSum': 1, 
+            'durationCount': 1, 
             'mapData._id.map_name': 1, 
             'mapData.totalResults': 1, 
             'mapData.totalWins': 1, 
@@ -382,24 +570,9 @@ def civ_stats_pipeline(start_date, end_date):
                 ]
             }
         }
-    }, {
-        '$lookup': {
-            'from': 'major_gods', 
-            'localField': '_id.civ_id', 
-            'foreignField': 'id', 
-            'as': 'god_info'
-        }
-    }, {
-        '$unwind': '$god_info'
-    }, {
-        '$addFields': {
-            '_id.god_name': '$god_info.name'
-        }
-    }, {
-        '$project': {
-            'god_info': 0
-        }
-    }, {
+    },
+    *god_stages(god_names),
+    {
         '$addFields': {
             'matchups': {
                 '$arrayToObject': {
@@ -424,7 +597,16 @@ def civ_stats_pipeline(start_date, end_date):
             'maps': {
                 '$arrayToObject': {
                     '$map': {
-                        'input': '$mapData', 
+                        # matches without mapData group under a null map_name, no map cell
+                        'input': {
+                            '$filter': {
+                                'input': '$mapData', 
+                                'as': 'mapDoc', 
+                                'cond': {
+                                    '$ne': [{'$ifNull': ['$$mapDoc._id.map_name', None]}, None]
+                                }
+                            }
+                        }, 
                         'as': 'item', 
                         'in': {
                             'k': {
@@ -562,16 +744,409 @@ def civ_stats_pipeline(start_date, end_date):
 
     return pipeline
 
+
+def civ_stats_keyed_pipeline(start_date, end_date, god_names=None):
+    """
+    Same documents as civ_stats_pipeline, built with keyed $group stages instead of $facet. 
+
+    civ_stats_pipeline packs every group of the range into a single $facet document (capped at 
+    16 MB) and then $filters all map and matchup groups for every (civ, elo_bin, day), which grows 
+    with the square of the number of groups. The keyed stages (pipeline_builder.group_stages) only 
+    ever touch the groups of one (civ, elo_bin, day) key. Durations are carried as sum + count so 
+    the average matches $avg exactly.
+    """
+    pipeline = [
+        *player_row_stages(start_date, end_date, god_names),
+        *group_stages(
+            civ='$cleanmatchHistory.civilization_id',
+            elo_bin='$cleanmatchHistory.elo_bin',
+            opp='$cleanmatchHistory.opp_god_name',
+            map_name='$mapData.name',
+            win={'$cond': [{'$eq': ['$cleanmatchHistory.outcome', 1]}, 1, 0]},
+        ),
+        *god_stages(god_names),
+        output_stage(elo_bin_index={'$indexOfArray': [ELO_BIN_LABELS, '$_id.elo_bin']}),
+    ]
+
+    return pipeline
+
+
+PIPELINES = {
+    'facet': civ_stats_pipeline,
+    'keyed': civ_stats_keyed_pipeline,
+    'minimal': build_pipeline,
+    'flat': results_pipeline,
+}
+
+# collection each pipeline reads, matches unless listed
+PIPELINE_SOURCES = {
+    'flat': player_results_str,
+}
+
 # --------------------------------------------------
 
 
-def create_daily_stats(target, ingest_custom_range=False, start_date=None, end_date=None):
+def split_date_range(start_date, end_date, days=1):
+    """
+    Split [start_date, end_date) into consecutive [start, end) partitions of `days` days each.
+    The last partition is truncated at end_date. start_date should be midnight UTC so that every
+    matchDay lands in exactly one partition.
+    """
+    partitions = []
+    step = timedelta(days=days)
+    part_start = start_date
+    while part_start < end_date:
+        part_end = min(part_start + step, end_date)
+        partitions.append((part_start, part_end))
+        part_start = part_end
+
+    return partitions
+
+
+def batched(docs, size):
+    """
+    Yield lists of up to size docs from any iterable, pulling from it lazily.
+    """
+    docs = iter(docs)
+    while batch := list(islice(docs, size)):
+        yield batch
+
+
+def insert_batch(target, batch):
+    # raw documents get their _id from the server so inserted_ids stays empty, an unordered
+    # insert_many raises unless every document landed
+    target.insert_many(batch, ordered=False)
+    return len(batch)
+
+
+def upsert_batch(target, batch):
+    """
+    Replace each doc's existing (civ_id, elo_bin, matchDay) stats document, or insert it if missing,
+    so re-running a day never duplicates it.
+    """
+    operations = [
+        ReplaceOne(
+            compact_filter(doc) if doc.get('v') == SCHEMA_VERSION else {
+                'metaField.civ_id': doc['metaField']['civ_id'],
+                'metaField.elo_bin': doc['metaField']['elo_bin'],
+                'matchDay': doc['matchDay'],
+            },
+            doc,
+            upsert=True,
+        )
+        for doc in batch
+    ]
+    result = target.bulk_write(operations, ordered=False)
+    return result.matched_count + result.upserted_count
+
+
+WRITERS = {
+    'insert': insert_batch,
+    'upsert': upsert_batch,
+    # run_partition first deletes the partition's days, then inserts
+    'replace': insert_batch,
+}
+
+
+def write_batches(target, docs, batch_size=batch_size, write_mode=write_mode, metrics=None, started=None,
+                  sort_key=None):
+    """
+    Stream docs into target as unordered bulk writes of batch_size documents. Each batch is flushed 
+    on a background writer thread while the next one is read from docs, so at most two batches are 
+    held in memory no matter how many documents the cursor returns. write_mode picks plain inserts 
+    or idempotent upserts (see WRITERS). Returns the number of documents written.
+    With a metrics dict, the seconds from started (default now) until the first batch was read, the 
+    seconds spent waiting on docs and writing, and the document and batch counts are recorded into 
+    it (see metrics.py). With sort_key every batch is sorted before it is written, ie by 
+    timeseries.bucket_key.
+    """
+    if write_mode not in WRITERS:
+        raise ValueError(f"Unknown write_mode {write_mode!r}, expected one of {list(WRITERS)}")
+    write_batch = WRITERS[write_mode]
+
+    def timed_write(batch):
+        write_started = time.perf_counter()
+        written = write_batch(target, batch)
+        return written, time.perf_counter() - write_started
+
+    started = started or time.perf_counter()
+    first_batch = None
+    drain = 0.0
+    insert = 0.0
+    count = 0
+    read = 0
+    batch_count = 0
+    pending = None
+    batches = batched(docs, batch_size)
+
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        while True:
+            read_started = time.perf_counter()
+            batch = next(batches, None)
+            drain += time.perf_counter() - read_started
+            if batch is None:
+                break
+
+            if first_batch is None:
+                first_batch = time.perf_counter() - started
+            read += len(batch)
+            batch_count += 1
+            if sort_key is not None:
+                batch.sort(key=sort_key)
+
+            # wait for the previous flush before queueing the next one
+            if pending is not None:
+                written, secs = pending.result()
+                count += written
+                insert += secs
+            pending = writer.submit(timed_write, batch)
+
+        if pending is not None:
+            written, secs = pending.result()
+            count += written
+            insert += secs
+
+    record(metrics, 'first_batch', first_batch)
+    record(metrics, 'drain', drain)
+    record(metrics, 'insert', insert)
+    record(metrics, 'docs_read', read)
+    record(metrics, 'docs_written', count)
+    record(metrics, 'batches', batch_count)
+    return count
+
+
+def source_pipeline(start_date, end_date, god_names, engine=engine, variant=stats_pipeline, modes=()):
+    """
+    The aggregation the chosen engine sends to the matches collection for [start_date, end_date) 
+    (ms since epoch): the variant stats pipeline (see PIPELINES) for "server", the projected 
+    matches (of every game mode in modes if any) for "numpy".
+    """
+    if engine == 'server':
+        if variant not in PIPELINES:
+            raise ValueError(f"Unknown pipeline {variant!r}, expected one of {list(PIPELINES)}")
+        return PIPELINES[variant](start_date, end_date, god_names)
+
+    if engine == 'numpy':
+        return projected_matches_pipeline(start_date, end_date, modes or BASE_MODE)
+
+    raise ValueError(f"Unknown engine {engine!r}, expected 'server' or 'numpy'")
+
+
+def partition_stats(start_date, end_date, god_names=None, batch_size=batch_size, engine=engine,
+                    variant=stats_pipeline, sketches=False, metrics=None, raw_bson=False, source=None):
+    """
+    Daily stats documents for [start_date, end_date) from the chosen engine. "server" returns the 
+    cursor of the stats pipeline run on the cluster, "numpy" aggregates the projected matches 
+    client side with civ_stats_columnar. With sketches (numpy engine only) the documents carry their 
+    sketches. The time spent building the pipeline and, for "numpy", draining the cursor into it is recorded into metrics. With raw_bson 
+    the server cursor yields RawBSONDocuments, fields are only decoded if something reads them. With 
+    a source dump path its matches are aggregated by civ_stats_columnar, matches is never read.
+    """
+    if god_names is None:
+        god_names = load_god_names(get_collection('major_gods'))
+
+    if source:
+        with span(metrics, 'drain'):
+            return civ_stats_columnar(file_matches(source, start_date, end_date), god_names, sketches)
+
+    with span(metrics, 'pipeline_build'):
+        pipeline = source_pipeline(
+            start_date.timestamp() * 1000, end_date.timestamp() * 1000, god_names, engine, variant
+        )
+    matches = get_collection('matches')
+    if engine == 'server' and variant in PIPELINE_SOURCES:
+        if sync_player_results:
+            flatten_matches(matches, get_collection(player_results_str), start_date, end_date)
+        matches = get_collection(PIPELINE_SOURCES[variant])
+    if raw_bson:
+        matches = matches.with_options(codec_options=RAW_CODEC)
+    cursor = matches.aggregate(pipeline, batchSize=batch_size)
+
+    if engine == 'numpy':
+        with span(metrics, 'drain'):
+            return civ_stats_columnar(cursor, god_names, sketches)
+
+    if sketches:
+        raise ValueError("Sketches are built from the projected matches, they need engine 'numpy'")
+
+    return cursor
+
+
+def partial_write_mode(target, days, write_mode, timeseries=False):
+    """
+    "replace" instead of "insert" when target already holds documents of days: an earlier run wrote 
+    part of them and died (or timed out) before watermarking them, inserting again would duplicate 
+    them. Any other write_mode is returned as is. Raises ValueError for a time series target on a 
+    server that can't delete them by matchDay.
+    """
+    if write_mode != 'insert' or target.find_one({'matchDay': {'$in': days}}, {'_id': 1}) is None:
+        return write_mode
+
+    if timeseries and not supports_deletes(target.database.client):
+        raise ValueError(f"{target.name} already has documents of {days[0]:%m/%d/%Y} - {days[-1]:%m/%d/%Y} "
+                         "and replacing them in a time series needs MongoDB 7.0+, delete them by hand first")
+    print(f"{target.name} already has documents of {days[0]:%m/%d/%Y} - {days[-1]:%m/%d/%Y}, replacing them")
+    return 'replace'
+
+
+def run_partition(target, start_date, end_date, god_names=None, batch_size=batch_size,
+                  write_mode=write_mode, engine=engine, variant=stats_pipeline, metrics=None, sort_key=None,
+                  sketches=False, raw_bson=False, source=None, schema=1, win_rates=False, timeseries=False):
+    """
+    Compute the stats of a single [start_date, end_date) partition on its own cursor and stream 
+    them into target. Once every document is written the partition's days are watermarked as 
+    complete. Returns the number of written docs.
+    """
+    started = time.perf_counter()
+
+    write_mode = partial_write_mode(target, day_range(start_date, end_date), write_mode, timeseries)
+    if write_mode == 'replace':
+        target.delete_many({'matchDay': {'$gte': start_date, '$lt': end_date}})
+
+    docs = partition_stats(
+        start_date, end_date, god_names, batch_size, engine, variant, sketches, metrics, raw_bson, source
+    )
+    if win_rates:
+        docs = with_win_rates(docs)
+    if schema == SCHEMA_VERSION:
+        if god_names is None:
+            god_names = load_god_names(get_collection('major_gods'))
+        docs = encode_docs(docs, get_collection(schema_tables_str), target.name, god_names)
+    count = write_batches(target, docs, batch_size, write_mode, metrics, started, sort_key)
+    mark_complete(get_collection(watermark_str), target.name, start_date, end_date)
+
+    elapsed = time.perf_counter() - started
+    print(f"Partition {start_date:%m/%d/%Y} - {end_date:%m/%d/%Y}: {count} docs in {elapsed:.2f}s")
+
+    return count
+
+
+def run_modes_partition(targets, start_date, end_date, god_names, batch_size=batch_size,
+                        write_mode=write_mode, metrics=None, sort_key=None, sketches=False, source=None,
+                        schema=1, force=False, win_rates=False, timeseries=False):
+    """
+    Compute the stats of every game mode of targets ({mode: collection}) for a single 
+    [start_date, end_date) partition from one scan of its matches, then stream each mode's 
+    documents into its target and watermark the partition's days there. Days a target already 
+    holds (ie of a mode added to an existing run) are not written again unless force is set. 
+    Returns the number of written docs over every mode.
+    """
+    started = time.perf_counter()
+    modes = list(targets)
+
+    watermarks = get_collection(watermark_str)
+    done = {
+        mode: set() if force else completed_days(watermarks, target.name, start_date, end_date)
+        for mode, target in targets.items()
+    }
+    write_modes = {}
+    for mode, target in targets.items():
+        days = [day for day in day_range(start_date, end_date) if day not in done[mode]]
+        write_modes[mode] = partial_write_mode(target, days, write_mode, timeseries) if days else write_mode
+        if write_modes[mode] == 'replace':
+            target.delete_many({'matchDay': {'$in': days}})
+
+    if source:
+        matches = file_matches(source, start_date, end_date, modes)
+    else:
+        with span(metrics, 'pipeline_build'):
+            pipeline = projected_matches_pipeline(start_date.timestamp() * 1000, end_date.timestamp() * 1000, modes)
+        matches = get_collection('matches').aggregate(pipeline, batchSize=batch_size)
+    with span(metrics, 'drain'):
+        mode_docs = mode_stats(matches, god_names, modes, sketches)
+
+    counts = {}
+    for mode, docs in mode_docs.items():
+        target = targets[mode]
+        if done[mode]:
+            docs = [doc for doc in docs if doc['matchDay'].replace(tzinfo=timezone.utc) not in done[mode]]
+        if win_rates:
+            docs = with_win_rates(docs)
+        if schema == SCHEMA_VERSION:
+            docs = encode_docs(docs, get_collection(schema_tables_str), target.name, god_names)
+        counts[mode] = write_batches(target, docs, batch_size, write_modes[mode], metrics, started, sort_key)
+        mark_complete(watermarks, target.name, start_date, end_date)
+
+    elapsed = time.perf_counter() - started
+    print(f"Partition {start_date:%m/%d/%Y} - {end_date:%m/%d/%Y}: {counts} docs in {elapsed:.2f}s")
+
+    return sum(counts.values())
+
+
+def create_daily_stats(target, ingest_custom_range=False, start_date=None, end_date=None,
+                       partition_days=partition_days, max_workers=max_workers, batch_size=batch_size,
+                       write_mode=write_mode, force=False, engine=engine, variant=stats_pipeline,
+                       explain=explain_runs, create_index=create_match_index, rollups=update_rollup_docs,
+                       metrics=None, timeseries=timeseries_target, export_path=stats_export_path,
+                       export_format=stats_export_format, export_compact=stats_export_compact,
+                       matrices=update_matrix_docs, sketches=stats_sketches, raw_bson=stats_raw_bson,
+                       source=stats_source, schema=stats_schema, modes=stats_modes, win_rates=stats_win_rates):
     """
     target: (str) name of the collection to insert the documents ie "daily_stats_test"
     ingest_custom_range: (boo) if true user must define start_date and end_date, if false pipeline will 
         only ingest yesterday (in UTC). 
     start_date: (str)  MM/DD/YYYY
     end_date: (str)  MM/DD/YYYY
+    partition_days: (int) number of days aggregated per partition, defaults to PARTITION_DAYS (1)
+    max_workers: (int) number of partitions aggregated concurrently, defaults to MAX_WORKERS (4)
+    batch_size: (int) cursor batch size and documents per bulk insert, defaults to BATCH_SIZE (1000)
+    write_mode: (str) "insert" to append documents, "upsert" to replace existing documents with the 
+        same metaField and matchDay or "replace" to delete each partition's days before inserting them, 
+        defaults to WRITE_MODE (insert)
+    force: (bool) if true recompute every day in the range, even the ones already watermarked
+    engine: (str) "server" to aggregate with civ_stats_pipeline on the cluster or "numpy" to only fetch 
+        the projected match fields and aggregate client side, defaults to STATS_ENGINE (server)
+    variant: (str) server engine pipeline, "keyed" (civ_stats_keyed_pipeline), "minimal" 
+        (pipeline_builder.build_pipeline), "facet" (civ_stats_pipeline) or "flat" (player_results.results_pipeline 
+        over the flattened player_results collection, backfilled once with player_results.py and synced 
+        with the matches inserted since by every run), defaults to STATS_PIPELINE (keyed). "minimal" stays 
+        opt-in until benchmarks.pipeline_stages reports identical output on a production day
+    explain: (bool) if true log the explain executionStats of the first partition's aggregation as one 
+        JSON line, defaults to STATS_EXPLAIN (false)
+    create_index: (bool) if true and the explained $match scans the whole matches collection, create 
+        the {gameMode, matchDate} index instead of only warning, defaults to STATS_CREATE_INDEX (false)
+    rollups: (bool) if true merge the days of the run into the weekly, monthly and all time rollups in 
+        ROLLUP_STR (default "<target>_rollups"), defaults to STATS_ROLLUPS (false)
+    metrics: (dict) if given, every partition records its spans (pipeline build, first batch, cursor 
+        drain, insert), document and batch counts into it, see metrics.py
+    timeseries: (bool) if true create target as a time series collection on matchDay / metaField, or 
+        check it is one, and write batches sorted by series. Time series collections take "insert" or 
+        "replace" writes, not "upsert", and "replace" needs MongoDB 7.0+ to delete by matchDay. Defaults 
+        to STATS_TIMESERIES (false)
+    export_path: (str) if set, export the run's days as a matchDay / elo_bin partitioned dataset to 
+        this local directory (under /tmp in Lambda) or s3://bucket/prefix (the template's StatsExportBucket) 
+        (see export.py), defaults to STATS_EXPORT_PATH (off)
+    export_format: (str) "parquet" or "arrow" (IPC, memory mappable), defaults to STATS_EXPORT_FORMAT
+    export_compact: (bool) if true also rewrite the whole history as one file per elo_bin, defaults to 
+        STATS_EXPORT_COMPACT (false)
+    matrices: (bool) if true update the per elo bin civ x civ matchup matrices in MATRIX_STR (default 
+        "<target>_matrices") with the run's days, defaults to STATS_MATRICES (false)
+    sketches: (bool) if true store rating / duration t-digests and a distinct player HyperLogLog in 
+        every document (see sketches.py), computed by the numpy engine so matches are scanned once, 
+        defaults to STATS_SKETCHES (false)
+    raw_bson: (bool) if true the server engine's documents are read as RawBSONDocuments and inserted 
+        from their raw buffers instead of being decoded into dicts and encoded again. Needs the 
+        "server" engine and no sketches, upserts and time series batches still decode the fields they 
+        key on. Defaults to STATS_RAW_BSON (false)
+    source: (str) path of a mongodump .bson or mongoexport .jsonl file of matches to read instead of 
+        the matches collection (see file_source.py). Runs on the numpy engine and scans the file once 
+        per pending range, partition_days is ignored. Defaults to STATS_SOURCE (off)
+    schema: (int) 1 to write documents as the pipelines return them, 2 for the compact encoding of 
+        compact_schema.py (integer ids, packed matchups / maps, id tables in SCHEMA_TABLES_STR). Rollups, 
+        matrices and exports read version 1 documents and are skipped for version 2 targets, read 
+        those with compact_schema.read_stats. Defaults to STATS_SCHEMA (1)
+    modes: (list) game modes to compute in a single scan of matches on the numpy engine, each into 
+        its own target (see game_modes.py): target itself for 1V1_SUPREMACY, "<target>_<mode>" for the 
+        others, with their own watermarks, rollups and matrices. Team modes take opponents and 
+        teammates from the players' teamid. Range queries and exports only cover target. Defaults to 
+        STATS_MODES (off, 1V1_SUPREMACY only)
+    win_rates: (bool) if true store winRate, Wilson interval bounds (winLow / winHigh), a smoothed win 
+        rate and a significance flag on every document and matchup / map cell (see win_rates.py). 
+        Matrices and range queries always carry them. Needs version 1 documents that are not raw BSON. 
+        Hourly incremental runs leave them stale until the nightly run recomputes the day. Defaults 
+        to STATS_WIN_RATES (false)
+
+    Returns the number of documents written to target, or to every mode target with modes.
 
     Ingesting full time series example: It is Sept 17th, 2024. User wants to ingest all match data 
     since release. Arguments should be as follows:
@@ -580,6 +1155,15 @@ def create_daily_stats(target, ingest_custom_range=False, start_date=None, end_d
     end_date = '09/17/2024' 
     NOTE: The last full day ingested with these params will be 09/16/2024. Then at 2am UTC on 09/18/2024 
     September 17th will be ingested and the pipeline is off to the races.
+    NOTE: Custom ranges are split into partitions of partition_days days which run concurrently on a 
+    pool of max_workers threads, each with its own cursor. Every stats document is grouped by matchDay so 
+    the partitions never overlap and a backfill takes roughly as long as its slowest partition.
+    NOTE: Days that are fully ingested are recorded in the WATERMARK_STR collection and skipped, only 
+    missing or dirty days are recomputed. A run that died mid-day leaves that day without a watermark 
+    but with some of its documents, an "insert" retry replaces the days of such partitions instead of 
+    duplicating them (time series targets need MongoDB 7.0+ for it).
+    NOTE: Ranges too long for a single 300s invocation should be sent with "backfill": True in the event, 
+    lambda_handler then runs them in checkpointed chunks across invocations (see backfill.py).
     NOTE: Invoke local lambda test with env_vars as: 
     `sam local invoke CivsStatsExtractorFunction --env-vars locals.json`
     """
@@ -594,36 +1178,255 @@ def create_daily_stats(target, ingest_custom_range=False, start_date=None, end_d
         end_date = today
 
     print(f"Creating daily stats from {start_date} to {end_date}")
-    start_date = start_date.timestamp() * 1000 #milliseconds since epoch
-    end_date = end_date.timestamp() * 1000
-    
-    # define which mongo pipeline we want to run
-    pipeline = civ_stats_pipeline(start_date, end_date)
-    
-    # run the pipeline
-    date_range = collection.aggregate(pipeline)
-    
-    docs = list(date_range)
+    started = time.perf_counter()
+
+    if source and engine != 'numpy':
+        print(f"Reading matches from {source}, file sources run on the numpy engine")
+        engine = 'numpy'
+
+    if modes and engine != 'numpy':
+        print(f"Computing {modes} in one scan, multi mode runs use the numpy engine")
+        engine = 'numpy'
+
+    if raw_bson and (engine != 'server' or sketches):
+        raise ValueError("raw_bson passes the server engine's documents through as is, it needs engine "
+                         "'server' and no sketches")
+
+    if sketches and engine != 'numpy':
+        print("Computing sketches from the projected matches, sketch runs use the numpy engine")
+        engine = 'numpy'
+
+    if win_rates and (raw_bson or schema == SCHEMA_VERSION):
+        raise ValueError("win_rates annotate version 1 documents, they can't be combined with raw_bson or "
+                         "schema 2, compute them on read with win_rates.with_win_rates instead")
+
+    if schema == SCHEMA_VERSION:
+        if timeseries:
+            raise ValueError("Compact documents have no metaField, they can't be written as a time series")
+        if rollups or matrices or export_path:
+            print("Compact target, skipping rollups, matrices and export, they read version 1 documents")
+        rollups, matrices, export_path = False, False, ''
+
+    if write_mode == 'insert' and has_incremental_state(get_collection(watermark_str), target.name):
+        # hourly runs already $inc'ed documents into these days, inserting would duplicate them
+        print("Target has incremental stats, upserting instead of inserting")
+        write_mode = 'upsert'
+
+    if timeseries:
+        if write_mode == 'upsert':
+            raise ValueError("Time series targets can't be upserted into, use write_mode 'insert' or 'replace'")
+        if write_mode == 'replace' and not supports_deletes(target.database.client):
+            raise ValueError("Replacing days of a time series target deletes them by matchDay, which needs "
+                             "MongoDB 7.0+, use write_mode 'insert'")
+        target = ensure_timeseries(target.database, target.name)
+
+    mode_targets = {}
+    for mode in modes:
+        name = mode_target_name(target.name, mode)
+        if name == target.name:
+            mode_targets[mode] = target
+        else:
+            mode_targets[mode] = ensure_timeseries(target.database, name) if timeseries else target.database[name]
+    stats_targets = list(mode_targets.values()) or [target]
+
+    if force:
+        pending = [(start_date, end_date)]
+    elif modes:
+        pending = pending_ranges_any(
+            get_collection(watermark_str), [stats_target.name for stats_target in stats_targets], start_date, end_date
+        )
+    else:
+        pending = pending_ranges(get_collection(watermark_str), target.name, start_date, end_date)
 
-    # insert docs into target collection
-    target.insert_many(docs)
+    if not ingest_custom_range:
+        # the nightly run also reconciles the older days late incremental matches marked dirty
+        late_days = sorted({
+            day for stats_target in stats_targets
+            for day in dirty_days(get_collection(watermark_str), stats_target.name) if day < start_date
+        })
+        if late_days:
+            print(f"Recomputing {len(late_days)} dirty days: {[f'{day:%m/%d/%Y}' for day in late_days]}")
+        pending = [(day, day + timedelta(days=1)) for day in late_days] + pending
 
-    return docs
+    if source:
+        # a dump is scanned whole for every partition, so each pending range is read in one pass
+        partitions = list(pending)
+    else:
+        partitions = [
+            partition
+            for pending_start, pending_end in pending
+            for partition in split_date_range(pending_start, pending_end, partition_days)
+        ]
+    if not partitions:
+        print("Every day in range is already ingested, nothing to do")
+        return 0
+
+    if write_mode == 'upsert':
+        for stats_target in stats_targets:
+            stats_target.create_index(COMPACT_KEY if schema == SCHEMA_VERSION else STATS_KEY)
+    elif write_mode == 'insert':
+        for stats_target in stats_targets:
+            stats_target.create_index(MATCH_DAY_KEY)
+
+    # god names are inlined into every partition's pipeline instead of joined per document
+    god_names = load_god_names(get_collection('major_gods'))
+
+    reads_results = engine == 'server' and variant in PIPELINE_SOURCES and not source
+    if reads_results:
+        # flattens only the matches inserted since the last sync, every match is reshaped once
+        sync_results(get_collection('matches'), get_collection(player_results_str), get_collection(watermark_str))
+
+    if explain and not source:
+        explain_start, explain_end = partitions[0]
+        log_query_plan(
+            get_collection(PIPELINE_SOURCES[variant] if reads_results else 'matches'),
+            source_pipeline(
+                explain_start.timestamp() * 1000, explain_end.timestamp() * 1000, god_names, engine, variant, modes
+            ),
+            create_index=create_index,
+            index=RESULTS_INDEX if reads_results else MATCH_INDEX,
+            target=target.name,
+            start_date=explain_start,
+            end_date=explain_end,
+            engine=engine,
+            pipeline=variant,
+        )
+
+    workers = max(1, min(max_workers, len(partitions)))
+
+    # run each partition on its own cursor
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if modes:
+            results = executor.map(
+                lambda partition: run_modes_partition(
+                    mode_targets, *partition, god_names=god_names, batch_size=batch_size, write_mode=write_mode,
+                    metrics=metrics, sort_key=bucket_key if timeseries else None, sketches=sketches,
+                    source=source, schema=schema, force=force, win_rates=win_rates, timeseries=timeseries,
+                ),
+                partitions,
+            )
+        else:
+            results = executor.map(
+                lambda partition: run_partition(
+                    target, *partition, god_names=god_names, batch_size=batch_size, write_mode=write_mode,
+                    engine=engine, variant=variant, metrics=metrics, sort_key=bucket_key if timeseries else None,
+                    sketches=sketches, raw_bson=raw_bson, source=source, schema=schema, win_rates=win_rates,
+                    timeseries=timeseries,
+                ),
+                partitions,
+            )
+        count = sum(results)
+    record(metrics, 'days', sum(len(day_range(*partition)) for partition in partitions))
+
+    elapsed = time.perf_counter() - started
+    print(f"Ran {len(partitions)} partitions on {workers} workers in {elapsed:.2f}s")
+
+    # ROLLUP_STR / MATRIX_STR name the collections of target, mode targets use the default names
+    for stats_target in stats_targets if rollups else []:
+        rollups_started = time.perf_counter()
+        rollup_target = get_collection(
+            rollup_str if rollup_str and stats_target == target else f"{stats_target.name}_rollups"
+        )
+        days = [day for partition in partitions for day in day_range(*partition)]
+        rollup_count = update_rollups(stats_target, rollup_target, days)
+        elapsed = time.perf_counter() - rollups_started
+        print(f"Updated {rollup_count} {rollup_target.name} documents for {len(days)} days in {elapsed:.2f}s")
+
+    for stats_target in stats_targets if matrices else []:
+        matrices_started = time.perf_counter()
+        matrix_target = get_collection(
+            matrix_str if matrix_str and stats_target == target else f"{stats_target.name}_matrices"
+        )
+        days = [day for partition in partitions for day in day_range(*partition)]
+        windows = update_matrices(stats_target, matrix_target, days, god_names)
+        elapsed = time.perf_counter() - matrices_started
+        print(f"Updated {matrix_target.name} windows {windows} in {elapsed:.2f}s")
+
+    # keeps the prefix sums of a warm container that answered range queries current
+    if target in stats_targets:
+        update_cache(
+            target, [day for partition in partitions for day in day_range(*partition)], god_names,
+            get_collection(watermark_str),
+        )
+
+    if export_path:
+        # pyarrow is only imported by runs that export, it is a slow import for every cold start
+        from export import export_days, export_history
+
+        export_started = time.perf_counter()
+        rows = export_days(target, partitions, god_names, export_path, export_format)
+        if export_compact:
+            rows += export_history(target, god_names, export_path, export_format)
+        elapsed = time.perf_counter() - export_started
+        print(f"Exported {rows} rows to {export_path} in {elapsed:.2f}s")
+
+    return count
 
 # event structure example
 # event = {
 #     "ingest_custom_range": True,
 #     "start_date": '08/26/2024', # one day before aom release = 08/26/2024
 #     "end_date": '09/17/2024',
+#     "partition_days": 1, # optional, days per partition
+#     "max_workers": 4, # optional, partitions aggregated concurrently
+#     "batch_size": 1000, # optional, documents per cursor batch and bulk insert
+#     "write_mode": "upsert", # optional, insert | upsert | replace
+#     "force": False, # optional, recompute days that are already watermarked
+#     "engine": "numpy", # optional, server | numpy
+#     "pipeline": "keyed", # optional, keyed | minimal | facet | flat
+#     "explain": True, # optional, log the query plan of the run
+#     "create_index": True, # optional, create the matches index if the query plan is a COLLSCAN
+#     "rollups": True, # optional, update the weekly / monthly / all time rollups
+#     "timeseries": True, # optional, create / check the target as a time series collection
+#     "export_path": "s3://bucket/stats", # optional, export the run as parquet / arrow files
+#     "export_format": "parquet", # optional, parquet | arrow
+#     "export_compact": False, # optional, also rewrite the full history export
+#     "matrices": True, # optional, update the civ x civ matchup matrices
+#     "sketches": True, # optional, store rating / duration quantile and distinct player sketches
+#     "raw_bson": True, # optional, insert the server engine's documents without decoding them
+#     "source": "/tmp/matches.bson", # optional, read matches from a .bson / .jsonl dump (local runs)
+#     "schema": 2, # optional, 1 | 2, write the compact document encoding
+#     "modes": ["1V1_SUPREMACY", "2V2_SUPREMACY"], # optional, every game mode in one scan, one target each
+#     "win_rates": True, # optional, store Wilson intervals, smoothed win rates and significance flags
+#     "backfill": True, # optional, ingest the range in checkpointed chunks across invocations
+#     "invocation": 1, # set by the continuation event of a backfill
+#     "incremental": True, # optional, $inc the matches inserted since the last hourly run into today's stats
+# }
+# range query example, answered from the container's prefix sums (see range_query.py)
+# event = {
+#     "query": {"civ": "Zeus", "start_date": "09/03/2024", "end_date": "10/10/2024", "elo_bin": "1251-1500"},
 # }
 
 
 def lambda_handler(event, context):
+    global invocation_count
     
     print("EVENT DICT-LIKE:")
     print(event)
 
-    target = db[target_str]
+    # a cold start pays for the imports and, on its first call, for connecting the client
+    started = time.perf_counter()
+    cold = invocation_count == 0
+    invocation_count += 1
+    connected = connect_seconds() is not None
+    metrics = {}
+    start_memory()
+
+    target = get_collection(target_str)
+
+    if "query" in event:
+        # a date range query answered from the warm prefix sums, nothing is ingested
+        query = event["query"]
+        result = range_stats(
+            target,
+            query["civ"],
+            datetime.strptime(query["start_date"], '%m/%d/%Y'),
+            datetime.strptime(query["end_date"], '%m/%d/%Y'),
+            load_god_names(get_collection('major_gods')),
+            query.get("elo_bin"),
+            get_collection(watermark_str),
+        )
+        return {**result, 'start_date': query["start_date"], 'end_date': query["end_date"]}
 
     if "ingest_custom_range" in event:
         ingest_custom_range = event["ingest_custom_range"]
@@ -638,9 +1441,92 @@ def lambda_handler(event, context):
         start_date = None
         end_date = None
 
-    docs = create_daily_stats(target, ingest_custom_range, start_date, end_date)
-    print(f"Created {len(docs)} daily stats documents.")
+    options = dict(
+        partition_days=event.get("partition_days", partition_days),
+        max_workers=event.get("max_workers", max_workers),
+        batch_size=event.get("batch_size", batch_size),
+        write_mode=event.get("write_mode", write_mode),
+        force=event.get("force", False),
+        engine=event.get("engine", engine),
+        variant=event.get("pipeline", stats_pipeline),
+        explain=event.get("explain", explain_runs),
+        create_index=event.get("create_index", create_match_index),
+        rollups=event.get("rollups", update_rollup_docs),
+        timeseries=event.get("timeseries", timeseries_target),
+        export_path=event.get("export_path", stats_export_path),
+        export_format=event.get("export_format", stats_export_format),
+        export_compact=event.get("export_compact", stats_export_compact),
+        matrices=event.get("matrices", update_matrix_docs),
+        sketches=event.get("sketches", stats_sketches),
+        raw_bson=event.get("raw_bson", stats_raw_bson),
+        source=event.get("source", stats_source),
+        schema=event.get("schema", stats_schema),
+        modes=event.get("modes", stats_modes),
+        win_rates=event.get("win_rates", stats_win_rates),
+        metrics=metrics,
+    )
+
+    response = {}
+    bytes_before = received_bytes()
+    if event.get("incremental", False):
+        mode = 'incremental'
+        if options['timeseries']:
+            raise ValueError("Time series targets can't be incremented, run the nightly stats instead")
+        if options['schema'] == SCHEMA_VERSION:
+            raise ValueError("Compact targets can't be incremented, their counts are packed, run the nightly stats instead")
+        count = run_incremental(
+            target,
+            get_collection('matches'),
+            get_collection(watermark_str),
+            load_god_names(get_collection('major_gods')),
+            options['batch_size'],
+        )
+        record(metrics, 'docs_written', count)
+        if options['engine'] == 'server' and options['variant'] in PIPELINE_SOURCES:
+            # keeps player_results within the hour too, the nightly run only syncs the last minutes
+            sync_results(get_collection('matches'), get_collection(player_results_str), get_collection(watermark_str))
+    elif ingest_custom_range and event.get("backfill", False):
+        mode = 'backfill'
+        written = []
+
+        def run_chunk(chunk_start, chunk_end):
+            written.append(create_daily_stats(target, True, chunk_start, chunk_end, **options))
+            return written[-1]
+
+        checkpoint = run_backfill(
+            target,
+            start_date.replace(tzinfo=timezone.utc),
+            end_date.replace(tzinfo=timezone.utc),
+            run_chunk,
+            get_collection(checkpoint_str),
+            context,
+            # a forced backfill starts over, its continuations resume
+            restart=options['force'] and event.get("invocation", 1) == 1,
+        )
+        count = sum(written)
+        response['done'] = checkpoint['done']
+        response['next_date'] = f"{checkpoint['nextDay']:%m/%d/%Y}"
+        if not checkpoint['done']:
+            response['continuation'] = continue_backfill(event, context, event.get("invocation", 1))
+    else:
+        mode = 'custom' if ingest_custom_range else 'nightly'
+        count = create_daily_stats(target, ingest_custom_range, start_date, end_date, **options)
+    print(f"Created {count} daily stats documents.")
+
+    record(metrics, 'import', import_seconds if cold else 0.0)
+    record(metrics, 'connect', 0.0 if connected else connect_seconds())
+    if bytes_before is not None:
+        record(metrics, 'bytes_received', received_bytes() - bytes_before)
+    record(metrics, 'total', time.perf_counter() - started)
+    record_rates(metrics)
+    record_memory(metrics)
+    emit(metrics, {'mode': mode}, event='stats_invocation_metrics', cold=cold, docs=count)
+
+    return {'docs': count, **response}
 
 # for running as script in local testing
 # if __name__ == "__main__":
-#     lambda_handler(event, None)
\ No newline at end of file
+#     lambda_handler(event, None)
+
+# everything above ran at import, ie once per cold start
+import_seconds = time.perf_counter() - import_started
@@ -0,0 +1,316 @@
+import math
+from array import array
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from elo_bins import ELO_BINS, ELO_BIN_EDGES
+from sketches import group_sketches
+
+DAY_MS = 24 * 60 * 60 * 1000
+EPOCH = datetime(1970, 1, 1)
+
+
+# client side civs stats engine -------------------------------------------
+# Same output as civ_stats_pipeline, but the server only filters and projects matches. The
+# $unwind / $group / $facet work runs here on NumPy columns instead of on the shared cluster.
+
+def projected_matches_pipeline(start_date, end_date, game_mode='1V1_SUPREMACY'):
+    """
+    Matches in [start_date, end_date) (ms since epoch) trimmed down to the fields the stats need.
+    game_mode is one gameMode or a list of them, read in the same scan. The matchHistoryMap keeps
+    its shape, each member only keeps civilization_id, outcome, newrating, profile_id and teamid.
+    """
+    return [
+        {
+            '$match': {
+                'gameMode': game_mode if isinstance(game_mode, str) else {'$in': list(game_mode)},
+                'matchDate': {
+                    '$gte': start_date,
+                    '$lt': end_date
+                }
+            }
+        }, {
+            '$project': {
+                '_id': 0,
+                'gameMode': 1,
+                'matchDate': 1,
+                'matchDuration': 1,
+                'mapData.name': 1,
+                'matchHistoryMap': {
+                    '$arrayToObject': {
+                        '$map': {
+                            'input': {'$objectToArray': '$matchHistoryMap'},
+                            'as': 'player',
+                            'in': {
+                                'k': '$$player.k',
+                                'v': {
+                                    '$map': {
+                                        'input': '$$player.v',
+                                        'as': 'member',
+                                        'in': {
+                                            'civilization_id': '$$member.civilization_id',
+                                            'outcome': '$$member.outcome',
+                                            'newrating': '$$member.newrating',
+                                            'profile_id': '$$member.profile_id',
+                                            'teamid': '$$member.teamid'
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    ]
+
+
+def decode_matches(matches, god_names):
+    """
+    Decode match documents into columns with one row per player per match, applying the same
+    rules as the server pipeline: only the first two players count, the average elo is taken over
+    every rating in the match, the opponent is the other player's first civ, mirror matches and
+    rows whose civ or opponent is not a major god are dropped.
+
+    Returns a dict of NumPy arrays (day, civ, opp, win, elo, duration, map, plus the player's own
+    rating and profile id for the sketches, NaN / -1 when unknown) and the opp_names and map_names
+    tables the opp and map codes index into.
+    """
+    opp_names = sorted(set(god_names.values()))
+    opp_codes = {name: code for code, name in enumerate(opp_names)}
+    map_codes = {}
+
+    day = array('q')
+    civ = array('q')
+    opp = array('q')
+    win = array('b')
+    elo = array('d')
+    duration = array('d')
+    map_code = array('q')
+    rating = array('d')
+    player = array('q')
+
+    for match in matches:
+        history = match.get('matchHistoryMap') or {}
+        players = list(history.values())
+        profile_keys = list(history)
+        if len(players) < 2:
+            continue
+
+        ratings = [
+            member['newrating'] for player in players for member in player
+            if isinstance(member.get('newrating'), (int, float))
+        ]
+        avg_elo = sum(ratings) / len(ratings) if ratings else math.nan
+
+        match_day = int(match['matchDate'] // DAY_MS)
+        match_duration = match.get('matchDuration')
+        if not isinstance(match_duration, (int, float)):
+            match_duration = math.nan
+
+        # matches without a map still count towards totals and matchups, just not towards maps
+        map_name = (match.get('mapData') or {}).get('name')
+        if map_name is None:
+            code = -1
+        else:
+            code = map_codes.setdefault(map_name, len(map_codes))
+
+        for index in (0, 1):
+            opp_members = players[1 - index]
+            opp_civ = next((m['civilization_id'] for m in opp_members if 'civilization_id' in m), None)
+            if opp_civ not in god_names:
+                continue
+
+            for member in players[index]:
+                civ_id = member.get('civilization_id')
+                if civ_id not in god_names or civ_id == opp_civ:
+                    continue
+
+                day.append(match_day)
+                civ.append(civ_id)
+                opp.append(opp_codes[god_names[opp_civ]])
+                win.append(member.get('outcome') == 1)
+                elo.append(avg_elo)
+                duration.append(match_duration)
+                map_code.append(code)
+
+                # matchHistoryMap is keyed by profile id, for members that don't carry it
+                own_rating = member.get('newrating')
+                rating.append(own_rating if isinstance(own_rating, (int, float)) else math.nan)
+                profile_id = member.get('profile_id', profile_keys[index])
+                player.append(int(profile_id) if str(profile_id).isdigit() else -1)
+
+    return {
+        'day': np.frombuffer(day, dtype=np.int64),
+        'civ': np.frombuffer(civ, dtype=np.int64),
+        'opp': np.frombuffer(opp, dtype=np.int64),
+        'win': np.frombuffer(win, dtype=np.int8),
+        'elo': np.frombuffer(elo, dtype=np.float64),
+        'duration': np.frombuffer(duration, dtype=np.float64),
+        'map': np.frombuffer(map_code, dtype=np.int64),
+        'rating': np.frombuffer(rating, dtype=np.float64),
+        'player': np.frombuffer(player, dtype=np.int64),
+        'opp_names': opp_names,
+        'map_names': list(map_codes),
+    }
+
+
+def elo_bin_index(elo):
+    """
+    Bin index of every average elo. Matches without any rating land in the first bin, like the
+    server pipeline's $lt against null does.
+    """
+    return np.digitize(np.nan_to_num(elo, nan=0.0), ELO_BIN_EDGES)
+
+
+def counts_by(groups, group_count, win):
+    """
+    Per group (totalResults, totalWins) for rows already labelled with their group index.
+    """
+    totals = np.bincount(groups, minlength=group_count)
+    wins = np.bincount(groups, weights=win, minlength=group_count)
+    return totals, wins.astype(np.int64)
+
+
+def sub_counts(groups, codes, code_count, win):
+    """
+    Counts per (group, code) pair, ie the matchups or maps of every group. Returns the group, code,
+    totalResults and totalWins of each pair that occurs, sorted by group.
+    """
+    pairs, inverse = np.unique(groups * code_count + codes, return_inverse=True)
+    totals, wins = counts_by(inverse.ravel(), len(pairs), win)
+    return pairs // code_count, pairs % code_count, totals, wins
+
+
+def group_rows(columns):
+    """
+    One dense group index per (matchDay, civ_id, elo_bin). Returns the sorted group keys, the group
+    of every row and the (civ_ids, first_day) tables group_meta decodes the keys with.
+    """
+    civ_ids, civ_code = np.unique(columns['civ'], return_inverse=True)
+    elo_bin = elo_bin_index(columns['elo'])
+    first_day = columns['day'].min()
+    keys = ((columns['day'] - first_day) * len(civ_ids) + civ_code.ravel()) * len(ELO_BINS) + elo_bin
+    group_keys, groups = np.unique(keys, return_inverse=True)
+
+    return group_keys, groups.ravel(), (civ_ids, first_day)
+
+
+def group_meta(key, tables):
+    """
+    (matchDay, civ_id, elo bin index) of a group key.
+    """
+    civ_ids, first_day = tables
+    key, bin_index = divmod(key, len(ELO_BINS))
+    day_offset, civ_index = divmod(key, len(civ_ids))
+
+    return EPOCH + timedelta(days=int(first_day) + day_offset), int(civ_ids[civ_index]), bin_index
+
+
+def cell_counts(groups, group_count, win, codes, code_count, rows=None):
+    """
+    Per group cell counts of sub_counts plus the bounds of every group's cells. rows are the rows
+    the cells belong to when they are not one per row (team games have one matchup cell per
+    opponent civ), codes < 0 are skipped.
+    """
+    if rows is None:
+        rows = np.arange(len(codes))
+    rows = rows[codes >= 0]
+    cell_groups, cell_codes, totals, wins = sub_counts(
+        groups[rows], codes[codes >= 0], max(code_count, 1), win[rows]
+    )
+    return cell_codes, totals, wins, np.searchsorted(cell_groups, np.arange(group_count + 1))
+
+
+def cell_dict(cells, names, group):
+    """
+    {name: {totalResults, totalWins}} of one group's cells, cells as returned by cell_counts.
+    """
+    codes, totals, wins, bounds = cells
+    cell_slice = slice(bounds[group], bounds[group + 1])
+    return {
+        names[code]: {'totalResults': total, 'totalWins': won}
+        for code, total, won in zip(
+            codes[cell_slice].tolist(), totals[cell_slice].tolist(), wins[cell_slice].tolist()
+        )
+    }
+
+
+def civ_stats_columnar(matches, god_names, sketches=False):
+    """
+    Compute the daily stats documents for an iterable of match documents (raw or shaped by
+    projected_matches_pipeline). Returns the same documents civ_stats_pipeline would, with
+    sketches a "sketches" field is added to every document.
+    """
+    return columnar_docs(decode_matches(matches, god_names), god_names, sketches)
+
+
+def columnar_docs(columns, god_names, sketches=False):
+    """
+    Daily stats documents of decoded player rows. The matchup cells are opp (one per row) or the
+    opp / opp_row pairs of team games, columns with teammate cells (mate / mate_row) also get a
+    "teammates" field shaped like matchups.
+    """
+    if not len(columns['day']):
+        return []
+
+    group_keys, groups, tables = group_rows(columns)
+    group_count = len(group_keys)
+
+    win = columns['win']
+    totals, wins = counts_by(groups, group_count, win)
+
+    duration = columns['duration']
+    has_duration = ~np.isnan(duration)
+    duration_sum = np.bincount(groups, weights=np.where(has_duration, duration, 0), minlength=group_count)
+    duration_count = np.bincount(groups, weights=has_duration, minlength=group_count)
+
+    opp_names = columns['opp_names']
+    map_names = columns['map_names']
+    opp_cells = cell_counts(groups, group_count, win, columns['opp'], len(opp_names), columns.get('opp_row'))
+    map_cells = cell_counts(groups, group_count, win, columns['map'], len(map_names))
+    if 'mate' in columns:
+        mate_cells = cell_counts(groups, group_count, win, columns['mate'], len(opp_names), columns['mate_row'])
+
+    if sketches:
+        group_sketch = group_sketches(groups, group_count, columns['rating'], duration, columns['player'])
+
+    docs = []
+    for group, key in enumerate(group_keys.tolist()):
+        match_day, civ_id, bin_index = group_meta(key, tables)
+        elo_bin, lower_elo, upper_elo = ELO_BINS[bin_index]
+
+        # matchDuration is stored in whole seconds, keep the sum an int like the server's $sum does
+        total_duration = duration_sum[group].item()
+        if total_duration.is_integer():
+            total_duration = int(total_duration)
+
+        if duration_count[group]:
+            avg_duration_mins = float(duration_sum[group] / duration_count[group] / 60)
+        else:
+            avg_duration_mins = None
+
+        docs.append({
+            'matchDay': match_day,
+            'totalResults': int(totals[group]),
+            'totalWins': int(wins[group]),
+            'durationSum': total_duration,
+            'durationCount': int(duration_count[group]),
+            'avgDurationMins': avg_duration_mins,
+            'matchups': cell_dict(opp_cells, opp_names, group),
+            'maps': cell_dict(map_cells, map_names, group),
+            'metaField': {
+                'civ_id': civ_id,
+                'elo_bin': elo_bin,
+                'god_name': god_names[civ_id],
+                'lower_elo': lower_elo,
+                'upper_elo': upper_elo,
+            },
+        })
+        if 'mate' in columns:
+            docs[-1]['teammates'] = cell_dict(mate_cells, opp_names, group)
+        if sketches:
+            docs[-1]['sketches'] = group_sketch[group]
+
+    return docs
@@ -0,0 +1,215 @@
+import os
+from datetime import datetime, UTC
+
+import numpy as np
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+
+from elo_bins import ELO_BINS
+
+
+# compact daily stats schema -------------------------------------------
+# Version 1 documents (what every pipeline returns) repeat the whole metaField and key matchups
+# and maps by name with nested {totalResults, totalWins} objects. Version 2 keeps integer ids and
+# packs the counts:
+# {
+#     "v": 2,
+#     "matchDay": <date>,
+#     "civ": 1, "bin": 2,                           # civ id, index into the tables' bins
+#     "n": 120, "w": 61, "ds": 81234, "dc": 120,    # totalResults, totalWins, durationSum / Count
+#     "mu": <matchups>, "mp": <maps>,               # packed counts, see pack_counts
+#     "tm": <teammates>,                            # packed like mu, team game mode targets only
+#     "sk": {...},                                  # sketches, when the run stores them
+# }
+# The id tables are stored once per target in SCHEMA_TABLES_STR:
+# {"_id": "daily_stats", "v": 2, "gods": [[1, "Zeus"], ...], "bins": [["0-750", 0, 750], ...],
+#  "maps": ["Acropolis", ...]}
+# Map ids are positions in "maps", which only ever grows. decode_doc turns a version 2 document
+# back into the version 1 shape for readers.
+
+SCHEMA_VERSION = 2
+schema_tables_str = os.getenv("SCHEMA_TABLES_STR", "stats_schema")
+
+COMPACT_KEY = [('civ', 1), ('bin', 1), ('matchDay', 1)]
+
+COUNT_DTYPES = ('<u2', '<u4', '<u4')
+
+
+def pack_counts(cells):
+    """
+    [(id, totalResults, totalWins)] as one Binary: every uint16 id, then every uint32 total, then
+    every uint32 win count, so a cell costs 10 bytes instead of a nested document.
+    """
+    columns = list(zip(*sorted(cells))) or [(), (), ()]
+    return Binary(b''.join(
+        np.array(column, dtype=dtype).tobytes() for column, dtype in zip(columns, COUNT_DTYPES)
+    ))
+
+
+def unpack_counts(blob):
+    """
+    [(id, totalResults, totalWins)] of a pack_counts Binary.
+    """
+    size = len(blob) // 10
+    ids = np.frombuffer(blob, dtype='<u2', count=size)
+    totals = np.frombuffer(blob, dtype='<u4', count=size, offset=2 * size)
+    wins = np.frombuffer(blob, dtype='<u4', count=size, offset=6 * size)
+    return list(zip(ids.tolist(), totals.tolist(), wins.tolist()))
+
+
+def load_tables(tables, target_name):
+    return tables.find_one({'_id': target_name})
+
+
+def ensure_tables(tables, target_name, god_names, map_names=()):
+    """
+    The id tables of target_name with every god of god_names and every map in map_names. New maps
+    are appended with a compare and set on the list's length, so concurrent partitions never hand
+    out the same id twice.
+    """
+    gods = [[god_id, name] for god_id, name in sorted(god_names.items())]
+    bins = [list(elo_bin) for elo_bin in ELO_BINS]
+    while True:
+        doc = load_tables(tables, target_name)
+        if doc is None:
+            try:
+                tables.update_one(
+                    {'_id': target_name},
+                    {'$setOnInsert': {'v': SCHEMA_VERSION, 'gods': gods, 'bins': bins, 'maps': []}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                # another partition created it first
+                pass
+            continue
+
+        changes = {}
+        if doc['gods'] != gods:
+            changes['$set'] = {'gods': gods, 'updatedAt': datetime.now(UTC)}
+        missing = sorted(set(map_names) - set(doc['maps']))
+        if missing:
+            changes['$push'] = {'maps': {'$each': missing}}
+        if not changes:
+            return doc
+
+        # a concurrent writer changed the maps first, retry on its version
+        tables.update_one({'_id': target_name, 'maps': {'$size': len(doc['maps'])}}, changes)
+
+
+def encode_doc(doc, tables):
+    """
+    Version 2 form of a version 1 daily stats document. tables must hold every god and map the
+    document names (see ensure_tables).
+    """
+    god_ids = {name: god_id for god_id, name in tables['gods']}
+    map_ids = {name: map_id for map_id, name in enumerate(tables['maps'])}
+    bin_ids = {label: index for index, (label, _, _) in enumerate(tables['bins'])}
+    meta = doc['metaField']
+
+    compact = {
+        'v': SCHEMA_VERSION,
+        'matchDay': doc['matchDay'],
+        'civ': meta['civ_id'],
+        'bin': bin_ids[meta['elo_bin']],
+        'n': doc['totalResults'],
+        'w': doc['totalWins'],
+        'ds': doc.get('durationSum', 0),
+        'dc': doc.get('durationCount', 0),
+        'mu': pack_counts(
+            (god_ids[name], counts['totalResults'], counts['totalWins'])
+            for name, counts in (doc.get('matchups') or {}).items()
+        ),
+        'mp': pack_counts(
+            (map_ids[name], counts['totalResults'], counts['totalWins'])
+            for name, counts in (doc.get('maps') or {}).items()
+        ),
+    }
+    if 'teammates' in doc:
+        compact['tm'] = pack_counts(
+            (god_ids[name], counts['totalResults'], counts['totalWins'])
+            for name, counts in (doc['teammates'] or {}).items()
+        )
+    if doc.get('sketches'):
+        compact['sk'] = doc['sketches']
+
+    return compact
+
+
+def encode_docs(docs, tables_collection, target_name, god_names):
+    """
+    Encode an iterable of version 1 documents, registering the maps of each batch of 1000 first.
+    """
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == 1000:
+            yield from encode_batch(batch, tables_collection, target_name, god_names)
+            batch = []
+    if batch:
+        yield from encode_batch(batch, tables_collection, target_name, god_names)
+
+
+def encode_batch(batch, tables_collection, target_name, god_names):
+    map_names = {name for doc in batch for name in (doc.get('maps') or {})}
+    tables = ensure_tables(tables_collection, target_name, god_names, map_names)
+    return [encode_doc(doc, tables) for doc in batch]
+
+
+def decode_doc(doc, tables):
+    """
+    Version 1 form of a version 2 document, documents of any other version are returned as is.
+    """
+    if doc.get('v') != SCHEMA_VERSION:
+        return doc
+
+    god_names = dict((god_id, name) for god_id, name in tables['gods'])
+    elo_bin, lower_elo, upper_elo = tables['bins'][doc['bin']]
+    decoded = {
+        'matchDay': doc['matchDay'],
+        'totalResults': doc['n'],
+        'totalWins': doc['w'],
+        'durationSum': doc['ds'],
+        'durationCount': doc['dc'],
+        'avgDurationMins': doc['ds'] / doc['dc'] / 60 if doc['dc'] else None,
+        'matchups': {
+            god_names[god_id]: {'totalResults': total, 'totalWins': won}
+            for god_id, total, won in unpack_counts(doc['mu'])
+        },
+        'maps': {
+            tables['maps'][map_id]: {'totalResults': total, 'totalWins': won}
+            for map_id, total, won in unpack_counts(doc['mp'])
+        },
+        'metaField': {
+            'civ_id': doc['civ'],
+            'elo_bin': elo_bin,
+            'god_name': god_names.get(doc['civ']),
+            'lower_elo': lower_elo,
+            'upper_elo': upper_elo,
+        },
+    }
+    if 'tm' in doc:
+        decoded['teammates'] = {
+            god_names[god_id]: {'totalResults': total, 'totalWins': won}
+            for god_id, total, won in unpack_counts(doc['tm'])
+        }
+    if 'sk' in doc:
+        decoded['sketches'] = doc['sk']
+
+    return decoded
+
+
+def compact_filter(doc):
+    """
+    The upsert filter of a version 2 document, same key as STATS_KEY.
+    """
+    return {'civ': doc['civ'], 'bin': doc['bin'], 'matchDay': doc['matchDay']}
+
+
+def read_stats(target, tables_collection, query=None):
+    """
+    Yield the documents of a version 2 target matching query (on the compact fields) in the
+    version 1 shape.
+    """
+    tables = load_tables(tables_collection, target.name)
+    for doc in target.find(query or {}, {'_id': 0}):
+        yield decode_doc(doc, tables)
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+
+from pymongo import MongoClient
+
+from metrics import listeners
+
+
+# lazy mongo connection -------------------------------------------
+# The client is created on first use instead of at import, and kept for the life of the Lambda
+# container, so warm invocations reuse its pool and only a cold start pays for the SRV lookup and
+# the first handshake.
+
+# auth
+username = os.getenv("MONGO_USER")
+password = os.getenv("MONGO_PASS")
+mongo_url = os.getenv("MONGO_URL")
+db_name = os.getenv("MONGO_DB", "test")
+
+# MONGO_URI overrides the Atlas url ie to point the benchmarks at a local mongod
+full_url = os.getenv("MONGO_URI") or f"mongodb+srv://{username}:{password}@{mongo_url}"
+
+# client params, defaults are pymongo's apart from compression
+max_pool_size = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+min_pool_size = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+connect_timeout_ms = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "20000"))
+server_selection_timeout_ms = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+socket_timeout_ms = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0")) # 0 = no timeout
+# zstd needs the zstandard package and snappy python-snappy, pymongo skips missing ones with a warning
+compressors = os.getenv("MONGO_COMPRESSORS", "zstd,zlib")
+
+_state = {'client': None, 'connect_seconds': None}
+_collections = {}
+_lock = threading.Lock()
+
+
+def client_options():
+    options = {
+        'maxPoolSize': max_pool_size,
+        'minPoolSize': min_pool_size,
+        'connectTimeoutMS': connect_timeout_ms,
+        'serverSelectionTimeoutMS': server_selection_timeout_ms,
+        'socketTimeoutMS': socket_timeout_ms or None,
+    }
+    if compressors:
+        options['compressors'] = compressors
+    # counts the bytes of cursor replies for the invocation metrics
+    options['event_listeners'] = listeners()
+
+    return options
+
+
+def get_client():
+    """
+    The shared MongoClient, created and pinged on the first call of the container. The ping makes
+    the SRV lookup and the first handshake happen here, where they are timed as connect_seconds,
+    instead of inside the first query.
+    """
+    with _lock:
+        if _state['client'] is None:
+            started = time.perf_counter()
+            client = MongoClient(full_url, **client_options())
+            client.admin.command('ping')
+            _state['connect_seconds'] = time.perf_counter() - started
+            _state['client'] = client
+
+        return _state['client']
+
+
+def get_db():
+    return get_client()[db_name]
+
+
+def get_collection(name):
+    """
+    Collection handles are cached too, resolving one is cheap but it happens on every call.
+    """
+    collection = _collections.get(name)
+    if collection is None:
+        collection = _collections.setdefault(name, get_db()[name])
+
+    return collection
+
+
+def connect_seconds():
+    """
+    Seconds the container spent creating and pinging the client, None before the first call.
+    """
+    return _state['connect_seconds']
+
+
+def close_client():
+    with _lock:
+        if _state['client'] is not None:
+            _state['client'].close()
+        _state['client'] = None
+        _state['connect_seconds'] = None
+        _collections.clear()
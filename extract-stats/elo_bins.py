@@ -0,0 +1,16 @@
+# elo bins used by every stats engine -------------------------------------------
+# (elo_bin, lower_elo, upper_elo). A match falls in the bin whose upper bound is the first one
+# above its average rating, anything from 1751 up is in the last bin.
+ELO_BINS = [
+    ('0-750', 0, 750),
+    ('751-1000', 751, 1000),
+    ('1001-1250', 1001, 1250),
+    ('1251-1500', 1251, 1500),
+    ('1501-1750', 1501, 1750),
+    ('1751-2000', 1751, 2000),
+]
+
+# left edges of every bin but the first, ie avg_elo < 751 -> bin 0, avg_elo < 1001 -> bin 1, ...
+ELO_BIN_EDGES = [lower for _, lower, _ in ELO_BINS[1:]]
+
+ELO_BIN_LABELS = [label for label, _, _ in ELO_BINS]
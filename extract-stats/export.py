@@ -0,0 +1,204 @@
+import os
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from watermarks import day_range
+
+
+# columnar snapshot export -------------------------------------------
+# Daily stats documents flattened into one row per (matchDay, civ, elo bin) and written as a hive
+# partitioned Parquet or Arrow IPC dataset:
+#   <path>/daily/matchDay=2024-09-01/elo_bin=751-1000/part-0.parquet
+#   <path>/history/elo_bin=751-1000/part-0.parquet   (optional full history compaction)
+# matchups and maps become columns named like their mongo paths, ie "matchups.Zeus.totalWins".
+# Matchup columns are the same for every file (one per major god), map columns only exist for
+# the maps played, so read several days with a unified schema (pyarrow.unify_schemas).
+# Paths are local directories or s3://bucket/prefix uris. In Lambda the only writable local path
+# is /tmp (gone with the container) and s3 paths need the template's StatsExportBucket parameter
+# for the function's s3 permissions. pyarrow comes from requirements-export.txt.
+# Documents are never all held at once: days are exported one day at a time and the history is
+# streamed into one open writer per elo_bin, HISTORY_BATCH documents per record batch.
+
+# export format -> (pyarrow dataset format, file options). zstd parquet for analysts, uncompressed
+# IPC files can be memory mapped as is.
+FORMATS = {
+    'parquet': ('parquet', lambda: ds.ParquetFileFormat().make_write_options(compression='zstd')),
+    'arrow': ('ipc', lambda: ds.IpcFileFormat().make_write_options(compression=None)),
+}
+
+BASE_COLUMNS = [
+    ('matchDay', pa.date32()),
+    ('elo_bin', pa.string()),
+    ('civ_id', pa.int32()),
+    ('god_name', pa.string()),
+    ('lower_elo', pa.int32()),
+    ('upper_elo', pa.int32()),
+    ('totalResults', pa.int64()),
+    ('totalWins', pa.int64()),
+    ('durationSum', pa.float64()),
+    ('durationCount', pa.int64()),
+    ('avgDurationMins', pa.float64()),
+]
+
+COUNT_FIELDS = ('totalResults', 'totalWins')
+
+HISTORY_BATCH = 1000
+
+
+def stats_table(docs, god_names, map_names=None):
+    """
+    Flatten daily stats documents into an Arrow table: the base columns, then a results and a wins
+    column per major god (0 when the civ never faced it) and per map in map_names, by default
+    every map the documents played.
+    """
+    docs = list(docs)
+    if map_names is None:
+        map_names = sorted({name for doc in docs for name in (doc.get('maps') or {})})
+    opp_names = sorted(set(god_names.values()))
+
+    columns = {name: [] for name, _ in BASE_COLUMNS}
+    for group, names in (('matchups', opp_names), ('maps', map_names)):
+        for name in names:
+            for field in COUNT_FIELDS:
+                columns[f'{group}.{name}.{field}'] = []
+
+    for doc in docs:
+        meta = doc['metaField']
+        columns['matchDay'].append(doc['matchDay'].date())
+        for field in ('elo_bin', 'civ_id', 'god_name', 'lower_elo', 'upper_elo'):
+            columns[field].append(meta[field])
+        for field in ('totalResults', 'totalWins', 'durationSum', 'durationCount', 'avgDurationMins'):
+            columns[field].append(doc.get(field))
+
+        for group, names in (('matchups', opp_names), ('maps', map_names)):
+            counts = doc.get(group) or {}
+            for name in names:
+                cell = counts.get(name) or {}
+                for field in COUNT_FIELDS:
+                    columns[f'{group}.{name}.{field}'].append(cell.get(field, 0))
+
+    types = dict(BASE_COLUMNS)
+    return pa.table({
+        name: pa.array(values, type=types.get(name, pa.int64())) for name, values in columns.items()
+    })
+
+
+def resolve(path):
+    """
+    (filesystem, path inside it) for a local directory or an s3:// style uri.
+    """
+    if '://' in path:
+        return pafs.FileSystem.from_uri(path)
+
+    return pafs.LocalFileSystem(), os.path.abspath(path)
+
+
+def write_table(table, path, partitions, fmt='parquet'):
+    """
+    Write table as a hive partitioned dataset under path. Partitions already holding data for the
+    same keys are replaced, so re-exporting a day never duplicates it.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {list(FORMATS)}")
+
+    file_format, file_options = FORMATS[fmt]
+    filesystem, base = resolve(path)
+    ds.write_dataset(
+        table,
+        base,
+        filesystem=filesystem,
+        format=file_format,
+        file_options=file_options(),
+        partitioning=partitions,
+        partitioning_flavor='hive',
+        basename_template=f"part-{{i}}.{fmt}",
+        existing_data_behavior='delete_matching',
+    )
+
+
+def export_days(target, ranges, god_names, path, fmt='parquet'):
+    """
+    Export the daily stats documents of target in the [start, end) ranges to <path>/daily,
+    partitioned by matchDay and elo_bin, one day at a time. Returns the number of exported rows.
+    """
+    rows = 0
+    for start, end in ranges:
+        for day in day_range(start, end):
+            table = stats_table(target.find({'matchDay': day}, {'_id': 0, 'sketches': 0}), god_names)
+            if table.num_rows:
+                write_table(table, f"{path.rstrip('/')}/daily", ['matchDay', 'elo_bin'], fmt)
+            rows += table.num_rows
+
+    return rows
+
+
+def played_maps(target):
+    """
+    Every map name of target's documents, the map columns of a history file.
+    """
+    return sorted(doc['_id'] for doc in target.aggregate([
+        {'$project': {'maps': {'$objectToArray': {'$ifNull': ['$maps', {}]}}}},
+        {'$unwind': '$maps'},
+        {'$group': {'_id': '$maps.k'}},
+    ]))
+
+
+def open_writer(filesystem, file_path, schema, fmt):
+    """
+    (writer, sink) of one history file, closing the writer leaves the sink open.
+    """
+    sink = filesystem.open_output_stream(file_path)
+    if fmt == 'parquet':
+        return pq.ParquetWriter(sink, schema, compression='zstd'), sink
+
+    return pa.ipc.new_file(sink, schema), sink
+
+
+def export_history(target, god_names, path, fmt='parquet'):
+    """
+    Compact the whole history of target into one file per elo_bin under <path>/history, sorted by
+    day and civ. The sorted cursor is streamed HISTORY_BATCH documents at a time into the open
+    file of each batch's elo bins. Returns the number of exported rows.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {list(FORMATS)}")
+
+    filesystem, base = resolve(f"{path.rstrip('/')}/history")
+    map_names = played_maps(target)
+    docs = target.find({}, {'_id': 0, 'sketches': 0}).sort([('matchDay', 1), ('metaField.civ_id', 1)])
+
+    writers = {}
+    rows = 0
+
+    def write(batch):
+        table = stats_table(batch, god_names, map_names)
+        for elo_bin in sorted(set(table.column('elo_bin').to_pylist())):
+            # the elo_bin column lives in the hive directory name, like write_table's partitions
+            rows_of_bin = table.filter(pc.equal(table.column('elo_bin'), elo_bin)).drop_columns(['elo_bin'])
+            if elo_bin not in writers:
+                directory = f"{base}/elo_bin={elo_bin}"
+                filesystem.create_dir(directory)
+                filesystem.delete_dir_contents(directory)
+                writers[elo_bin] = open_writer(filesystem, f"{directory}/part-0.{fmt}", rows_of_bin.schema, fmt)
+            writers[elo_bin][0].write_table(rows_of_bin)
+        return table.num_rows
+
+    try:
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) == HISTORY_BATCH:
+                rows += write(batch)
+                batch = []
+        if batch:
+            rows += write(batch)
+    finally:
+        for writer, sink in writers.values():
+            writer.close()
+            sink.close()
+
+    return rows
@@ -0,0 +1,132 @@
+import mmap
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import bson
+from bson import json_util
+
+from columnar_stats import civ_stats_columnar
+
+
+# file backed match source -------------------------------------------
+# Matches read from a local dump instead of the matches collection, so history can be recomputed
+# on a laptop or in CI without touching the cluster:
+#   mongodump --collection matches          -> matches.bson
+#   mongoexport --collection matches        -> matches.jsonl (extended JSON, one match per line)
+#   mongoexport --collection matches --jsonArray -> matches.json (one extended JSON array, loaded whole)
+# Files are memory mapped and decoded one document at a time, then filtered on gameMode and
+# matchDate like the stats $match. The stats themselves come from the numpy engine
+# (columnar_stats), which takes raw match documents.
+
+BSON_SUFFIXES = ('.bson',)
+JSONL_SUFFIXES = ('.jsonl', '.ndjson', '.json')
+
+
+def scan_bson(path):
+    """
+    Yield every document of a mongodump .bson file, a plain concatenation of BSON documents.
+    """
+    if not os.path.getsize(path):
+        return
+
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            offset = 0
+            while offset < len(view):
+                length = int.from_bytes(view[offset:offset + 4], 'little')
+                yield bson.decode(view[offset:offset + length])
+                offset += length
+        finally:
+            view.release()
+
+
+def scan_jsonl(path):
+    """
+    Yield every document of a mongoexport JSON lines file, extended JSON types included. A
+    --jsonArray export (the file starts with "[") is parsed as a whole instead, it has no line
+    boundaries to stream on.
+    """
+    if not os.path.getsize(path):
+        return
+
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if mapped[:64].lstrip().startswith(b'['):
+            docs = json_util.loads(mapped[:])
+            if not isinstance(docs, list):
+                raise ValueError(f"{path} starts with '[' but is not a JSON array of documents")
+            yield from docs
+            return
+
+        for line in iter(mapped.readline, b''):
+            if line.strip():
+                yield json_util.loads(line)
+
+
+def scan(path):
+    """
+    Yield the documents of a .bson or .jsonl dump, picked by the file's suffix.
+    """
+    if path.endswith(BSON_SUFFIXES):
+        return scan_bson(path)
+    if path.endswith(JSONL_SUFFIXES):
+        return scan_jsonl(path)
+
+    raise ValueError(f"Unknown dump format {path!r}, expected one of {BSON_SUFFIXES + JSONL_SUFFIXES}")
+
+
+def file_matches(path, start_date, end_date, game_mode='1V1_SUPREMACY'):
+    """
+    The matches of a dump with the given gameMode (or any of a list of them) and a matchDate in
+    [start_date, end_date) (midnight UTC datetimes).
+    """
+    game_modes = {game_mode} if isinstance(game_mode, str) else set(game_mode)
+    start_ms = start_date.timestamp() * 1000
+    end_ms = end_date.timestamp() * 1000
+    for match in scan(path):
+        match_date = match.get('matchDate')
+        # null or missing dates never match, like the stats $match range
+        if not isinstance(match_date, (int, float)):
+            continue
+        if match.get('gameMode') in game_modes and start_ms <= match_date < end_ms:
+            yield match
+
+
+def file_god_names(path):
+    """
+    The {id: name} table of a major_gods dump, what load_god_names returns for the collection.
+    """
+    return {doc['id']: doc['name'] for doc in scan(path)}
+
+
+def write_jsonl(docs, path):
+    """
+    Write stats documents as extended JSON lines. Returns the number of written documents.
+    """
+    count = 0
+    with open(path, 'w') as file:
+        for doc in docs:
+            file.write(json_util.dumps(doc, json_options=json_util.RELAXED_JSON_OPTIONS) + '\n')
+            count += 1
+
+    return count
+
+
+def main(matches_path, gods_path, start, end, out_path):
+    start_date, end_date = (
+        datetime.strptime(day, '%m/%d/%Y').replace(tzinfo=timezone.utc) for day in (start, end)
+    )
+    started = time.perf_counter()
+    docs = civ_stats_columnar(file_matches(matches_path, start_date, end_date), file_god_names(gods_path))
+    count = write_jsonl(docs, out_path)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {count} daily stats documents from {matches_path} to {out_path} in {elapsed:.2f}s")
+
+
+# without any mongo, stats of a dump straight into a JSON lines file:
+#   python file_source.py matches.bson major_gods.bson 08/26/2024 09/17/2024 daily_stats.jsonl
+# create_daily_stats(source=...) instead writes into the MONGO_URI target, ie a local mongod.
+if __name__ == "__main__":
+    main(*sys.argv[1:6])
@@ -0,0 +1,140 @@
+import math
+import os
+from array import array
+
+import numpy as np
+
+from columnar_stats import DAY_MS, columnar_docs
+
+
+# multi mode stats -------------------------------------------
+# Every game mode's daily stats from one scan of matches: the projected matches of all modes are
+# read once, split by gameMode and aggregated per mode by the numpy engine. Players are grouped
+# into teams by teamid instead of the two player swap of the 1v1 pipelines, so each player row
+# carries the set of civs it faced and the set it played with:
+#   matchups  -> every distinct opponent civ of the row, other than the player's own
+#   teammates -> every distinct civ of the player's teammates (team modes only)
+# A row is dropped when the player or every opponent is not a major god, or when every opponent
+# played the player's own civ, which keeps 1V1_SUPREMACY documents identical to the 1v1 engines.
+# Each mode has its own target, see mode_target_name.
+
+BASE_MODE = '1V1_SUPREMACY'
+
+# comma separated gameModes, empty for the 1V1_SUPREMACY only runs
+stats_modes = [mode for mode in os.getenv("STATS_MODES", "").split(",") if mode]
+
+# the modes the leaderboard extractor tracks: 1v1 and team supremacy and deathmatch
+LEADERBOARD_MODES = [
+    '1V1_SUPREMACY', '2V2_SUPREMACY', '3V3_SUPREMACY', '4V4_SUPREMACY',
+    '1V1_DEATHMATCH', '2V2_DEATHMATCH', '3V3_DEATHMATCH', '4V4_DEATHMATCH',
+]
+
+
+def mode_target_name(target_name, mode):
+    """
+    Target collection of a mode's documents: target_name itself for 1V1_SUPREMACY, so existing
+    readers keep their collection, "<target_name>_<mode>" (lower case) for every other mode.
+    """
+    return target_name if mode == BASE_MODE else f"{target_name}_{mode.lower()}"
+
+
+def decode_mode_matches(matches, god_names, modes):
+    """
+    Decode match documents of several game modes into one set of columns per mode, see
+    decode_matches for the row columns. Matchups and teammates are cells of their own since a row
+    faces several civs in team games: opp / opp_row (the opponent's code and the row it belongs
+    to) and mate / mate_row. Modes without any teammate cell have no mate columns. Members
+    without a teamid play on a team of their own.
+    """
+    opp_names = sorted(set(god_names.values()))
+    opp_codes = {name: code for code, name in enumerate(opp_names)}
+    map_codes = {}
+
+    fields = {
+        'day': 'q', 'civ': 'q', 'win': 'b', 'elo': 'd', 'duration': 'd', 'map': 'q', 'rating': 'd',
+        'player': 'q', 'opp': 'q', 'opp_row': 'q', 'mate': 'q', 'mate_row': 'q',
+    }
+    columns = {mode: {field: array(code) for field, code in fields.items()} for mode in modes}
+
+    for match in matches:
+        mode_columns = columns.get(match.get('gameMode'))
+        history = match.get('matchHistoryMap') or {}
+        if mode_columns is None or len(history) < 2:
+            continue
+
+        members = [
+            (member.get('teamid', position), profile_key, member)
+            for position, (profile_key, player) in enumerate(history.items())
+            for member in player
+        ]
+        ratings = [
+            member['newrating'] for *_, member in members if isinstance(member.get('newrating'), (int, float))
+        ]
+        avg_elo = sum(ratings) / len(ratings) if ratings else math.nan
+
+        match_day = int(match['matchDate'] // DAY_MS)
+        match_duration = match.get('matchDuration')
+        if not isinstance(match_duration, (int, float)):
+            match_duration = math.nan
+
+        map_name = (match.get('mapData') or {}).get('name')
+        code = -1 if map_name is None else map_codes.setdefault(map_name, len(map_codes))
+
+        for index, (team, profile_key, member) in enumerate(members):
+            civ_id = member.get('civilization_id')
+            if civ_id not in god_names:
+                continue
+
+            opponents = {
+                other.get('civilization_id') for other_team, _, other in members if other_team != team
+            }
+            opponents = sorted(opp_codes[god_names[opp]] for opp in opponents if opp in god_names and opp != civ_id)
+            if not opponents:
+                continue
+            mates = sorted({
+                opp_codes[god_names[other['civilization_id']]]
+                for other_index, (other_team, _, other) in enumerate(members)
+                if other_team == team and other_index != index and other.get('civilization_id') in god_names
+            })
+
+            row = len(mode_columns['day'])
+            mode_columns['day'].append(match_day)
+            mode_columns['civ'].append(civ_id)
+            mode_columns['win'].append(member.get('outcome') == 1)
+            mode_columns['elo'].append(avg_elo)
+            mode_columns['duration'].append(match_duration)
+            mode_columns['map'].append(code)
+
+            own_rating = member.get('newrating')
+            mode_columns['rating'].append(own_rating if isinstance(own_rating, (int, float)) else math.nan)
+            profile_id = member.get('profile_id', profile_key)
+            mode_columns['player'].append(int(profile_id) if str(profile_id).isdigit() else -1)
+
+            mode_columns['opp'].extend(opponents)
+            mode_columns['opp_row'].extend([row] * len(opponents))
+            mode_columns['mate'].extend(mates)
+            mode_columns['mate_row'].extend([row] * len(mates))
+
+    decoded = {}
+    for mode, mode_columns in columns.items():
+        dtypes = {'q': np.int64, 'b': np.int8, 'd': np.float64}
+        decoded[mode] = {
+            field: np.frombuffer(values, dtype=dtypes[values.typecode]) for field, values in mode_columns.items()
+        }
+        if not len(decoded[mode]['mate']):
+            del decoded[mode]['mate'], decoded[mode]['mate_row']
+        decoded[mode]['opp_names'] = opp_names
+        decoded[mode]['map_names'] = list(map_codes)
+
+    return decoded
+
+
+def mode_stats(matches, god_names, modes, sketches=False):
+    """
+    {mode: daily stats documents} of an iterable of match documents of any of modes, raw or shaped
+    by projected_matches_pipeline(..., modes).
+    """
+    return {
+        mode: columnar_docs(columns, god_names, sketches)
+        for mode, columns in decode_mode_matches(matches, god_names, modes).items()
+    }
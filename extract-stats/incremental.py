@@ -0,0 +1,150 @@
+import os
+from datetime import datetime, timedelta, timezone, UTC
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from pipeline_builder import build_stages
+from rollups import increments, avg_duration_expr
+from watermarks import completed_days, mark_dirty
+from compact_schema import schema_tables_str, load_tables
+
+
+# hourly incremental stats -------------------------------------------
+# Between nightly runs the stats of the matches inserted since the last run are $inc'ed into the
+# daily stats documents, so today is visible within the hour. New matches are found by their _id:
+# the match extractor upserts them and the server stamps every new _id with its insert time.
+# The last processed _id is kept in the watermarks collection:
+# {"_id": {"target": "daily_stats", "kind": "incremental"}, "lastMatchId": <ObjectId>, ...}
+#
+# Days already completed by a full run are never incremented, a late match only marks them dirty.
+# The nightly run then recomputes yesterday and every dirty day from scratch with upserts, which
+# is the reconciliation pass that fixes anything the increments got wrong.
+
+# matches younger than this are left to the next run, an _id is taken before its insert commits
+settle_secs = int(os.getenv("INCREMENTAL_SETTLE_SECS", "60"))
+
+
+def state_id(target_name):
+    return {'target': target_name, 'kind': 'incremental'}
+
+
+def last_match_id(watermarks, target_name):
+    state = watermarks.find_one({'_id': state_id(target_name)})
+    return state['lastMatchId'] if state else None
+
+
+def save_match_id(watermarks, target_name, match_id, matches, docs):
+    watermarks.update_one(
+        {'_id': state_id(target_name)},
+        {
+            '$set': {'target': target_name, 'lastMatchId': match_id, 'updatedAt': datetime.now(UTC)},
+            '$inc': {'runs': 1, 'matches': matches, 'docs': docs},
+        },
+        upsert=True,
+    )
+
+
+def delta_pipeline(after_id, until_id, god_names, game_mode='1V1_SUPREMACY'):
+    """
+    The minimal stats pipeline over the matches with after_id < _id <= until_id instead of a
+    matchDate range. Documents come out per (civ, elo bin, matchDay) like a full run's.
+    """
+    stages = [
+        {
+            '$match': {
+                'gameMode': game_mode,
+                '_id': {'$gt': after_id, '$lte': until_id}
+            }
+        }
+    ]
+    for name, step in build_stages(0, 0, god_names, game_mode):
+        if name != 'match':
+            stages += step
+
+    return stages
+
+
+def increment_ops(docs, done):
+    """
+    $inc upserts of delta documents into their day's stats documents. Returns (operations, touched
+    days, late days), documents of a day in done are skipped and reported as late.
+    """
+    operations = []
+    touched = set()
+    late = set()
+    for doc in docs:
+        day = doc['matchDay'].replace(tzinfo=timezone.utc)
+        if day in done:
+            late.add(day)
+            continue
+
+        touched.add(day)
+        meta = doc['metaField']
+        operations.append(UpdateOne(
+            {'metaField.civ_id': meta['civ_id'], 'metaField.elo_bin': meta['elo_bin'], 'matchDay': doc['matchDay']},
+            {
+                '$inc': increments(doc),
+                # civ_id and elo_bin are inserted from the filter, setting metaField would conflict
+                '$setOnInsert': {
+                    f'metaField.{field}': value for field, value in meta.items() if field not in ('civ_id', 'elo_bin')
+                },
+            },
+            upsert=True,
+        ))
+
+    return operations, touched, late
+
+
+def run_incremental(target, matches, watermarks, god_names, batch_size=1000):
+    """
+    Fold the matches inserted since the last run into target's daily stats documents. The first
+    run starts at the matches inserted since midnight UTC. Returns the number of stats documents
+    incremented or created. Only version 1 documents can be incremented, compact (version 2)
+    targets raise.
+    """
+    # every compact target registers its id tables, a point lookup instead of scanning target
+    if load_tables(target.database[schema_tables_str], target.name) is not None:
+        raise ValueError(f"{target.name} holds compact documents, their packed counts can't be $inc'ed")
+
+    after_id = last_match_id(watermarks, target.name)
+    if after_id is None:
+        today = datetime.now(UTC).replace(hour=0, minute=0, second=0, microsecond=0)
+        after_id = ObjectId.from_datetime(today)
+
+    # ObjectId.from_datetime is the smallest id of its second, so <= it stays behind the settle lag
+    until_id = ObjectId.from_datetime(datetime.now(UTC) - timedelta(seconds=settle_secs))
+    if until_id <= after_id:
+        print("No settled matches since the last incremental run")
+        return 0
+
+    new_matches = matches.count_documents({'_id': {'$gt': after_id, '$lte': until_id}})
+    docs = list(matches.aggregate(delta_pipeline(after_id, until_id, god_names), batchSize=batch_size))
+
+    count = 0
+    if docs:
+        days = [doc['matchDay'].replace(tzinfo=timezone.utc) for doc in docs]
+        done = completed_days(watermarks, target.name, min(days), max(days) + timedelta(days=1))
+        operations, touched, late = increment_ops(docs, done)
+
+        for start in range(0, len(operations), batch_size):
+            result = target.bulk_write(operations[start:start + batch_size], ordered=False)
+            count += result.modified_count + result.upserted_count
+
+        if touched:
+            target.update_many(
+                {'matchDay': {'$in': sorted(touched)}},
+                [{'$set': {'avgDurationMins': avg_duration_expr()}}],
+            )
+        if late:
+            mark_dirty(watermarks, target.name, sorted(late))
+            print(f"Marked {len(late)} completed days dirty for late matches: {[f'{day:%m/%d/%Y}' for day in sorted(late)]}")
+
+    save_match_id(watermarks, target.name, until_id, new_matches, count)
+    print(f"Incremented {count} stats documents from {new_matches} new matches")
+
+    return count
+
+
+def has_incremental_state(watermarks, target_name):
+    return last_match_id(watermarks, target_name) is not None
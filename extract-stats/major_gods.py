@@ -0,0 +1,52 @@
+import os
+import threading
+import time
+
+
+# how long a warm container trusts its copy of the major_gods table
+god_cache_ttl = int(os.getenv("GOD_CACHE_TTL", "3600")) # seconds
+
+_cache = {'names': None, 'loaded_at': 0.0}
+_lock = threading.Lock()
+
+
+def load_god_names(major_gods, ttl=god_cache_ttl):
+    """
+    Return the major_gods table as an {id: name} dict. The table is read once per warm Lambda
+    container and re-read after ttl seconds, so stats runs never join against it per document.
+    """
+    with _lock:
+        expired = time.monotonic() - _cache['loaded_at'] > ttl
+        if _cache['names'] is None or expired:
+            _cache['names'] = {
+                doc['id']: doc['name'] for doc in major_gods.find({}, {'_id': 0, 'id': 1, 'name': 1})
+            }
+            _cache['loaded_at'] = time.monotonic()
+
+        return _cache['names']
+
+
+def clear_god_names():
+    with _lock:
+        _cache['names'] = None
+        _cache['loaded_at'] = 0.0
+
+
+def god_name_expr(field, god_names):
+    """
+    Aggregation expression mapping the civ id in field to its god name with a literal $switch, or
+    null when the id is not a major god.
+    """
+    # $switch needs at least one branch
+    if not god_names:
+        return None
+
+    return {
+        '$switch': {
+            'branches': [
+                {'case': {'$eq': [field, god_id]}, 'then': name}
+                for god_id, name in sorted(god_names.items())
+            ],
+            'default': None
+        }
+    }
@@ -0,0 +1,246 @@
+import os
+from datetime import datetime, timedelta, timezone, UTC
+
+import numpy as np
+from bson import Binary
+
+from elo_bins import ELO_BIN_LABELS
+from win_rates import win_rate_arrays
+
+
+# civ x civ matchup matrices -------------------------------------------
+# One document per (elo_bin, window) holding dense wins / totals matrices, row = civ, column =
+# opponent, both indexed by the position of the civ id in civ_ids:
+# {
+#     "_id": {"elo_bin": "751-1000", "window": 30},   # window in days, 0 = all time
+#     "civ_ids": [1, 2, ...],
+#     "names": ["Zeus", "Hades", ...],
+#     "wins": <int32 little endian bytes, len(civ_ids) x len(civ_ids)>,
+#     "totals": <same>,
+#     "winLow", "winHigh", "winSmoothed": <float32 little endian bytes, same shape>,   # see win_rates.py
+#     "significant": <uint8 bytes, same shape, 1 when the interval excludes 50%>,
+#     "through": <date>,                               # last day of the window
+#     "updatedAt": <date>,
+# }
+# A window ends at the last ingested day. When the next days land the new days are added and the
+# days that slid out of the window subtracted, anything else rebuilds the window from the daily
+# stats documents.
+
+# windows in days, "all" = since release
+matrix_windows = [
+    0 if window == 'all' else int(window)
+    for window in os.getenv("MATRIX_WINDOWS", "7,30,all").split(",")
+]
+
+DTYPE = np.dtype('<i4')
+RATE_DTYPE = np.dtype('<f4')
+RATE_FIELDS = ('winLow', 'winHigh', 'winSmoothed')
+
+
+def day_counts(target, start_date, end_date, civ_ids, god_names):
+    """
+    (wins, totals) arrays shaped (elo bins, civs, civs) summed over the daily stats documents of
+    [start_date, end_date), either bound may be None for an open range.
+    """
+    size = len(civ_ids)
+    wins = np.zeros((len(ELO_BIN_LABELS), size, size), dtype=np.int64)
+    totals = np.zeros_like(wins)
+
+    civ_index = {civ_id: index for index, civ_id in enumerate(civ_ids)}
+    name_index = {name: civ_index[civ_id] for civ_id, name in god_names.items()}
+    bin_index = {label: index for index, label in enumerate(ELO_BIN_LABELS)}
+
+    match_day = {}
+    if start_date is not None:
+        match_day['$gte'] = start_date
+    if end_date is not None:
+        match_day['$lt'] = end_date
+
+    cells = []
+    docs = target.find(
+        {'matchDay': match_day} if match_day else {},
+        {'_id': 0, 'metaField.civ_id': 1, 'metaField.elo_bin': 1, 'matchups': 1},
+    )
+    for doc in docs:
+        row = civ_index.get(doc['metaField']['civ_id'])
+        if row is None:
+            continue
+        elo_bin = bin_index[doc['metaField']['elo_bin']]
+        for name, counts in (doc.get('matchups') or {}).items():
+            column = name_index.get(name)
+            if column is not None:
+                cells.append((elo_bin, row, column, counts['totalWins'], counts['totalResults']))
+
+    if cells:
+        elo_bins, rows, columns, cell_wins, cell_totals = np.array(cells, dtype=np.int64).T
+        np.add.at(wins, (elo_bins, rows, columns), cell_wins)
+        np.add.at(totals, (elo_bins, rows, columns), cell_totals)
+
+    return wins, totals
+
+
+def matrix_doc(elo_bin, window, civ_ids, god_names, wins, totals, through):
+    rates = win_rate_arrays(wins, totals)
+    return {
+        '_id': {'elo_bin': elo_bin, 'window': window},
+        'civ_ids': civ_ids,
+        'names': [god_names[civ_id] for civ_id in civ_ids],
+        'wins': Binary(wins.astype(DTYPE).tobytes()),
+        'totals': Binary(totals.astype(DTYPE).tobytes()),
+        **{field: Binary(rates[field].astype(RATE_DTYPE).tobytes()) for field in RATE_FIELDS},
+        'significant': Binary(rates['significant'].astype(np.uint8).tobytes()),
+        'through': through,
+        'updatedAt': datetime.now(UTC),
+    }
+
+
+def stored_window(matrices, window, civ_ids):
+    """
+    (wins, totals, through) of every elo bin of a stored window, None when it is missing or was
+    built for other civs.
+    """
+    docs = {doc['_id']['elo_bin']: doc for doc in matrices.find({'_id.window': window})}
+    if set(docs) != set(ELO_BIN_LABELS) or any(doc['civ_ids'] != civ_ids for doc in docs.values()):
+        return None
+
+    size = len(civ_ids)
+    wins = np.stack([
+        np.frombuffer(docs[label]['wins'], dtype=DTYPE).reshape(size, size) for label in ELO_BIN_LABELS
+    ]).astype(np.int64)
+    totals = np.stack([
+        np.frombuffer(docs[label]['totals'], dtype=DTYPE).reshape(size, size) for label in ELO_BIN_LABELS
+    ]).astype(np.int64)
+    # mongo hands dates back naive, they are always UTC
+    through = docs[ELO_BIN_LABELS[0]]['through'].replace(tzinfo=timezone.utc)
+
+    return wins, totals, through
+
+
+def update_window(target, matrices, window, days, god_names):
+    """
+    Bring the matrices of one window up to date after days (midnight UTC) were written to target.
+    Returns "incremental" or "rebuilt".
+    """
+    civ_ids = sorted(god_names)
+    one_day = timedelta(days=1)
+    stored = stored_window(matrices, window, civ_ids)
+
+    # incremental only when the new days directly follow the stored window
+    follows = (
+        stored is not None
+        and days[0] == stored[2] + one_day
+        and all(later - earlier == one_day for earlier, later in zip(days, days[1:]))
+    )
+
+    if follows:
+        wins, totals, through = stored
+        new_wins, new_totals = day_counts(target, through + one_day, days[-1] + one_day, civ_ids, god_names)
+        wins += new_wins
+        totals += new_totals
+        if window:
+            old_wins, old_totals = day_counts(
+                target, through + one_day - timedelta(days=window), days[-1] + one_day - timedelta(days=window),
+                civ_ids, god_names,
+            )
+            wins -= old_wins
+            totals -= old_totals
+        through = days[-1]
+        mode = 'incremental'
+    else:
+        through = max(days[-1], stored[2]) if stored is not None else days[-1]
+        start = through + one_day - timedelta(days=window) if window else None
+        wins, totals = day_counts(target, start, through + one_day, civ_ids, god_names)
+        mode = 'rebuilt'
+
+    for index, label in enumerate(ELO_BIN_LABELS):
+        doc = matrix_doc(label, window, civ_ids, god_names, wins[index], totals[index], through)
+        matrices.replace_one({'_id': doc['_id']}, doc, upsert=True)
+
+    return mode
+
+
+def update_matrices(target, matrices, days, god_names, windows=matrix_windows):
+    """
+    Update every window's matchup matrices for the days just written to target. Returns
+    {window: "incremental" | "rebuilt"}.
+    """
+    days = sorted({day if day.tzinfo else day.replace(tzinfo=timezone.utc) for day in days})
+    if not days or not god_names:
+        return {}
+
+    return {window: update_window(target, matrices, window, days, god_names) for window in windows}
+
+
+# query api -------------------------------------------
+
+def load_matrix(matrices, elo_bin, window):
+    """
+    The stored matrix of one elo bin and window as a dict of NumPy arrays plus a lookup table from
+    civ id and god name to row, or None if it was never built. Matrices stored before the win rate
+    fields get them computed on load.
+    """
+    doc = matrices.find_one({'_id': {'elo_bin': elo_bin, 'window': window}})
+    if doc is None:
+        return None
+
+    size = len(doc['civ_ids'])
+    index = {civ_id: position for position, civ_id in enumerate(doc['civ_ids'])}
+    index.update({name: position for position, name in enumerate(doc['names'])})
+
+    wins = np.frombuffer(doc['wins'], dtype=DTYPE).reshape(size, size)
+    totals = np.frombuffer(doc['totals'], dtype=DTYPE).reshape(size, size)
+    if 'significant' in doc:
+        rates = {field: np.frombuffer(doc[field], dtype=RATE_DTYPE).reshape(size, size) for field in RATE_FIELDS}
+        rates['significant'] = np.frombuffer(doc['significant'], dtype=np.uint8).reshape(size, size).astype(bool)
+    else:
+        rates = {field: values for field, values in win_rate_arrays(wins, totals).items() if field != 'winRate'}
+
+    return {
+        'elo_bin': elo_bin,
+        'window': window,
+        'through': doc['through'],
+        'civ_ids': doc['civ_ids'],
+        'names': doc['names'],
+        'index': index,
+        'wins': wins,
+        'totals': totals,
+        **rates,
+    }
+
+
+def win_rate(matrix, civ, opponent):
+    """
+    Win rate of civ against opponent (civ ids or god names), None when they never met.
+    """
+    row, column = matrix['index'][civ], matrix['index'][opponent]
+    total = matrix['totals'][row, column]
+    if not total:
+        return None
+
+    return float(matrix['wins'][row, column] / total)
+
+
+def matchup_row(matrix, civ):
+    """
+    {opponent name: {totalResults, totalWins, winRate, winLow, winHigh, winSmoothed, significant}} of
+    civ (civ id or god name) against every opponent it met.
+    """
+    row = matrix['index'][civ]
+    wins, totals = matrix['wins'][row], matrix['totals'][row]
+    rates = zip(*(matrix[field][row].tolist() for field in RATE_FIELDS + ('significant',)))
+
+    return {
+        name: {
+            'totalResults': int(total),
+            'totalWins': int(won),
+            'winRate': float(won / total),
+            'winLow': low,
+            'winHigh': high,
+            'winSmoothed': smoothed,
+            'significant': significant,
+        }
+        for name, won, total, (low, high, smoothed, significant) in zip(
+            matrix['names'], wins.tolist(), totals.tolist(), rates
+        )
+        if total
+    }
@@ -0,0 +1,170 @@
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import bson
+from pymongo import monitoring
+
+
+# invocation metrics -------------------------------------------
+# Every invocation fills one metrics dict ({name: value}, partitions merge into it from their
+# threads) and prints it as a single CloudWatch Embedded Metric Format line. CloudWatch turns the
+# line into metrics under METRICS_NAMESPACE without any API call, locally it is just a JSON line
+# on stdout:
+# {"_aws": {"Timestamp": ..., "CloudWatchMetrics": [{"Namespace": "AomStats", "Dimensions": [["mode"]],
+#  "Metrics": [{"Name": "total", "Unit": "Seconds"}, ...]}]}, "mode": "nightly", "total": 12.3, ...}
+
+namespace = os.getenv("METRICS_NAMESPACE", "AomStats")
+# count the bytes of every cursor reply, costs re-encoding the replies so it is off in production,
+# the benchmarks turn it on to compare bytes off the wire
+count_bytes = os.getenv("METRICS_BYTES", "false").lower() == "true"
+# python heap peak on top of the RSS peak, tracemalloc slows allocations down noticeably
+trace_memory = os.getenv("METRICS_TRACEMALLOC", "false").lower() == "true"
+
+# name -> (CloudWatch unit, how the values of several partitions combine)
+METRICS = {
+    'import': ('Seconds', 'sum'),
+    'connect': ('Seconds', 'sum'),
+    'pipeline_build': ('Seconds', 'sum'),
+    'first_batch': ('Seconds', 'min'),
+    'drain': ('Seconds', 'sum'),
+    'insert': ('Seconds', 'sum'),
+    'total': ('Seconds', 'sum'),
+    'days': ('Count', 'sum'),
+    'batches': ('Count', 'sum'),
+    'docs_read': ('Count', 'sum'),
+    'docs_written': ('Count', 'sum'),
+    'read_rate': ('Count/Second', 'max'),
+    'write_rate': ('Count/Second', 'max'),
+    'bytes_received': ('Bytes', 'sum'),
+    'container_peak_rss': ('Megabytes', 'max'),
+    'peak_traced': ('Megabytes', 'max'),
+}
+
+COMBINE = {'sum': lambda old, new: old + new, 'min': min, 'max': max}
+
+# cursor replies whose size counts as received
+CURSOR_COMMANDS = {'aggregate', 'find', 'getMore'}
+
+_lock = threading.Lock()
+_received = {'bytes': 0}
+
+
+def record(metrics, name, value):
+    """
+    Merge value into metrics[name] the way METRICS combines it, a no-op without a metrics dict or
+    a value.
+    """
+    if metrics is None or value is None:
+        return
+
+    _, how = METRICS[name]
+    with _lock:
+        metrics[name] = COMBINE[how](metrics[name], value) if name in metrics else value
+
+
+@contextmanager
+def span(metrics, name):
+    """
+    Time the with block into metrics[name].
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(metrics, name, time.perf_counter() - started)
+
+
+class ReplyBytes(monitoring.CommandListener):
+    """
+    Adds the BSON size of every cursor reply to the received bytes.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name in CURSOR_COMMANDS:
+            size = len(bson.encode(event.reply))
+            with _lock:
+                _received['bytes'] += size
+
+    def failed(self, event):
+        pass
+
+
+def listeners():
+    """
+    The command listeners a MongoClient needs for bytes_received.
+    """
+    return [ReplyBytes()] if count_bytes else []
+
+
+def received_bytes():
+    """
+    Cursor bytes received by this container so far, diff two calls for an invocation's. None when
+    METRICS_BYTES is off and nothing is counted.
+    """
+    return _received['bytes'] if count_bytes else None
+
+
+def start_memory():
+    """
+    Restart the tracemalloc peak for a new invocation when METRICS_TRACEMALLOC is on.
+    """
+    if not trace_memory:
+        return
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+
+
+def record_memory(metrics):
+    """
+    Peak RSS of the container (ru_maxrss is in KiB on Linux) and, when traced, the python heap peak.
+    ru_maxrss never resets, so container_peak_rss is the peak of every invocation the container
+    has served so far, not this one's: only a cold invocation reports its own.
+    """
+    record(metrics, 'container_peak_rss', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    if tracemalloc.is_tracing():
+        record(metrics, 'peak_traced', tracemalloc.get_traced_memory()[1] / (1024 * 1024))
+
+
+def record_rates(metrics):
+    """
+    Documents read per second of cursor draining and written per second of inserting.
+    """
+    if metrics.get('drain'):
+        record(metrics, 'read_rate', metrics.get('docs_read', 0) / metrics['drain'])
+    if metrics.get('insert'):
+        record(metrics, 'write_rate', metrics.get('docs_written', 0) / metrics['insert'])
+
+
+def emf_record(metrics, dimensions, properties=None):
+    """
+    The Embedded Metric Format document of metrics, dimensions ({name: value}) split them into
+    separate series, properties are logged alongside without becoming metrics.
+    """
+    names = [name for name in METRICS if name in metrics]
+    return {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': METRICS[name][0]} for name in names],
+            }],
+        },
+        **dimensions,
+        **(properties or {}),
+        **{name: metrics[name] for name in names},
+    }
+
+
+def emit(metrics, dimensions, **properties):
+    print(json.dumps(emf_record(metrics, dimensions, properties), default=str))
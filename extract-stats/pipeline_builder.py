@@ -0,0 +1,328 @@
+from elo_bins import ELO_BINS, ELO_BIN_EDGES, ELO_BIN_LABELS
+from major_gods import god_name_expr
+
+
+# composable civs stats pipeline -------------------------------------------
+# Builds the minimal pipeline producing the same documents as civ_stats_pipeline:
+#   match   -> 1v1 matches of the range
+#   reshape -> one $project: matchDay, matchDuration, map_name and a `rows` array holding one
+#              {civ, opp, opp_name, win, elo_bin} entry per player
+#   unwind  -> one document per player row
+#   filter  -> drop mirror matches and opponents that are not major gods
+#   group   -> keyed $group stages, see group_stages
+#   gods    -> name each civ with the inlined major_gods map
+#   output  -> final document shape
+# Stages are exposed on their own so other pipelines and the benchmarks can reuse them.
+
+# elo bins above the first are all ELO_BIN_WIDTH wide, so the bin index is arithmetic
+ELO_BIN_WIDTH = ELO_BIN_EDGES[1] - ELO_BIN_EDGES[0]
+ELO_BIN_OFFSET = ELO_BIN_EDGES[0] - ELO_BIN_WIDTH
+
+
+def match_stage(start_date, end_date, game_mode='1V1_SUPREMACY'):
+    return {
+        '$match': {
+            'gameMode': game_mode,
+            'matchDate': {
+                '$gte': start_date,
+                '$lt': end_date
+            }
+        }
+    }
+
+
+def elo_bin_expr(avg_elo):
+    """
+    Index into ELO_BINS of an average elo: floor((avg_elo - 501) / 250) clamped to [0, 5]. A null
+    average lands in bin 0 since $max ignores nulls, same as the $switch chain's $lt against null.
+    """
+    return {
+        '$min': [
+            len(ELO_BINS) - 1,
+            {
+                '$max': [
+                    0,
+                    {'$toInt': {'$floor': {'$divide': [{'$subtract': [avg_elo, ELO_BIN_OFFSET]}, ELO_BIN_WIDTH]}}}
+                ]
+            }
+        ]
+    }
+
+
+def player_rows_expr(players, opponents, god_names):
+    """
+    One row per member of players, facing the first civ of opponents.
+    """
+    return {
+        '$map': {
+            'input': players,
+            'as': 'member',
+            'in': {
+                'civ': '$$member.civilization_id',
+                'opp': {'$arrayElemAt': [f'{opponents}.civilization_id', 0]},
+                'opp_name': god_name_expr({'$arrayElemAt': [f'{opponents}.civilization_id', 0]}, god_names),
+                'win': {'$cond': [{'$eq': ['$$member.outcome', 1]}, 1, 0]},
+                'elo_bin': '$$elo_bin'
+            }
+        }
+    }
+
+
+def reshape_stage(god_names):
+    """
+    Single $project from a match to its player rows. Only the first two players count and the
+    average elo is taken over every rating in the match, as in civ_stats_pipeline.
+    """
+    return {
+        '$project': {
+            '_id': 0,
+            'matchDay': {
+                '$dateTrunc': {
+                    'date': {'$toDate': '$matchDate'},
+                    'unit': 'day'
+                }
+            },
+            'matchDuration': 1,
+            'map_name': '$mapData.name',
+            'rows': {
+                '$let': {
+                    'vars': {
+                        'players': {'$objectToArray': '$matchHistoryMap'}
+                    },
+                    'in': {
+                        '$let': {
+                            'vars': {
+                                'player0': {'$arrayElemAt': ['$$players.v', 0]},
+                                'player1': {'$arrayElemAt': ['$$players.v', 1]},
+                                'elo_bin': elo_bin_expr({
+                                    '$avg': {
+                                        '$reduce': {
+                                            'input': '$$players.v.newrating',
+                                            'initialValue': [],
+                                            'in': {'$concatArrays': ['$$value', '$$this']}
+                                        }
+                                    }
+                                })
+                            },
+                            'in': {
+                                '$concatArrays': [
+                                    player_rows_expr('$$player0', '$$player1', god_names),
+                                    player_rows_expr('$$player1', '$$player0', god_names)
+                                ]
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+
+def unwind_stage():
+    return {'$unwind': '$rows'}
+
+
+def filter_stage():
+    """
+    Drop mirror matches and rows whose opponent is not a major god.
+    """
+    return {
+        '$match': {
+            'rows.opp_name': {'$ne': None},
+            '$expr': {'$ne': ['$rows.civ', '$rows.opp']}
+        }
+    }
+
+
+def cells_to_object(cell_type):
+    """
+    {name: {totalResults, totalWins}} built from the cells of one type ("opp" or "map"). Cells
+    without a name (matches without mapData) are left out, like the numpy engine leaves them out
+    of its map counts.
+    """
+    return {
+        '$arrayToObject': {
+            '$map': {
+                'input': {
+                    '$filter': {
+                        'input': '$cells',
+                        'as': 'cell',
+                        'cond': {
+                            '$and': [
+                                {'$eq': ['$$cell.t', cell_type]},
+                                {'$ne': [{'$ifNull': ['$$cell.k', None]}, None]}
+                            ]
+                        }
+                    }
+                },
+                'as': 'item',
+                'in': {
+                    'k': {'$toString': '$$item.k'},
+                    'v': {
+                        'totalResults': '$$item.totalResults',
+                        'totalWins': '$$item.totalWins'
+                    }
+                }
+            }
+        }
+    }
+
+
+def group_stages(civ, elo_bin, opp, map_name, win, day='$matchDay', duration='$matchDuration'):
+    """
+    Keyed $group stages from player rows to one document per (civ_id, elo_bin, matchDay) key, with
+    totals, duration sum + count and the key's matchup and map `cells`. Arguments are the
+    expressions of each row's fields.
+
+    Rows are first grouped per (key, opponent, map). Each of those groups is emitted once as a
+    matchup cell and once as a map cell, the cells are summed per (key, type, name) and finally
+    collected per key. Every stage only touches the groups of one key, so the work is linear in
+    the number of groups and no document holds more than one key's cells.
+    """
+    is_opp = {'$eq': ['$_id.t', 'opp']}
+
+    return [
+        {
+            '$group': {
+                '_id': {
+                    'civ_id': civ,
+                    'elo_bin': elo_bin,
+                    'matchDay': day,
+                    'opp': opp,
+                    'map_name': map_name
+                },
+                'totalResults': {'$sum': 1},
+                'totalWins': {'$sum': win},
+                'durationSum': {'$sum': duration},
+                'durationCount': {'$sum': {'$cond': [{'$isNumber': duration}, 1, 0]}}
+            }
+        }, {
+            '$project': {
+                '_id': 0,
+                'key': {
+                    'civ_id': '$_id.civ_id',
+                    'elo_bin': '$_id.elo_bin',
+                    'matchDay': '$_id.matchDay'
+                },
+                'cells': [
+                    {'t': 'opp', 'k': '$_id.opp'},
+                    {'t': 'map', 'k': '$_id.map_name'}
+                ],
+                'totalResults': 1,
+                'totalWins': 1,
+                'durationSum': 1,
+                'durationCount': 1
+            }
+        }, {
+            '$unwind': '$cells'
+        }, {
+            '$group': {
+                '_id': {
+                    'key': '$key',
+                    't': '$cells.t',
+                    'k': '$cells.k'
+                },
+                'totalResults': {'$sum': '$totalResults'},
+                'totalWins': {'$sum': '$totalWins'},
+                'durationSum': {'$sum': '$durationSum'},
+                'durationCount': {'$sum': '$durationCount'}
+            }
+        }, {
+            # every player row is in exactly one "opp" cell, so the key's totals come from those
+            '$group': {
+                '_id': '$_id.key',
+                'totalResults': {'$sum': {'$cond': [is_opp, '$totalResults', 0]}},
+                'totalWins': {'$sum': {'$cond': [is_opp, '$totalWins', 0]}},
+                'durationSum': {'$sum': {'$cond': [is_opp, '$durationSum', 0]}},
+                'durationCount': {'$sum': {'$cond': [is_opp, '$durationCount', 0]}},
+                'cells': {
+                    '$push': {
+                        't': '$_id.t',
+                        'k': '$_id.k',
+                        'totalResults': '$totalResults',
+                        'totalWins': '$totalWins'
+                    }
+                }
+            }
+        }
+    ]
+
+
+def god_name_stages(god_names):
+    """
+    Name each key's civ as _id.god_name from the inlined major_gods map, dropping civs that are
+    not major gods.
+    """
+    return [
+        {
+            '$addFields': {
+                '_id.god_name': god_name_expr('$_id.civ_id', god_names)
+            }
+        }, {
+            '$match': {
+                '_id.god_name': {'$ne': None}
+            }
+        }
+    ]
+
+
+def output_stage(elo_bin_index='$_id.elo_bin'):
+    """
+    Final daily stats document shape. elo_bin_index is the expression of the key's index into
+    ELO_BINS, the label and bounds are looked up from it.
+    """
+    def elo_bin_field(values):
+        return {'$arrayElemAt': [values, elo_bin_index]}
+
+    return {
+        '$replaceRoot': {
+            'newRoot': {
+                'matchDay': '$_id.matchDay',
+                'totalResults': '$totalResults',
+                'totalWins': '$totalWins',
+                'durationSum': '$durationSum',
+                'durationCount': '$durationCount',
+                'avgDurationMins': {
+                    '$cond': [
+                        {'$gt': ['$durationCount', 0]},
+                        {'$divide': [{'$divide': ['$durationSum', '$durationCount']}, 60]},
+                        None
+                    ]
+                },
+                'matchups': cells_to_object('opp'),
+                'maps': cells_to_object('map'),
+                'metaField': {
+                    'civ_id': '$_id.civ_id',
+                    'elo_bin': elo_bin_field(ELO_BIN_LABELS),
+                    'god_name': '$_id.god_name',
+                    'lower_elo': elo_bin_field([lower for _, lower, _ in ELO_BINS]),
+                    'upper_elo': elo_bin_field([upper for _, _, upper in ELO_BINS])
+                }
+            }
+        }
+    }
+
+
+def build_stages(start_date, end_date, god_names, game_mode='1V1_SUPREMACY'):
+    """
+    The minimal stats pipeline as a list of (name, stages) steps, for timing it step by step.
+    """
+    return [
+        ('match', [match_stage(start_date, end_date, game_mode)]),
+        ('reshape', [reshape_stage(god_names)]),
+        ('unwind', [unwind_stage()]),
+        ('filter', [filter_stage()]),
+        ('group', group_stages(
+            civ='$rows.civ', elo_bin='$rows.elo_bin', opp='$rows.opp_name', map_name='$map_name', win='$rows.win'
+        )),
+        ('gods', god_name_stages(god_names)),
+        ('output', [output_stage()]),
+    ]
+
+
+def build_pipeline(start_date, end_date, god_names, game_mode='1V1_SUPREMACY'):
+    """
+    Minimal pipeline producing the same documents as civ_stats_pipeline for matches in
+    [start_date, end_date) (ms since epoch). god_names is the {id: name} major_gods map.
+    """
+    return [stage for _, stages in build_stages(start_date, end_date, god_names, game_mode) for stage in stages]
@@ -0,0 +1,252 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone, UTC
+
+from bson import ObjectId
+
+from connection import get_collection
+from major_gods import god_name_expr
+from pipeline_builder import match_stage, elo_bin_expr, group_stages, god_name_stages, output_stage
+
+
+# flattened player results -------------------------------------------
+# Most of every stats pipeline reshapes matchHistoryMap: $objectToArray, flattening the ratings
+# for the average elo, pairing each player with the other one's civ, $unwind and dropping mirror
+# matches. player_results holds the result of that reshaping, written once per match:
+# {
+#     "_id": {"match": <matches _id>, "side": 0, "member": 0},   # side = index of the player in
+#                                                                 # matchHistoryMap, member = index in its list
+#     "day": <date>,                                 # matchDay, midnight UTC
+#     "civ": 1, "opp": 4,                            # civilization ids, never equal
+#     "win": 1,
+#     "elo": 2,                                      # index into ELO_BINS of the match's average elo
+#     "map": "Acropolis",                            # missing without mapData
+#     "dur": 1234,                                   # matchDuration, missing when unknown
+# }
+# The "flat" stats pipeline is then an indexed $match on day plus the keyed $group stages. Rows of
+# civs that are not major gods are kept, so a new major god only changes the stats pipeline.
+#
+# Every match is flattened once: backfill fills a date range, then sync_results flattens only the
+# matches inserted since the last sync (by _id, like the hourly incremental run), from the hourly
+# and nightly runs of the "flat" pipeline. The last flattened _id is kept in the watermarks:
+# {"_id": {"target": "player_results", "kind": "flatten"}, "lastMatchId": <ObjectId>, ...}
+
+player_results_str = os.getenv("PLAYER_RESULTS_STR", "player_results")
+# also re-flatten each partition's whole date range before its "flat" stats run, a full reshape
+# per partition, only for a player_results that was never backfilled
+sync_player_results = os.getenv("PLAYER_RESULTS_SYNC", "false").lower() == "true"
+# matches younger than this are left to the next sync, an _id is taken before its insert commits
+settle_secs = int(os.getenv("INCREMENTAL_SETTLE_SECS", "60"))
+
+RESULTS_INDEX = [('day', 1), ('civ', 1)]
+
+
+def side_rows_expr(players, opponents, side):
+    """
+    One row per member of players, facing the first civ of opponents. Expects the match's elo bin
+    index in $$elo_bin.
+    """
+    return {
+        '$map': {
+            'input': {'$range': [0, {'$size': {'$ifNull': [players, []]}}]},
+            'as': 'index',
+            'in': {
+                '$let': {
+                    'vars': {'member': {'$arrayElemAt': [players, '$$index']}},
+                    'in': {
+                        'side': side,
+                        'member': '$$index',
+                        'civ': '$$member.civilization_id',
+                        'opp': {'$arrayElemAt': [f'{opponents}.civilization_id', 0]},
+                        'win': {'$cond': [{'$eq': ['$$member.outcome', 1]}, 1, 0]},
+                        'elo': '$$elo_bin'
+                    }
+                }
+            }
+        }
+    }
+
+
+def flatten_pipeline(start_date, end_date, into=player_results_str, game_mode='1V1_SUPREMACY', match=None):
+    """
+    Flatten the matches in [start_date, end_date) (ms since epoch), or the ones of a $match stage,
+    into the player_results collection named into. Rows that already exist are kept, so re-running
+    a range only adds the matches inserted since.
+    """
+    return [
+        match or match_stage(start_date, end_date, game_mode),
+        {
+            '$project': {
+                'day': {
+                    '$dateTrunc': {
+                        'date': {'$toDate': '$matchDate'},
+                        'unit': 'day'
+                    }
+                },
+                'dur': '$matchDuration',
+                'map': '$mapData.name',
+                'rows': {
+                    '$let': {
+                        'vars': {
+                            'players': {'$objectToArray': '$matchHistoryMap'}
+                        },
+                        'in': {
+                            '$let': {
+                                'vars': {
+                                    'player0': {'$arrayElemAt': ['$$players.v', 0]},
+                                    'player1': {'$arrayElemAt': ['$$players.v', 1]},
+                                    'elo_bin': elo_bin_expr({
+                                        '$avg': {
+                                            '$reduce': {
+                                                'input': '$$players.v.newrating',
+                                                'initialValue': [],
+                                                'in': {'$concatArrays': ['$$value', '$$this']}
+                                            }
+                                        }
+                                    })
+                                },
+                                'in': {
+                                    '$concatArrays': [
+                                        side_rows_expr('$$player0', '$$player1', 0),
+                                        side_rows_expr('$$player1', '$$player0', 1)
+                                    ]
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }, {
+            '$unwind': '$rows'
+        }, {
+            '$match': {
+                'rows.opp': {'$ne': None},
+                '$expr': {'$ne': ['$rows.civ', '$rows.opp']}
+            }
+        }, {
+            '$project': {
+                '_id': {'match': '$_id', 'side': '$rows.side', 'member': '$rows.member'},
+                'day': 1,
+                'civ': '$rows.civ',
+                'opp': '$rows.opp',
+                'win': '$rows.win',
+                'elo': '$rows.elo',
+                'map': 1,
+                'dur': 1
+            }
+        }, {
+            '$merge': {
+                'into': into,
+                'on': '_id',
+                'whenMatched': 'keepExisting',
+                'whenNotMatched': 'insert'
+            }
+        }
+    ]
+
+
+def flatten_matches(matches, results, start_date, end_date):
+    """
+    Bring results up to date with the matches of [start_date, end_date) (midnight UTC datetimes).
+    """
+    started = time.perf_counter()
+    results.create_index(RESULTS_INDEX)
+    matches.aggregate(
+        flatten_pipeline(start_date.timestamp() * 1000, end_date.timestamp() * 1000, into=results.name)
+    )
+    elapsed = time.perf_counter() - started
+    print(f"Flattened {start_date:%m/%d/%Y} - {end_date:%m/%d/%Y} into {results.name} in {elapsed:.2f}s")
+
+
+def sync_id(results_name):
+    return {'target': results_name, 'kind': 'flatten'}
+
+
+def last_synced_id(watermarks, results_name):
+    state = watermarks.find_one({'_id': sync_id(results_name)})
+    return state['lastMatchId'] if state else None
+
+
+def save_synced_id(watermarks, results_name, match_id):
+    watermarks.update_one(
+        {'_id': sync_id(results_name)},
+        {'$set': {'target': results_name, 'lastMatchId': match_id, 'updatedAt': datetime.now(UTC)}},
+        upsert=True,
+    )
+
+
+def sync_results(matches, results, watermarks, game_mode='1V1_SUPREMACY'):
+    """
+    Flatten the matches inserted since the last sync into results. Raises ValueError before a
+    backfill recorded where to start, the "flat" stats of an empty results collection would be
+    watermarked as complete.
+    """
+    after_id = last_synced_id(watermarks, results.name)
+    if after_id is None:
+        raise ValueError(f"{results.name} was never backfilled, run player_results.py over the history first")
+
+    until_id = ObjectId.from_datetime(datetime.now(UTC) - timedelta(seconds=settle_secs))
+    if until_id > after_id:
+        started = time.perf_counter()
+        results.create_index(RESULTS_INDEX)
+        match = {'$match': {'gameMode': game_mode, '_id': {'$gt': after_id, '$lte': until_id}}}
+        matches.aggregate(flatten_pipeline(0, 0, into=results.name, match=match))
+        save_synced_id(watermarks, results.name, until_id)
+        elapsed = time.perf_counter() - started
+        print(f"Synced the matches inserted since {after_id.generation_time:%m/%d/%Y %H:%M} into {results.name} in {elapsed:.2f}s")
+
+
+def results_pipeline(start_date, end_date, god_names):
+    """
+    Same documents as civ_stats_pipeline for [start_date, end_date) (ms since epoch), read from
+    player_results instead of matches.
+    """
+    god_ids = sorted(god_names)
+    return [
+        {
+            '$match': {
+                'day': {
+                    '$gte': datetime.fromtimestamp(start_date / 1000, timezone.utc),
+                    '$lt': datetime.fromtimestamp(end_date / 1000, timezone.utc)
+                },
+                'civ': {'$in': god_ids},
+                'opp': {'$in': god_ids}
+            }
+        },
+        *group_stages(
+            civ='$civ', elo_bin='$elo', opp=god_name_expr('$opp', god_names), map_name='$map', win='$win',
+            day='$day', duration='$dur'
+        ),
+        *god_name_stages(god_names),
+        output_stage(),
+    ]
+
+
+def backfill(start_date, end_date, chunk_days=7):
+    """
+    Flatten every match of [start_date, end_date) chunk_days at a time, each chunk is one $merge.
+    The first backfill also starts the sync state at end_date (now when it is later), sync_results
+    then flattens every match inserted after it. Matches of the range inserted after end_date are
+    flattened again by the sync, the $merge keeps the rows it already has.
+    """
+    matches = get_collection('matches')
+    results = get_collection(player_results_str)
+    watermarks = get_collection(os.getenv("WATERMARK_STR", "stats_watermarks"))
+    if last_synced_id(watermarks, results.name) is None:
+        save_synced_id(watermarks, results.name, ObjectId.from_datetime(min(end_date, datetime.now(UTC))))
+
+    chunk_start = start_date
+    while chunk_start < end_date:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days), end_date)
+        flatten_matches(matches, results, chunk_start, chunk_end)
+        chunk_start = chunk_end
+
+
+# backfill from the command line, same MONGO_* env vars as the Lambda:
+#   python player_results.py 08/26/2024 09/17/2024 [chunk_days]
+if __name__ == "__main__":
+    backfill(
+        *(datetime.strptime(day, '%m/%d/%Y').replace(tzinfo=timezone.utc) for day in sys.argv[1:3]),
+        *map(int, sys.argv[3:4]),
+    )
@@ -0,0 +1,112 @@
+import json
+
+
+# the initial $match of every stats pipeline filters on these
+MATCH_INDEX = [('gameMode', 1), ('matchDate', 1)]
+
+
+def explain_aggregate(collection, pipeline):
+    """
+    Run pipeline against collection with explain executionStats and return the raw explain output.
+    NOTE: executionStats really executes the query, so this costs as much as the aggregation.
+    """
+    return collection.database.command(
+        'explain',
+        {'aggregate': collection.name, 'pipeline': pipeline, 'cursor': {}},
+        verbosity='executionStats',
+    )
+
+
+def plan_stages(plan):
+    """
+    Flatten a (winning) query plan tree into its stage names, leaf first,
+    ie ['IXSCAN gameMode_1_matchDate_1', 'FETCH', 'PROJECTION_DEFAULT'].
+    """
+    if not plan:
+        return []
+
+    # slot based engine plans wrap the classic tree in queryPlan
+    if 'queryPlan' in plan:
+        return plan_stages(plan['queryPlan'])
+
+    children = []
+    if 'inputStage' in plan:
+        children.append(plan['inputStage'])
+    children += plan.get('inputStages', [])
+
+    stages = [stage for child in children for stage in plan_stages(child)]
+    name = plan.get('stage', '?')
+    if plan.get('indexName'):
+        name = f"{name} {plan['indexName']}"
+
+    return stages + [name]
+
+
+def summarize_explain(explain):
+    """
+    Boil an aggregate explain down to what we chart: keys and docs examined, the winning plan,
+    whether it scans the whole collection, the time of every pipeline stage and disk spills.
+    """
+    stages = explain.get('stages') or []
+
+    # the query part is either the first $cursor stage or, when fully pushed down, the top level
+    if stages and '$cursor' in stages[0]:
+        query = stages[0]['$cursor']
+        previous_millis = stages[0].get('executionTimeMillisEstimate', 0)
+        stages = stages[1:]
+    else:
+        query = explain
+        previous_millis = 0
+
+    planner = query.get('queryPlanner', {})
+    execution = query.get('executionStats', {})
+    winning_plan = plan_stages(planner.get('winningPlan'))
+
+    # stage time estimates are cumulative, each stage's own time is the difference to the previous
+    stage_stats = []
+    for stage in stages:
+        name = next((key for key in stage if key.startswith('$')), '?')
+        millis = stage.get('executionTimeMillisEstimate', previous_millis)
+        stage_stats.append({
+            'stage': name,
+            'nReturned': stage.get('nReturned'),
+            'millis': millis - previous_millis,
+            'usedDisk': stage.get('usedDisk', False) or bool(stage.get('spills')),
+            'spilledBytes': stage.get('spilledBytes', 0),
+        })
+        previous_millis = millis
+
+    return {
+        'namespace': planner.get('namespace'),
+        'keysExamined': execution.get('totalKeysExamined'),
+        'docsExamined': execution.get('totalDocsExamined'),
+        'nReturned': execution.get('nReturned'),
+        'executionTimeMillis': execution.get('executionTimeMillis'),
+        'winningPlan': winning_plan,
+        'collscan': any(stage.startswith('COLLSCAN') for stage in winning_plan),
+        'stages': stage_stats,
+        'usedDisk': any(stage['usedDisk'] for stage in stage_stats),
+    }
+
+
+def log_query_plan(collection, pipeline, create_index=False, index=MATCH_INDEX, **fields):
+    """
+    Explain pipeline, print the summary as a single JSON log line (plus any extra fields) and
+    check the initial $match is served by an index. On a COLLSCAN it warns, or creates index (the
+    one the $match of collection needs, MATCH_INDEX for matches) when create_index is set. Returns
+    the summary.
+    """
+    summary = summarize_explain(explain_aggregate(collection, pipeline))
+    print(json.dumps({'event': 'stats_query_plan', **fields, **summary}, default=str))
+
+    if summary['collscan']:
+        if create_index:
+            name = collection.create_index(index)
+            print(f"WARNING: stats $match scanned all of {collection.name}, created index {name}")
+        else:
+            print(
+                f"WARNING: stats $match scanned all of {collection.name}, "
+                f"no index on {[key for key, _ in index]}"
+            )
+
+    return summary
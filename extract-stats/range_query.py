@@ -0,0 +1,311 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from compact_schema import schema_tables_str, load_tables, decode_doc
+from elo_bins import ELO_BIN_LABELS
+from incremental import state_id
+from rollups import increments
+from win_rates import annotate
+
+
+# date range queries from prefix sums -------------------------------------------
+# The daily stats documents of a target are loaded once per warm container into cumulative arrays,
+# row d holding the sums of every day before first_day + d:
+#   totalResults, totalWins, durationSum, durationCount   shaped (days + 1, civs, elo bins)
+#   matchups.totalResults, matchups.totalWins             shaped (days + 1, civs, elo bins, gods)
+#   maps.totalResults, maps.totalWins                     shaped (days + 1, civs, elo bins, maps)
+# so the stats of any [start, end) window are row end - row start, whatever the window length.
+# New days are appended as create_daily_stats writes them, recomputed days drop the cache and the
+# next query reloads it.
+# Other containers (and hourly $inc runs) write the target too, so every query first reads the
+# target's watermark version (the latest completedAt plus the incremental state's updatedAt, two
+# small lookups) and reloads when it moved. RANGE_CACHE_TTL_SECS bounds the age of a cache whose
+# version can't be checked, RANGE_CACHE_TARGETS the number of cached targets.
+# Documents are streamed straight into the day arrays, only the fields the sums need are read and
+# none of them is kept, so a load costs the arrays and one cursor batch whatever the history length.
+# Compact (schema 2) targets are decoded back into version 1 documents one at a time on the way.
+
+range_cache_ttl_secs = int(os.getenv("RANGE_CACHE_TTL_SECS", "3600"))
+range_cache_targets = int(os.getenv("RANGE_CACHE_TARGETS", "4"))
+
+EPOCH = datetime(1970, 1, 1)
+
+FIELDS = ('totalResults', 'totalWins', 'durationSum', 'durationCount')
+COUNT_FIELDS = ('totalResults', 'totalWins')
+GROUPS = ('matchups', 'maps')
+PROJECTION = {
+    '_id': 0, 'matchDay': 1, 'metaField.civ_id': 1, 'metaField.elo_bin': 1, 'totalResults': 1, 'totalWins': 1,
+    'durationSum': 1, 'durationCount': 1, 'avgDurationMins': 1, 'matchups': 1, 'maps': 1,
+}
+COMPACT_PROJECTION = {'_id': 0, 'tm': 0, 'sk': 0}
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def day_number(day):
+    return (day.replace(tzinfo=None) - EPOCH).days
+
+
+def empty_state(god_names):
+    civ_ids = sorted(god_names)
+    return {
+        'first_day': 0,
+        'days': 0,
+        'civ_ids': civ_ids,
+        'civ_index': {civ_id: index for index, civ_id in enumerate(civ_ids)},
+        'god_names': dict(god_names),
+        'names': {'matchups': sorted(set(god_names.values())), 'maps': []},
+        'sums': {},
+    }
+
+
+def widen(rows, group, size):
+    """
+    Grow the name axis of a group's day arrays to hold at least size names, doubling it.
+    """
+    for field in COUNT_FIELDS:
+        values = rows[f'{group}.{field}']
+        if values.shape[-1] < size:
+            padding = [(0, 0)] * (values.ndim - 1) + [(0, max(size, 2 * values.shape[-1]) - values.shape[-1])]
+            rows[f'{group}.{field}'] = np.pad(values, padding)
+
+
+def day_rows(state, docs, first_day, day_count):
+    """
+    Per day (not yet cumulative) arrays of docs over day_count days from first_day, adding the
+    maps state has not seen yet to its map names. docs is consumed one document at a time.
+    """
+    civ_count, bin_count = len(state['civ_ids']), len(ELO_BIN_LABELS)
+    bin_index = {label: index for index, label in enumerate(ELO_BIN_LABELS)}
+    names = state['names']
+    name_index = {group: {name: index for index, name in enumerate(names[group])} for group in GROUPS}
+
+    rows = {field: np.zeros((day_count, civ_count, bin_count)) for field in FIELDS}
+    for group in GROUPS:
+        for field in COUNT_FIELDS:
+            rows[f'{group}.{field}'] = np.zeros((day_count, civ_count, bin_count, len(names[group])))
+
+    for doc in docs:
+        row = state['civ_index'].get(doc['metaField']['civ_id'])
+        if row is None:
+            continue
+        day = day_number(doc['matchDay']) - first_day
+        elo_bin = bin_index[doc['metaField']['elo_bin']]
+
+        for field, value in increments(doc).items():
+            if field in FIELDS:
+                rows[field][day, row, elo_bin] += value
+                continue
+            group, name, count_field = field.split('.')
+            if group not in GROUPS:
+                continue
+            index = name_index[group].get(name)
+            if index is None and group == 'maps':
+                index = name_index['maps'][name] = len(names['maps'])
+                names['maps'].append(name)
+                widen(rows, 'maps', len(names['maps']))
+            if index is not None:
+                rows[f'{group}.{count_field}'][day, row, elo_bin, index] += value
+
+    for field in COUNT_FIELDS:
+        rows[f'maps.{field}'] = rows[f'maps.{field}'][..., :len(names['maps'])]
+
+    return rows
+
+
+def append_rows(state, rows, day_count):
+    """
+    Append day_count days of per day rows to the cumulative arrays of state.
+    """
+    for field, values in rows.items():
+        cumulative = state['sums'].get(field)
+        if cumulative is None:
+            cumulative = np.zeros((1,) + values.shape[1:])
+        elif cumulative.shape[1:] != values.shape[1:]:
+            # new maps widen the last axis, days before them played it 0 times
+            padding = [(0, 0)] * (values.ndim - 1) + [(0, values.shape[-1] - cumulative.shape[-1])]
+            cumulative = np.pad(cumulative, padding)
+
+        state['sums'][field] = np.concatenate([cumulative, cumulative[-1] + np.cumsum(values, axis=0)])
+
+    state['days'] += day_count
+
+
+def read_days(target, start_date=None, end_date=None):
+    """
+    Cursor of the PROJECTION fields of target's documents in [start_date, end_date), decoded
+    from the compact schema when target has id tables.
+    """
+    match_day = {}
+    if start_date is not None:
+        match_day['$gte'] = start_date
+    if end_date is not None:
+        match_day['$lt'] = end_date
+    query = {'matchDay': match_day} if match_day else {}
+
+    tables = load_tables(target.database[schema_tables_str], target.name)
+    if tables is None:
+        return target.find(query, PROJECTION)
+
+    return (decode_doc(doc, tables) for doc in target.find(query, COMPACT_PROJECTION))
+
+
+def day_bounds(target):
+    """
+    (first, last) day numbers of target's documents, None for an empty target.
+    """
+    first = target.find_one({}, {'_id': 0, 'matchDay': 1}, sort=[('matchDay', 1)])
+    last = target.find_one({}, {'_id': 0, 'matchDay': 1}, sort=[('matchDay', -1)])
+    if first is None or last is None:
+        return None
+
+    return day_number(first['matchDay']), day_number(last['matchDay'])
+
+
+def load(target, god_names):
+    """
+    Build the prefix sums of every daily stats document of target.
+    """
+    state = empty_state(god_names)
+    bounds = day_bounds(target)
+    if bounds is None:
+        return state
+
+    state['first_day'] = bounds[0]
+    day_count = bounds[1] - bounds[0] + 1
+    append_rows(state, day_rows(state, read_days(target), state['first_day'], day_count), day_count)
+
+    return state
+
+
+def stats_version(watermarks, target_name):
+    """
+    What changes whenever target_name's documents do: the latest completedAt of its watermarks
+    and the updatedAt of its incremental state. None without a watermarks collection.
+    """
+    if watermarks is None:
+        return None
+
+    latest = watermarks.find_one(
+        {'target': target_name, 'completedAt': {'$exists': True}}, {'completedAt': 1}, sort=[('completedAt', -1)]
+    )
+    incremental = watermarks.find_one({'_id': state_id(target_name)}, {'updatedAt': 1})
+    return (latest or {}).get('completedAt'), (incremental or {}).get('updatedAt')
+
+
+def cached_state(target, god_names, watermarks=None):
+    """
+    The warm prefix sums of target, loaded on first use, when the major gods changed, when the
+    target's watermark version moved since the load or once it is older than the TTL.
+    """
+    version = stats_version(watermarks, target.name)
+    with _lock:
+        state = _cache.get(target.name)
+        if (
+            state is None
+            or state['god_names'] != god_names
+            or (watermarks is not None and state['version'] != version)
+            or time.monotonic() - state['loaded'] > range_cache_ttl_secs
+        ):
+            state = _cache[target.name] = load(target, god_names)
+            state['version'] = version
+            state['loaded'] = time.monotonic()
+
+        _cache.move_to_end(target.name)
+        while len(_cache) > range_cache_targets:
+            _cache.popitem(last=False)
+
+        return state
+
+
+def update_cache(target, days, god_names, watermarks=None):
+    """
+    Append days (midnight UTC) just written to target to its warm prefix sums. Days inside the
+    cached range were recomputed, they drop the cache instead. A no-op while target was never
+    queried in this container. With watermarks the cache takes the target's new version, the
+    days it appended are what moved it.
+    """
+    version = stats_version(watermarks, target.name) if target.name in _cache else None
+    with _lock:
+        state = _cache.get(target.name)
+        if state is None or not days:
+            return
+
+        numbers = sorted({day_number(day) for day in days})
+        # an empty target has no first day yet, reload it like a recomputed one
+        start = state['first_day'] + state['days']
+        if not state['days'] or state['god_names'] != god_names or numbers[0] < start:
+            del _cache[target.name]
+            return
+
+        day_count = numbers[-1] - start + 1
+        docs = read_days(target, EPOCH + timedelta(days=start), EPOCH + timedelta(days=numbers[-1] + 1))
+        append_rows(state, day_rows(state, docs, start, day_count), day_count)
+        if watermarks is not None:
+            state['version'] = version
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+def range_stats(target, civ, start_date, end_date, god_names, elo_bin=None, watermarks=None):
+    """
+    Stats of civ (civ id or god name) over the days in [start_date, end_date), in one elo bin or
+    summed over all of them, shaped like a daily stats document: totals, durations, the win rate
+    fields of win_rates.py and the matchups / maps the civ played, with theirs. Costs two rows of
+    the prefix sums whatever the window length. With the watermarks collection the cache is
+    checked against the target's watermark version first.
+    """
+    state = cached_state(target, god_names, watermarks)
+    civ_id = civ if civ in state['civ_index'] else next(
+        (civ_id for civ_id, name in god_names.items() if name == civ), None
+    )
+    if civ_id is None:
+        raise ValueError(f"Unknown civ {civ!r}, expected a major god id or name")
+
+    result = {
+        'civ_id': civ_id,
+        'god_name': god_names[civ_id],
+        'elo_bin': elo_bin,
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+
+    # rows of the window's bounds, clamped to the loaded days
+    low, high = (
+        min(max(day_number(day) - state['first_day'], 0), state['days']) for day in (start_date, end_date)
+    )
+    high = max(high, low)
+    row = state['civ_index'][civ_id]
+
+    def window(field):
+        sums = state['sums'][field]
+        values = sums[high, row] - sums[low, row]
+        return values[ELO_BIN_LABELS.index(elo_bin)] if elo_bin is not None else values.sum(axis=0)
+
+    for field in FIELDS:
+        result[field] = window(field).item()
+    for field in COUNT_FIELDS + ('durationCount',):
+        result[field] = int(result[field])
+    result['avgDurationMins'] = (
+        result['durationSum'] / result['durationCount'] / 60 if result['durationCount'] else None
+    )
+
+    for group in GROUPS:
+        totals, wins = (window(f'{group}.{field}').tolist() for field in COUNT_FIELDS)
+        result[group] = {
+            name: {'totalResults': int(total), 'totalWins': int(won)}
+            for name, total, won in zip(state['names'][group], totals, wins)
+            if total
+        }
+    annotate([result, *result['matchups'].values(), *result['maps'].values()])
+
+    return result
@@ -0,0 +1,223 @@
+from collections import defaultdict
+from datetime import timedelta, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+# weekly / monthly / all time rollups -------------------------------------------
+# Rollups are merged from the daily stats documents, never from raw matches. One document per
+# (period, periodStart, civ_id, elo_bin):
+# {
+#     "_id": {"period": "week", "periodStart": <date>, "civ_id": 1, "elo_bin": "751-1000"},
+#     "period": "week",             # week (starting monday) | month | all
+#     "periodStart": <date>,        # null for "all"
+#     "periodEnd": <date>,          # exclusive, null for "all"
+#     "totalResults", "totalWins", "durationSum", "durationCount", "avgDurationMins",
+#     "matchups": {god_name: {totalResults, totalWins}},
+#     "maps": {map_name: {totalResults, totalWins}},
+#     "teammates": {god_name: {totalResults, totalWins}},   # team game mode targets only
+#     "metaField": {...},           # same as the daily documents
+#     "days": [<date>, ...],        # the matchDays merged into it
+# }
+# Every field but avgDurationMins is a plain sum, so a new day is folded in with a single $inc.
+# `days` makes that idempotent: a day already merged into a rollup is never added twice.
+
+PERIODS = ['week', 'month', 'all']
+
+# daily documents written before durationSum / durationCount existed only carry the average
+DURATION_KEYS = ('durationSum', 'durationCount')
+
+
+def period_start(period, day):
+    """
+    First day of the period holding day, None for "all".
+    """
+    day = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'all':
+        return None
+
+    raise ValueError(f"Unknown period {period!r}, expected one of {PERIODS}")
+
+
+def period_end(period, start):
+    """
+    Exclusive end of the period starting at start, None for "all".
+    """
+    if period == 'week':
+        return start + timedelta(days=7)
+    if period == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+
+    return None
+
+
+def rollup_id(period, start, meta):
+    return {'period': period, 'periodStart': start, 'civ_id': meta['civ_id'], 'elo_bin': meta['elo_bin']}
+
+
+def as_utc(day):
+    # mongo hands dates back naive, they are always UTC
+    return day if day.tzinfo else day.replace(tzinfo=timezone.utc)
+
+
+def increments(doc):
+    """
+    The sums a daily stats document adds to its rollups, as a flat {dotted field: value} dict.
+    """
+    if all(key in doc for key in DURATION_KEYS):
+        duration_sum, duration_count = doc['durationSum'], doc['durationCount']
+    elif doc.get('avgDurationMins') is not None:
+        # legacy document, assume every result had a duration
+        duration_sum, duration_count = doc['avgDurationMins'] * 60 * doc['totalResults'], doc['totalResults']
+    else:
+        duration_sum, duration_count = 0, 0
+
+    fields = {
+        'totalResults': doc['totalResults'],
+        'totalWins': doc['totalWins'],
+        'durationSum': duration_sum,
+        'durationCount': duration_count,
+    }
+    for group in ('matchups', 'maps', 'teammates'):
+        for name, counts in (doc.get(group) or {}).items():
+            fields[f'{group}.{name}.totalResults'] = counts['totalResults']
+            fields[f'{group}.{name}.totalWins'] = counts['totalWins']
+
+    return fields
+
+
+def avg_duration_expr():
+    return {
+        '$cond': [
+            {'$gt': ['$durationCount', 0]},
+            {'$divide': [{'$divide': ['$durationSum', '$durationCount']}, 60]},
+            None
+        ]
+    }
+
+
+def fold_day(target, rollups, day):
+    """
+    $inc the daily documents of day into every period's rollups, skipping rollups that already
+    hold day. Returns the number of rollup documents touched.
+    """
+    day_docs = target.find({'matchDay': {'$gte': day, '$lt': day + timedelta(days=1)}}, {'_id': 0})
+
+    operations = []
+    for doc in day_docs:
+        fields = increments(doc)
+        for period in PERIODS:
+            start = period_start(period, day)
+            operations.append(UpdateOne(
+                {'_id': rollup_id(period, start, doc['metaField']), 'days': {'$ne': day}},
+                {
+                    '$inc': fields,
+                    '$addToSet': {'days': day},
+                    '$setOnInsert': {
+                        'period': period,
+                        'periodStart': start,
+                        'periodEnd': period_end(period, start) if start else None,
+                        'metaField': doc['metaField'],
+                    },
+                },
+                upsert=True,
+            ))
+
+    if not operations:
+        return 0
+
+    try:
+        result = rollups.bulk_write(operations, ordered=False)
+        return result.modified_count + result.upserted_count
+    except BulkWriteError as error:
+        # the rollup exists and already holds day, so the upsert collides with it: nothing to do
+        if any(write_error['code'] != 11000 for write_error in error.details['writeErrors']):
+            raise
+        return error.details['nModified'] + error.details['nUpserted']
+
+
+def rebuild_period(target, rollups, period, start):
+    """
+    Recompute every rollup of one period from scratch out of the daily documents, for days whose
+    daily documents were rewritten after they had been folded in.
+    """
+    if start is None:
+        query = {}
+    else:
+        query = {'matchDay': {'$gte': start, '$lt': period_end(period, start)}}
+
+    sums = defaultdict(lambda: defaultdict(int))
+    metas = {}
+    days = defaultdict(set)
+    for doc in target.find(query, {'_id': 0}):
+        meta = doc['metaField']
+        key = (meta['civ_id'], meta['elo_bin'])
+        metas[key] = meta
+        days[key].add(doc['matchDay'])
+        for field, value in increments(doc).items():
+            sums[key][field] += value
+
+    docs = []
+    for key, fields in sums.items():
+        doc = {
+            '_id': rollup_id(period, start, metas[key]),
+            'period': period,
+            'periodStart': start,
+            'periodEnd': period_end(period, start) if start else None,
+            'metaField': metas[key],
+            'days': sorted(days[key]),
+        }
+        for field, value in fields.items():
+            parent = doc
+            *path, leaf = field.split('.')
+            for part in path:
+                parent = parent.setdefault(part, {})
+            parent[leaf] = value
+        docs.append(doc)
+
+    rollups.delete_many({'_id.period': period, '_id.periodStart': start})
+    if docs:
+        rollups.insert_many(docs, ordered=False)
+
+    return len(docs)
+
+
+def update_rollups(target, rollups, days):
+    """
+    Merge the daily stats documents of days (midnight UTC datetimes) from target into the weekly,
+    monthly and all time rollups. New days are folded in with $inc, so a nightly run only reads its
+    own day. Days already folded in (ie recomputed with force or after being marked dirty) rebuild
+    their periods from the daily documents instead, which reads the whole history for "all".
+    Returns the number of rollup documents touched.
+    """
+    rollups.create_index([('days', 1)])
+    days = sorted({as_utc(day) for day in days})
+
+    # periods holding a day that is merged in already, their sums are stale
+    stale = {
+        (period, period_start(period, day))
+        for day in days
+        if rollups.find_one({'days': day}, {'_id': 1}) is not None
+        for period in PERIODS
+    }
+
+    count = 0
+    for period, start in stale:
+        count += rebuild_period(target, rollups, period, start)
+
+    touched = {(period, period_start(period, day)) for day in days for period in PERIODS}
+    for day in days:
+        count += fold_day(target, rollups, day)
+
+    for period, start in touched:
+        rollups.update_many(
+            {'_id.period': period, '_id.periodStart': start},
+            [{'$set': {'avgDurationMins': avg_duration_expr()}}],
+        )
+
+    return count
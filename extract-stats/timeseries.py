@@ -0,0 +1,87 @@
+import os
+
+
+# time series target -------------------------------------------
+# Daily stats documents already are measurements: matchDay is the time and metaField (civ, elo bin
+# and their names) never changes for a series. Stored as a MongoDB time series collection, the
+# documents of a series are packed into compressed buckets and "civ X over the last N days" reads
+# a handful of buckets instead of N documents.
+
+TIME_FIELD = 'matchDay'
+META_FIELD = 'metaField'
+
+# expire documents this many days after their matchDay, 0 keeps them forever
+ttl_days = int(os.getenv("STATS_TTL_DAYS", "0"))
+# days of one series packed into a bucket, 0 uses the "hours" granularity (buckets of up to 30 days)
+bucket_span_days = int(os.getenv("STATS_BUCKET_SPAN_DAYS", "0"))
+
+DAY_SECONDS = 24 * 60 * 60
+# arbitrary deletes (delete_many on matchDay) on time series collections, older servers only delete
+# by metaField
+DELETES_VERSION = (7, 0)
+
+
+def timeseries_options(bucket_span_days=bucket_span_days):
+    """
+    The create command's timeseries options. A custom bucket span (MongoDB 6.3+) rounds bucket
+    starts to the same span so a month of days lands in a single bucket.
+    """
+    options = {'timeField': TIME_FIELD, 'metaField': META_FIELD}
+    if bucket_span_days:
+        span = bucket_span_days * DAY_SECONDS
+        options['bucketMaxSpanSeconds'] = span
+        options['bucketRoundingSeconds'] = span
+    else:
+        options['granularity'] = 'hours'
+
+    return options
+
+
+def ensure_timeseries(db, name, ttl_days=ttl_days, bucket_span_days=bucket_span_days):
+    """
+    Create db[name] as a time series collection of daily stats if it does not exist, otherwise
+    check it is one with the right time and meta fields and bring its TTL in line with ttl_days.
+    Raises ValueError for an existing plain collection, those have to be migrated by hand (copy the
+    documents into a new time series collection and rename it).
+    """
+    expire_after = ttl_days * DAY_SECONDS if ttl_days else None
+    info = next(iter(db.list_collections(filter={'name': name})), None)
+
+    if info is None:
+        options = {'timeseries': timeseries_options(bucket_span_days)}
+        if expire_after:
+            options['expireAfterSeconds'] = expire_after
+        db.create_collection(name, **options)
+        print(f"Created time series collection {name} with {options}")
+        return db[name]
+
+    existing = info.get('options', {}).get('timeseries')
+    if info.get('type') != 'timeseries' or existing is None:
+        raise ValueError(f"{name} is a plain collection, it can't be written as a time series")
+
+    if (existing.get('timeField'), existing.get('metaField')) != (TIME_FIELD, META_FIELD):
+        raise ValueError(
+            f"{name} is a time series on {existing.get('timeField')} / {existing.get('metaField')}, "
+            f"expected {TIME_FIELD} / {META_FIELD}"
+        )
+
+    if info['options'].get('expireAfterSeconds') != expire_after:
+        db.command('collMod', name, expireAfterSeconds=expire_after or 'off')
+        print(f"Set {name} expireAfterSeconds to {expire_after or 'off'}")
+
+    return db[name]
+
+
+def supports_deletes(client):
+    """
+    True when the server deletes time series documents by matchDay, which write_mode "replace" needs.
+    """
+    return tuple(client.server_info()['versionArray'][:2]) >= DELETES_VERSION
+
+
+def bucket_key(doc):
+    """
+    Insert order that fills buckets one series at a time: by civ, elo bin, then day.
+    """
+    meta = doc[META_FIELD]
+    return (meta['civ_id'], meta['elo_bin'], doc[TIME_FIELD])
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone, UTC
+from pymongo import UpdateOne
+
+
+# ingestion watermarks -------------------------------------------
+# One small document per fully ingested (target, matchDay):
+# {
+#     "_id": {"target": "daily_stats", "matchDay": <date>},
+#     "target": "daily_stats",
+#     "matchDay": <date>,
+#     "completedAt": <date>,
+#     "dirty": False,
+# }
+# A day is complete when its watermark exists and is not dirty. Marking a day dirty makes the
+# next run recompute it.
+
+def day_range(start_date, end_date):
+    """
+    List the midnight UTC days in [start_date, end_date).
+    """
+    days = []
+    day = start_date
+    while day < end_date:
+        days.append(day)
+        day += timedelta(days=1)
+
+    return days
+
+
+def completed_days(watermarks, target_name, start_date, end_date):
+    """
+    Return the set of days in [start_date, end_date) that are fully ingested into target_name.
+    """
+    cursor = watermarks.find(
+        {
+            'target': target_name,
+            'matchDay': {'$gte': start_date, '$lt': end_date},
+            'dirty': {'$ne': True},
+        },
+        {'matchDay': 1},
+    )
+
+    # mongo hands dates back naive, they are always UTC
+    return {doc['matchDay'].replace(tzinfo=timezone.utc) for doc in cursor}
+
+
+def pending_ranges(watermarks, target_name, start_date, end_date):
+    """
+    Return the [start, end) runs of consecutive days in [start_date, end_date) that are missing or
+    dirty, ie the only days that still need to be computed.
+    """
+    return day_runs(day_range(start_date, end_date), completed_days(watermarks, target_name, start_date, end_date))
+
+
+def pending_ranges_any(watermarks, target_names, start_date, end_date):
+    """
+    Like pending_ranges for the days missing or dirty in any of target_names, ie the days a run
+    writing every target at once still has to compute.
+    """
+    done = set.intersection(*(
+        completed_days(watermarks, target_name, start_date, end_date) for target_name in target_names
+    ))
+    return day_runs(day_range(start_date, end_date), done)
+
+
+def day_runs(days, done):
+    """
+    The [start, end) runs of consecutive days of the sorted days that are not in done.
+    """
+    ranges = []
+    for day in days:
+        if day in done:
+            continue
+        if ranges and ranges[-1][1] == day:
+            ranges[-1] = (ranges[-1][0], day + timedelta(days=1))
+        else:
+            ranges.append((day, day + timedelta(days=1)))
+
+    return ranges
+
+
+def mark_complete(watermarks, target_name, start_date, end_date):
+    """
+    Record every day in [start_date, end_date) as fully ingested into target_name.
+    """
+    now = datetime.now(UTC)
+    operations = [
+        UpdateOne(
+            {'_id': {'target': target_name, 'matchDay': day}},
+            {'$set': {'target': target_name, 'matchDay': day, 'completedAt': now, 'dirty': False}},
+            upsert=True,
+        )
+        for day in day_range(start_date, end_date)
+    ]
+    if operations:
+        watermarks.bulk_write(operations, ordered=False)
+
+
+def mark_dirty(watermarks, target_name, days):
+    """
+    Flag already ingested days so the next run recomputes them.
+    """
+    watermarks.update_many(
+        {'target': target_name, 'matchDay': {'$in': list(days)}},
+        {'$set': {'dirty': True}},
+    )
+
+
+def dirty_days(watermarks, target_name):
+    """
+    Return the days of target_name flagged dirty, ie waiting to be recomputed.
+    """
+    cursor = watermarks.find({'target': target_name, 'dirty': True}, {'matchDay': 1})
+    return sorted(doc['matchDay'].replace(tzinfo=timezone.utc) for doc in cursor)
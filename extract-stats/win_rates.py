@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+
+
+# win rate intervals -------------------------------------------
+# Derived fields of a (totalWins, totalResults) pair, computed with NumPy over whole arrays of
+# cells at once (every matchup and map of a batch of documents, or a civ x civ matrix):
+#   winRate      totalWins / totalResults
+#   winLow       lower bound of the Wilson score interval at WIN_RATE_Z
+#   winHigh      upper bound
+#   winSmoothed  win rate with WIN_RATE_PRIOR pseudo games at 50%, so a 3-0 matchup reads ~0.6
+#                instead of 1.0
+#   significant  true when the interval excludes 50%
+# Cells without results have NaN rates and are never significant.
+
+win_rate_z = float(os.getenv("WIN_RATE_Z", "1.96"))
+win_rate_prior = float(os.getenv("WIN_RATE_PRIOR", "10"))
+
+WIN_RATE_FIELDS = ('winRate', 'winLow', 'winHigh', 'winSmoothed', 'significant')
+COUNT_GROUPS = ('matchups', 'maps', 'teammates')
+BATCH = 1000
+
+
+def wilson_interval(wins, totals, z=win_rate_z):
+    """
+    (low, high) arrays of the Wilson score interval of every wins / totals cell.
+    """
+    wins = np.asarray(wins, dtype=np.float64)
+    totals = np.asarray(totals, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = wins / totals
+        z2_n = z * z / totals
+        center = (rate + z2_n / 2) / (1 + z2_n)
+        half = z / (1 + z2_n) * np.sqrt(rate * (1 - rate) / totals + z2_n / totals / 4)
+
+    # rounding leaves the bounds of 0 / n and n / n a hair outside [0, 1]
+    return np.clip(center - half, 0, 1), np.clip(center + half, 0, 1)
+
+
+def smoothed_rate(wins, totals, prior=win_rate_prior):
+    """
+    Win rate of every cell with prior pseudo games split evenly between wins and losses.
+    """
+    wins = np.asarray(wins, dtype=np.float64)
+    totals = np.asarray(totals, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (wins + prior / 2) / (totals + prior)
+
+
+def win_rate_arrays(wins, totals, z=win_rate_z, prior=win_rate_prior):
+    """
+    {field: array} of every WIN_RATE_FIELDS field, shaped like wins and totals.
+    """
+    wins = np.asarray(wins, dtype=np.float64)
+    totals = np.asarray(totals, dtype=np.float64)
+    low, high = wilson_interval(wins, totals, z)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = wins / totals
+
+    return {
+        'winRate': rate,
+        'winLow': low,
+        'winHigh': high,
+        'winSmoothed': smoothed_rate(wins, totals, prior),
+        # NaN compares false, so empty cells are never significant
+        'significant': (low > 0.5) | (high < 0.5),
+    }
+
+
+def annotate(cells):
+    """
+    Add the WIN_RATE_FIELDS fields to every {totalResults, totalWins} dict of cells in place.
+    """
+    if not cells:
+        return
+
+    counts = np.array([(cell['totalWins'], cell['totalResults']) for cell in cells], dtype=np.float64)
+    arrays = win_rate_arrays(counts[:, 0], counts[:, 1])
+    columns = [
+        arrays[field].tolist() if field == 'significant' else np.round(arrays[field], 6).tolist()
+        for field in WIN_RATE_FIELDS
+    ]
+    for cell, values in zip(cells, zip(*columns)):
+        cell.update(zip(WIN_RATE_FIELDS, (None if value != value else value for value in values)))
+
+
+def with_win_rates(docs):
+    """
+    Yield daily stats documents (or rollups, range query results: anything shaped like them) with
+    the WIN_RATE_FIELDS fields on the document itself and on every matchup, map and teammate cell,
+    computed over batches of BATCH documents at a time.
+    """
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == BATCH:
+            yield from annotate_batch(batch)
+            batch = []
+    if batch:
+        yield from annotate_batch(batch)
+
+
+def annotate_batch(batch):
+    annotate(batch + [cell for doc in batch for group in COUNT_GROUPS for cell in (doc.get(group) or {}).values()])
+    return batch